@@ -0,0 +1,359 @@
+"""
+An offline benchmark suite for AgentRec. A synthetic prompt pool of a
+configurable number of agents and prompts is generated and run through every
+stage of the library, from pool operations to fitting and recommendation.
+The throughput and p50/p99 latency of each stage are written as JSON so that
+results can be compared across releases, machines and tuning options.
+
+By default prompts are encoded by `HashingEncoder`, a deterministic encoder
+which needs neither a model download nor a GPU, so the numbers measure the
+library itself rather than the encoder. A SentenceTransformer model can be benchmarked
+instead with `--model`.
+
+The cold import time of the package can be checked against a budget with
+`--check-imports`, which exits with a non-zero status if an import is over
+budget or pulls in torch, transformers or sentence-transformers.
+
+Usage:
+    python -m agentrec.bench --agents 8 --prompts 1250 --dim 768 > bench.json
+    python -m agentrec.bench --check-imports
+"""
+import numpy as np
+
+from agentrec.datasets import Agent, PromptPool
+from agentrec.models import HashingEncoder, IVFIndex, SBERTAgentRec
+from agentrec.models.scoring import top_k
+from agentrec.serve import percentile
+
+from typing import Callable, Optional
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+N_AGENTS = 8
+N_PROMPTS = 1250
+DIM = 384
+N_QUERIES = 1000
+N_LATENCY_QUERIES = 200
+REPEAT = 5
+TOPIC_WORDS = 64
+SHARED_WORDS = 2048
+IMPORT_BUDGET = 0.5
+IMPORT_TARGETS = (
+    "agentrec",
+    "agentrec.datasets",
+    "agentrec.models",
+    "agentrec.datasets:PromptPool",
+    "agentrec.models:SBERTAgentRec",
+    "agentrec.serve",
+    "agentrec.eval",
+)
+HEAVY_MODULES = ("torch", "transformers", "sentence_transformers")
+
+IMPORT_SCRIPT = """
+import importlib, json, sys, time
+module, _, name = sys.argv[1].partition(":")
+start = time.perf_counter()
+value = importlib.import_module(module)
+if name:
+    getattr(value, name)
+seconds = time.perf_counter() - start
+print(json.dumps({"seconds": seconds, "modules": sorted(sys.modules)}))
+"""
+
+def synthetic_prompts(n_agents: int, n_prompts: int, seed: int = 0):
+    """
+    Returns `n_prompts` random prompts for each of `n_agents` agents as
+    training samples. Every agent draws about half of its words from its own
+    topic vocabulary and the rest from a vocabulary shared by all agents.
+
+    Args:
+        n_agents: The number of agents.
+        n_prompts: The number of prompts per agent.
+        seed: The random seed. Defaults to `0`.
+    """
+    rng = random.Random(seed)
+    samples = []
+    for agent in range(n_agents):
+        for _ in range(n_prompts):
+            words = [
+                f"topic{agent}x{rng.randrange(TOPIC_WORDS)}" if rng.random() < 0.5
+                else f"word{rng.randrange(SHARED_WORDS)}"
+                for _ in range(rng.randint(4, 16))
+            ]
+            samples.append({
+                "agent_name": f"Agent {agent}",
+                "prompt": " ".join(words),
+            })
+
+    return samples
+
+def synthetic_pool(n_agents: int, n_prompts: int, seed: int = 0):
+    """
+    Returns a `PromptPool` holding `synthetic_prompts`.
+    """
+    pool = PromptPool()
+    pool.set([Agent(name=f"Agent {agent}") for agent in range(n_agents)])
+    pool.pool = synthetic_prompts(n_agents, n_prompts, seed)
+    return pool
+
+def measure(fn: Callable, repeat: int = REPEAT):
+    """
+    Calls `fn` `repeat` times and returns the seconds taken by each call along
+    with the result of the last call.
+    """
+    seconds = []
+    result  = None
+    for _ in range(repeat):
+        start  = time.perf_counter()
+        result = fn()
+        seconds.append(time.perf_counter() - start)
+
+    return seconds, result
+
+def summarize(stage: str, seconds: list[float], items: int):
+    """
+    Returns the JSON record of a stage which processed `items` items in each
+    of the measured calls.
+    """
+    median = percentile(seconds, 50)
+    return {
+        "stage": stage,
+        "items": items,
+        "runs": len(seconds),
+        "p50_seconds": median,
+        "p99_seconds": percentile(seconds, 99),
+        "throughput": items / median if median > 0 else float("inf"),
+    }
+
+def import_times(
+    targets: tuple[str] = IMPORT_TARGETS,
+    budget: float = IMPORT_BUDGET,
+    repeat: int = REPEAT,
+):
+    """
+    Measures the cold import time of every target in a fresh interpreter.
+    A target is a module name, optionally followed by `:` and the name of an
+    attribute to access, such as a lazily imported class.
+
+    Args:
+        targets: The targets to import. Defaults to the public modules and
+                 the main classes of the package.
+        budget: The budget in seconds which the median import time of every
+                target should stay within. Defaults to `0.5`.
+        repeat: The number of interpreters started per target. Defaults to
+                `5`.
+
+    Returns:
+        A list of dictionaries with the keys `target`, `p50_seconds`,
+        `heavy_modules` (the heavy dependencies which were imported) and
+        `ok`, which is `True` if the target is within budget and imported
+        none of `HEAVY_MODULES`.
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env  = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [root, env.get("PYTHONPATH")]))
+
+    report = []
+    for target in targets:
+        seconds = []
+        modules = []
+        for _ in range(repeat):
+            output = subprocess.run([sys.executable, "-c", IMPORT_SCRIPT, target],
+                                    env=env,
+                                    capture_output=True,
+                                    text=True,
+                                    check=True).stdout
+            result = json.loads(output)
+            seconds.append(result["seconds"])
+            modules = result["modules"]
+
+        heavy  = [module for module in HEAVY_MODULES if module in modules]
+        median = percentile(seconds, 50)
+        report.append({
+            "target": target,
+            "p50_seconds": median,
+            "heavy_modules": heavy,
+            "ok": median <= budget and len(heavy) == 0,
+        })
+
+    return report
+
+def run(
+    n_agents: int = N_AGENTS,
+    n_prompts: int = N_PROMPTS,
+    dim: int = DIM,
+    n_queries: int = N_QUERIES,
+    n_latency_queries: int = N_LATENCY_QUERIES,
+    repeat: int = REPEAT,
+    model: Optional[str] = None,
+    score_function: str = "log_pmean",
+    k: int = 1,
+    index: bool = False,
+    quantization: Optional[str] = None,
+    prototypes: Optional[int] = None,
+    seed: int = 0,
+):
+    """
+    Runs the benchmark and returns its report as a dictionary. See `main` for
+    the meaning of the arguments.
+    """
+    stages = []
+
+    seconds, pool = measure(lambda: synthetic_pool(n_agents, n_prompts, seed), repeat)
+    stages.append(summarize("pool.build", seconds, len(pool)))
+
+    seconds, _ = measure(lambda: pool.split_indices(0.2, seed=seed), repeat)
+    stages.append(summarize("pool.split", seconds, len(pool)))
+
+    # Shuffling replaces the table of a pool rather than modifying it, so a
+    # copy sharing the table leaves the benchmarked pool in its original order
+    def shuffle():
+        copy = PromptPool()
+        copy.table = pool.table
+        copy.shuffle(seed)
+
+    seconds, _ = measure(shuffle, repeat)
+    stages.append(summarize("pool.shuffle", seconds, len(pool)))
+
+    def dedup():
+        copy = PromptPool()
+        copy.agents = pool.agents
+        copy.table = pool.table.take(slice(None))
+        return copy.dedup()
+
+    seconds, _ = measure(dedup, repeat)
+    stages.append(summarize("pool.dedup", seconds, len(pool)))
+
+    encoder = model if model is not None else HashingEncoder(dim, seed=seed)
+    classifier = SBERTAgentRec(encoder,
+                               score_function=score_function,
+                               index=IVFIndex(seed=seed) if index else None,
+                               quantization=quantization)
+
+    training = pool.table
+    seconds, _ = measure(lambda: classifier.fit(training), repeat)
+    stages.append(summarize("fit", seconds, len(pool)))
+
+    if prototypes is not None:
+        seconds, _ = measure(lambda: classifier.compress(prototypes), 1)
+        stages.append(summarize("compress", seconds, len(pool)))
+
+    queries = synthetic_prompts(n_agents, max(1, n_queries // n_agents), seed + 1)
+    prompts = [query["prompt"] for query in queries]
+    truth   = np.array([[classifier.agents.index(query["agent_name"])]
+                        for query in queries])
+
+    seconds, encoded = measure(lambda: classifier.encode(prompts), repeat)
+    stages.append(summarize("encode", seconds, len(prompts)))
+
+    seconds, scores = measure(lambda: classifier._score_matrix(encoded), repeat)
+    stages.append(summarize("score", seconds, len(prompts)))
+
+    seconds, top = measure(lambda: top_k(scores, k), repeat)
+    stages.append(summarize("top_k", seconds, len(prompts)))
+
+    seconds, _ = measure(lambda: classifier.recommend_batch(prompts, k), repeat)
+    stages.append(summarize("recommend_batch", seconds, len(prompts)))
+
+    latencies = []
+    for prompt in prompts[:n_latency_queries]:
+        start = time.perf_counter()
+        classifier.get_agent(prompt)
+        latencies.append(time.perf_counter() - start)
+    stages.append({
+        **summarize("get_agent", latencies, 1),
+        "throughput": len(latencies) / sum(latencies) if latencies else 0.0,
+    })
+
+    return {
+        "config": {
+            "agents": n_agents,
+            "prompts_per_agent": n_prompts,
+            "dim": dim,
+            "queries": len(prompts),
+            "repeat": repeat,
+            "model": model if model is not None else "hash",
+            "score_function": score_function,
+            "k": k,
+            "index": index,
+            "quantization": quantization,
+            "prototypes": prototypes,
+            "seed": seed,
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+        },
+        "accuracy": float(np.mean(np.any(top == truth, axis=1))),
+        "stages": stages,
+    }
+
+def main(argv: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(description="Benchmark AgentRec offline")
+    parser.add_argument("--agents", type=int, default=N_AGENTS)
+    parser.add_argument("--prompts", type=int, default=N_PROMPTS,
+                        help="The number of prompts per agent")
+    parser.add_argument("--dim", type=int, default=DIM,
+                        help="The dimension of the stub encoder")
+    parser.add_argument("--queries", type=int, default=N_QUERIES)
+    parser.add_argument("--latency-queries", type=int, default=N_LATENCY_QUERIES)
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    parser.add_argument("--model", default=None,
+                        help="A SentenceTransformer model used instead of the stub")
+    parser.add_argument("--score-function", default="log_pmean")
+    parser.add_argument("--k", type=int, default=1)
+    parser.add_argument("--index", action="store_true")
+    parser.add_argument("--quantization", default=None)
+    parser.add_argument("--prototypes", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None,
+                        help="The file to write the JSON report to")
+    parser.add_argument("--check-imports", action="store_true",
+                        help="Check the cold import times against a budget")
+    parser.add_argument("--import-budget", type=float, default=IMPORT_BUDGET)
+    args = parser.parse_args(argv)
+
+    if args.check_imports:
+        report = import_times(budget=args.import_budget, repeat=args.repeat)
+        json.dump(report, sys.stdout, indent=2)
+        print()
+        for result in report:
+            if not result["ok"]:
+                print(f"[AgentRec] Import of {result['target']} took "
+                      f"{result['p50_seconds']:.3f}s and imported "
+                      f"{result['heavy_modules']}", file=sys.stderr)
+
+        sys.exit(0 if all(result["ok"] for result in report) else 1)
+
+    report = run(n_agents=args.agents,
+                 n_prompts=args.prompts,
+                 dim=args.dim,
+                 n_queries=args.queries,
+                 n_latency_queries=args.latency_queries,
+                 repeat=args.repeat,
+                 model=args.model,
+                 score_function=args.score_function,
+                 k=args.k,
+                 index=args.index,
+                 quantization=args.quantization,
+                 prototypes=args.prototypes,
+                 seed=args.seed)
+
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+        return
+
+    with open(args.output, "w") as output_file:
+        json.dump(report, output_file, indent=2)
+
+if __name__ == "__main__":
+    main()
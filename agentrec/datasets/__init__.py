@@ -1,4 +1,31 @@
-from agentrec.datasets.agent import Agent
-from agentrec.datasets.generator import AgentGenerator
-from agentrec.datasets.generator import Generator
-from agentrec.datasets.promptpool import PromptPool
+"""
+The public classes of `agentrec.datasets`. They are imported lazily on first
+access, so importing the package only imports the modules which are used.
+"""
+import importlib
+
+_EXPORTS = {
+    "Agent": "agentrec.datasets.agent",
+    "JSONExtractor": "agentrec.datasets.extract",
+    "AgentGenerator": "agentrec.datasets.generator",
+    "AsyncGenerator": "agentrec.datasets.generator",
+    "AsyncModelAdapter": "agentrec.datasets.generator",
+    "Generator": "agentrec.datasets.generator",
+    "RateLimiter": "agentrec.datasets.generator",
+    "PromptPool": "agentrec.datasets.promptpool",
+    "PromptStream": "agentrec.datasets.promptpool",
+    "PromptTable": "agentrec.datasets.table",
+}
+
+__all__ = list(_EXPORTS)
+
+def __getattr__(name: str):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    value = getattr(importlib.import_module(_EXPORTS[name]), name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,164 @@
+import json
+import re
+
+TOKENS = re.compile(r'[{}"\\]')
+CONTENT = re.compile(r'"content"\s*:\s*("(?:[^"\\]|\\.)*")', re.DOTALL)
+
+# Raw newlines inside strings are tolerated, since LLMs often emit them
+DECODER = json.JSONDecoder(strict=False)
+
+class JSONExtractor:
+    """
+    An incremental extractor of the top-level JSON objects embedded in LLM
+    output. Text is fed in chunks of any size, such as streamed tokens, and
+    every object is returned as soon as its closing brace arrives. Each
+    character is scanned once, and braces inside strings, escaped quotes and
+    nested objects are handled, so prose and markdown around the objects are
+    skipped without being parsed.
+
+    Objects which are not valid JSON, for example because a comma is missing
+    between two keys, are repaired by reading their `content` string directly
+    when possible.
+    """
+    def __init__(self):
+        self.objects = 0
+        self.repaired = 0
+        self.invalid = 0
+        self.truncated = 0
+
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._buffer = []
+        self._length = 0
+
+        # The buffer offset of every open object and the buffer spans of the
+        # complete objects directly inside it
+        self._starts = []
+        self._children = []
+
+    def feed(self, text: str):
+        """
+        Scans a chunk of text and returns the objects completed by it.
+        """
+        results = []
+        start = 0 if self._depth > 0 else None
+        base  = self._length
+        skip  = 0
+
+        # An escape at the end of the previous chunk applies to the first
+        # character of this one
+        if self._escape:
+            self._escape = False
+            skip = 1
+
+        for match in TOKENS.finditer(text):
+            i = match.start()
+            if i < skip:
+                continue
+
+            char = text[i]
+            if self._in_string:
+                if char == "\\":
+                    skip = i + 2
+                elif char == '"':
+                    self._in_string = False
+                continue
+
+            if self._depth == 0:
+                if char == "{":
+                    self._depth = 1
+                    self._starts = [0]
+                    self._children = [[]]
+                    start = i
+                    base  = 0
+                continue
+
+            if char == '"':
+                self._in_string = True
+            elif char == "{":
+                self._depth += 1
+                self._starts.append(base + i - start)
+                self._children.append([])
+            elif char == "}":
+                self._depth -= 1
+                begin = self._starts.pop()
+                self._children.pop()
+                if self._depth == 0:
+                    self._buffer.append(text[start:i+1])
+                    self._emit(results)
+                    start = None
+                else:
+                    self._children[-1].append((begin, base + i + 1 - start))
+
+        self._escape = skip > len(text)
+        if self._depth > 0:
+            self._buffer.append(text[start:])
+            self._length = base + len(text) - start
+
+        return results
+
+    def close(self):
+        """
+        Ends the input and returns the objects which can be recovered from an
+        unterminated object. An opening brace which is never closed, such as
+        one in the surrounding prose or in a cut-off response, is skipped, and
+        the complete objects found inside it while scanning are returned
+        without scanning the text again.
+        """
+        results = []
+        if self._depth == 0:
+            return results
+
+        self.truncated += 1
+        text  = "".join(self._buffer)
+        spans = sorted(span for children in self._children for span in children)
+
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._starts = []
+        self._children = []
+        for begin, end in spans:
+            self._buffer = [text[begin:end]]
+            self._emit(results)
+
+        self._buffer = []
+        self._length = 0
+        return results
+
+    def stats(self):
+        """
+        Returns a dictionary of the extraction counters.
+        """
+        return {
+            "objects": self.objects,
+            "repaired": self.repaired,
+            "invalid": self.invalid,
+            "truncated": self.truncated,
+        }
+
+    def _emit(self, results: list[dict]):
+        text = "".join(self._buffer)
+        self._buffer = []
+        self._length = 0
+
+        try:
+            value = DECODER.decode(text)
+            if isinstance(value, dict):
+                self.objects += 1
+                results.append(value)
+                return
+        except ValueError:
+            pass
+
+        match = CONTENT.search(text)
+        if match is not None:
+            try:
+                results.append({"content": DECODER.decode(match.group(1))})
+                self.repaired += 1
+                return
+            except ValueError:
+                pass
+
+        self.invalid += 1
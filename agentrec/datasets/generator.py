@@ -1,10 +1,16 @@
 from agentrec.datasets import Agent
-import jsonlines
+from agentrec.datasets.extract import JSONExtractor
 
 from typing import Any, Optional
+import asyncio
+import inspect
+import math
+import threading
+import time
 
 BATCH_SIZE = 50
 CONTEXT_SIZE = 0
+MAX_IN_FLIGHT = 16
 SYSTEM_PROMPT = """
 You are a synthetic dataset generator specializing in creating diverse and \
 realistic prompts for Large Language Models (LLMs). Your task is to generate \
@@ -27,6 +33,87 @@ Each entry in the dataset should be JSON with the following structure:
 ```
 """
 
+def is_async_model(model: Any):
+    """
+    Returns whether the model implements an async __call__.
+    """
+    return inspect.iscoroutinefunction(model) or \
+           inspect.iscoroutinefunction(getattr(model, "__call__", None))
+
+class AsyncModelAdapter:
+    """
+    Adapts a model with a synchronous __call__ to the asynchronous model
+    protocol by running each call in a worker thread.
+
+    Args:
+        model: A class implementing __call__ for inferencing a LLM given an
+               untokenized OpenAI-compatible context.
+    """
+    def __init__(self, model: Any):
+        self.model = model
+
+    async def __call__(self, context: list[dict]):
+        return await asyncio.to_thread(self.model, context)
+
+def as_async_model(model: Any):
+    """
+    Returns the model itself if it implements an async __call__, and an
+    `AsyncModelAdapter` around it otherwise.
+    """
+    return model if is_async_model(model) else AsyncModelAdapter(model)
+
+class RateLimiter:
+    """
+    Wraps a model so that it can be shared safely by concurrent generators.
+    At most `max_concurrency` calls are in flight at once, and calls are
+    started at most `rate` times per second. The wrapped model must itself be
+    safe to call from multiple threads.
+
+    Args:
+        model: A class implementing __call__ for inferencing a LLM given an
+               untokenized OpenAI-compatible context.
+        max_concurrency: The maximum number of simultaneous calls. If it is
+                         not specified, then calls are not limited.
+        rate: The maximum number of calls started per second. If it is not
+              specified, then calls are not limited.
+    """
+    def __init__(
+        self,
+        model: Any,
+        max_concurrency: Optional[int] = None,
+        rate: Optional[float] = None,
+    ):
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.rate = rate
+        self.semaphore = threading.BoundedSemaphore(max_concurrency) \
+                         if max_concurrency is not None else None
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def __call__(self, context: list[dict]):
+        if self.semaphore is None:
+            self._wait()
+            return self.model(context)
+
+        with self.semaphore:
+            self._wait()
+            return self.model(context)
+
+    def _wait(self):
+        """
+        Blocks until the next call may start according to `rate`.
+        """
+        if self.rate is None:
+            return
+
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + 1 / self.rate
+
+        time.sleep(start - now)
+
 class Generator:
     """
     Describes a generator which can generate a dataset of prompts addressed to
@@ -98,8 +185,14 @@ class AgentGenerator:
     This generator is intended to be created through the `Generator` class.
 
     Note that these samples are not deduplicated or cleaned. It is therefore the
-    responsibility of the user to deduplicate and clean the training samples 
-    through some method such as the MinHash algorithm.
+    responsibility of the user to deduplicate and clean the training samples,
+    for example with `PromptPool.dedup`.
+
+    The content of the model response may also be an iterable, or an async
+    iterable for async models, of streamed text chunks. Prompts are then
+    extracted while the response is still being generated. The extraction
+    counters of the latest batch are kept in `batch_stats`, and their sums over
+    every batch in `total_stats`.
 
     Args:
         model: A class implementing __call__ for inferencing a LLM given an
@@ -140,8 +233,11 @@ class AgentGenerator:
             elif isinstance(example, dict):
                 self.agent_examples.append(example["content"])
 
+        self.async_model = as_async_model(model)
         self.context = []
         self.batch = []
+        self.batch_stats = {}
+        self.total_stats = {}
 
     def next_batch(self):
         """
@@ -152,6 +248,52 @@ class AgentGenerator:
         if len(self.batch) > 0: 
             return self.batch
 
+        model_context, user_prompt = self._build_context()
+
+        # Expect OpenAI-compatible context list
+        response  = self.model(model_context)[-1]
+        extractor = JSONExtractor()
+        response, objects = self._extract(response, extractor)
+        return self._parse_response(user_prompt, response, objects, extractor)
+
+    async def anext_batch(self):
+        """
+        The asynchronous counterpart of `next_batch`. The model may implement
+        an async __call__, in which case it is awaited directly. Otherwise the
+        synchronous model is run in a worker thread so that the event loop is
+        not blocked.
+
+        If the call is cancelled while the model is running, then the context
+        is left as it was before the call.
+        """
+        if len(self.batch) > 0:
+            return self.batch
+
+        model_context, user_prompt = self._build_context()
+
+        # Expect OpenAI-compatible context list
+        response  = (await self.async_model(model_context))[-1]
+        extractor = JSONExtractor()
+
+        if hasattr(response["content"], "__aiter__"):
+            chunks  = []
+            objects = []
+            async for chunk in response["content"]:
+                chunks.append(chunk)
+                objects += extractor.feed(chunk)
+
+            objects += extractor.close()
+            response = dict(response, content="".join(chunks))
+        else:
+            response, objects = self._extract(response, extractor)
+
+        return self._parse_response(user_prompt, response, objects, extractor)
+
+    def _build_context(self):
+        """
+        Returns the OpenAI-compatible context for the next LLM call, along
+        with the user prompt that is stored in the context afterwards.
+        """
         if self.store_context > 0:
             while len(self.context) > self.store_context:
                 self.context.pop(0)
@@ -189,37 +331,62 @@ class AgentGenerator:
                         self.context + \
                         user_prompt
 
-        # Expect OpenAI-compatible context list
-        response = self.model(model_context)[-1]
-        res = response["content"]
-        batch = []
+        return model_context, user_prompt
 
+    def _extract(self, response: dict, extractor: JSONExtractor):
+        """
+        Returns the response with its full content along with the objects
+        extracted from it. The content may be a string or an iterable of
+        streamed text chunks, which are parsed as they arrive so that parsing
+        overlaps generation.
+        """
+        content = response["content"]
+        if isinstance(content, str):
+            return response, extractor.feed(content) + extractor.close()
+
+        chunks  = []
+        objects = []
+        for chunk in content:
+            chunks.append(chunk)
+            objects += extractor.feed(chunk)
+
+        objects += extractor.close()
+        return dict(response, content="".join(chunks)), objects
+
+    def _parse_response(
+        self,
+        user_prompt: list[dict],
+        response: dict,
+        objects: list[dict],
+        extractor: JSONExtractor,
+    ):
+        """
+        Stores the response in the context and returns the prompts among the
+        objects extracted from it. The yield of the batch is recorded in
+        `batch_stats` and added to `total_stats`.
+        """
         self.context.extend(user_prompt)
         self.context.append(response)
 
-        try:
-            while True:
-                start = res.index("{")
-                end   = res.index("}")
-                json  = res[start:end+1]
-                res   = res[end+1:]
-                batch.append(json)
-        except ValueError:
-            pass
-
-        reader = jsonlines.Reader(batch)
         processed = []
+        for prompt in objects:
+            if not isinstance(prompt.get("content"), str):
+                continue
 
-        if reader is not None:
-            for prompt in reader.iter(type=dict, skip_invalid=True):
-                if "content" not in prompt:
-                    continue
+            processed.append({
+                "agent_name": self.agent,
+                "prompt": prompt["content"].strip(),
+            })
 
-                processed.append({
-                    "agent_name": self.agent,
-                    "prompt": prompt["content"].strip(),
-                })
+        self.batch_stats = extractor.stats()
+        self.batch_stats["prompts"] = len(processed)
+        self.batch_stats["requested"] = self.batch_size
+        self.batch_stats["characters"] = len(response["content"])
 
+        for key, value in self.batch_stats.items():
+            self.total_stats[key] = self.total_stats.get(key, 0) + value
+
+        self.batch_stats["yield"] = len(processed) / self.batch_size
         return processed
 
     def __next__(self):
@@ -233,3 +400,101 @@ class AgentGenerator:
             self.batch = self.next_batch()
 
         return self.batch.pop()
+
+    async def __anext__(self):
+        """
+        The asynchronous counterpart of `__next__`. Like `__next__`, this never
+        raises `StopAsyncIteration`.
+        """
+        while not len(self.batch) > 0:
+            self.batch = await self.anext_batch()
+
+        return self.batch.pop()
+
+class AsyncGenerator(Generator):
+    """
+    Describes a generator with the same interface as `Generator` which keeps
+    many LLM calls in flight at once. This is intended for inference servers
+    which are built to serve many concurrent requests, such as local
+    OpenAI-compatible servers.
+
+    The model may implement either an async or a synchronous __call__. A
+    synchronous model is run in worker threads.
+
+    At most `max_in_flight` model calls run at once across every agent, which
+    applies back-pressure to the callers. If `store_context` is not `0`, each
+    call of an agent depends on the previous one, so the calls of a single
+    agent are then made one at a time.
+
+    Args:
+        model: A class implementing __call__ or an async __call__ for
+               inferencing a LLM given an untokenized OpenAI-compatible context.
+        agents: A list of agents that the generator should be able to generate.
+        batch_size: The number of training samples to generate per LLM call.
+                    Defaults to `50`.
+        store_context: See `Generator`. Defaults to `0`.
+        max_in_flight: The maximum number of model calls in flight at once.
+                       Defaults to `16`.
+    """
+    def __init__(
+        self,
+        model: Any,
+        agents: Agent | list[Agent],
+        batch_size: int = BATCH_SIZE,
+        store_context: int = CONTEXT_SIZE,
+        max_in_flight: int = MAX_IN_FLIGHT,
+    ):
+        super().__init__(model,
+                         agents,
+                         batch_size=batch_size,
+                         store_context=store_context)
+        self.store_context = store_context if store_context is not None else CONTEXT_SIZE
+        self.max_in_flight = max_in_flight
+        self._semaphore = None
+
+    async def generate(self, agent: str, n: int):
+        """
+        Returns `n` prompts generated for the given agent. Batches are
+        requested concurrently, and their prompts are returned in the order
+        the batches were requested. Cancelling this cancels every call in
+        flight.
+
+        Args:
+            agent: The name of the agent.
+            n: The number of prompts to generate.
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+
+        agent_gen = self(agent)
+        prompts = []
+        while len(prompts) < n:
+            calls = math.ceil((n - len(prompts)) / agent_gen.batch_size)
+            if self.store_context > 0:
+                calls = 1
+
+            batches = await asyncio.gather(*[
+                self._next_batch(agent_gen) for _ in range(calls)
+            ])
+            for batch in batches:
+                prompts += batch
+
+        return prompts[:n]
+
+    async def generate_all(self, per_agent: int):
+        """
+        Returns a dictionary mapping every agent name to `per_agent` generated
+        prompts. All agents are generated concurrently.
+
+        Args:
+            per_agent: The number of prompts to generate for each agent.
+        """
+        names = [agent.name for agent in self.agents]
+        results = await asyncio.gather(*[
+            self.generate(name, per_agent) for name in names
+        ])
+        return dict(zip(names, results))
+
+    async def _next_batch(self, agent_gen: AgentGenerator):
+        async with self._semaphore:
+            return await agent_gen.anext_batch()
@@ -0,0 +1,172 @@
+import numpy as np
+
+from agentrec.hashing import NGRAM, shingle_hashes
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+NUM_PERM = 128
+THRESHOLD = 0.8
+BLOCK_SHINGLES = 1 << 16
+
+def permutations(num_perm: int = NUM_PERM, seed: int = 0):
+    """
+    Returns the odd multipliers and the offsets of `num_perm` random
+    multiply-shift hash functions, which stand in for random permutations.
+    """
+    rng = np.random.default_rng(seed)
+    a = rng.integers(0, 1 << 63, num_perm, dtype=np.uint64) * 2 + 1
+    b = rng.integers(0, 1 << 63, num_perm, dtype=np.uint64)
+    return a, b
+
+def optimal_bands(num_perm: int, threshold: float):
+    """
+    Returns the number of LSH bands which divides `num_perm` and whose
+    detection threshold `(1 / bands) ** (1 / rows)` is closest to `threshold`.
+    """
+    candidates = [
+        bands for bands in range(1, num_perm + 1) if num_perm % bands == 0
+    ]
+    return min(
+        candidates,
+        key=lambda bands: abs((1 / bands) ** (bands / num_perm) - threshold),
+    )
+
+def signatures(
+    prompts: list[str],
+    num_perm: int = NUM_PERM,
+    ngram: int = NGRAM,
+    seed: int = 0,
+):
+    """
+    Computes the MinHash signatures of the character n-gram shingles of a
+    list of prompts. The shingles are hashed by `shingle_hashes` and the
+    minimum of each hash function over a prompt is taken with a segmented
+    reduction, so no Python loop runs per shingle.
+
+    Args:
+        prompts: The prompts to compute the signatures of.
+        num_perm: The number of hash functions. Defaults to `128`.
+        ngram: The number of bytes per shingle. Defaults to `5`.
+        seed: The random seed of the hash functions. Defaults to `0`.
+
+    Returns:
+        A `(len(prompts), num_perm)` array of `uint32` signatures.
+    """
+    a, b = permutations(num_perm, seed)
+    result = np.empty((len(prompts), num_perm), dtype=np.uint32)
+    if len(prompts) == 0:
+        return result
+
+    hashes, counts = shingle_hashes(prompts, ngram)
+    bounds = np.concatenate(([0], np.cumsum(counts)))
+
+    start = 0
+    while start < len(prompts):
+        # Hash blocks of prompts so that the `(num_perm, shingles)` matrix
+        # stays within `BLOCK_SHINGLES` columns
+        stop = start + 1
+        total = counts[start]
+        while stop < len(prompts) and total + counts[stop] <= BLOCK_SHINGLES:
+            total += counts[stop]
+            stop += 1
+
+        h = hashes[bounds[start]:bounds[stop]]
+        offsets = bounds[start:stop] - bounds[start]
+
+        # Hash functions run along the rows so the reduction is contiguous
+        hashed = a[:, None] * h
+        hashed += b[:, None]
+        hashed >>= np.uint64(32)
+        result[start:stop] = np.minimum.reduceat(hashed, offsets, axis=1).T
+        start = stop
+
+    return result
+
+def _signature_worker(args: tuple):
+    return signatures(*args)
+
+def parallel_signatures(
+    prompts: list[str],
+    num_perm: int = NUM_PERM,
+    ngram: int = NGRAM,
+    seed: int = 0,
+    workers: int = 1,
+    chunk_size: int = 4096,
+):
+    """
+    Computes `signatures` in chunks across a pool of `workers` processes. The
+    result is identical to computing the signatures in a single process.
+    """
+    if workers <= 1 or len(prompts) <= chunk_size:
+        return signatures(prompts, num_perm, ngram, seed)
+
+    chunks = [
+        (prompts[i:i+chunk_size], num_perm, ngram, seed)
+        for i in range(0, len(prompts), chunk_size)
+    ]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return np.concatenate(list(executor.map(_signature_worker, chunks)))
+
+def lsh_duplicates(
+    signatures: np.ndarray,
+    bands: int,
+    threshold: float = THRESHOLD,
+    groups: Optional[np.ndarray] = None,
+):
+    """
+    Finds near-duplicates among MinHash signatures with banded locality
+    sensitive hashing. Signatures sharing a band are candidates, and a
+    candidate is a duplicate if the estimated Jaccard similarity to the first
+    signature of its bucket is at least `threshold`. Bucketing is a sort per
+    band, so the cost grows near-linearly with the number of signatures.
+
+    Args:
+        signatures: A `(n, num_perm)` signature matrix.
+        bands: The number of bands, which must divide `num_perm`.
+        threshold: The minimum estimated Jaccard similarity of duplicates.
+                   Defaults to `0.8`.
+        groups: An optional group id of every signature. Signatures in
+                different groups are never duplicates of each other.
+
+    Returns:
+        A boolean mask of the signatures which duplicate an earlier one. The
+        first signature of every set of duplicates is kept.
+    """
+    n, num_perm = signatures.shape
+    if num_perm % bands != 0:
+        raise ValueError(f"{bands} bands do not divide {num_perm} hash functions")
+
+    rows = num_perm // bands
+    duplicate = np.zeros(n, dtype=bool)
+    if n == 0:
+        return duplicate
+
+    if groups is None:
+        groups = np.zeros(n, dtype=np.uint32)
+
+    for band in range(bands):
+        keys = np.column_stack((
+            np.asarray(groups, dtype=np.uint32),
+            signatures[:, band*rows:(band+1)*rows],
+        ))
+        keys = np.ascontiguousarray(keys).view(
+            np.dtype((np.void, keys.dtype.itemsize * keys.shape[1]))
+        ).ravel()
+
+        # The first index of every bucket represents it, since a stable sort
+        # keeps equal keys in their original order
+        order = np.argsort(keys, kind="stable")
+        first = np.ones(n, dtype=bool)
+        first[1:] = keys[order[1:]] != keys[order[:-1]]
+        representative = np.empty(n, dtype=np.int64)
+        representative[order] = order[np.maximum.accumulate(
+            np.where(first, np.arange(n), 0)
+        )]
+
+        candidates = np.flatnonzero((representative != np.arange(n)) & ~duplicate)
+        similarity = np.mean(signatures[candidates] ==
+                             signatures[representative[candidates]], axis=1)
+        duplicate[candidates[similarity >= threshold]] = True
+
+    return duplicate
@@ -1,11 +1,20 @@
 import jsonlines
+import numpy as np
 
-from agentrec.datasets import Agent, Generator
+from agentrec.datasets import Agent, AsyncGenerator, Generator, RateLimiter
+from agentrec.datasets.table import PromptTable
+from agentrec.datasets import minhash
 
-from typing import Any, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Iterator, Optional
 from pathlib import Path
-import copy
+import itertools
+import json
+import os
 import random
+import threading
+
+FLUSH_EVERY = 50
 
 class PromptPool:
     """
@@ -15,13 +24,27 @@ class PromptPool:
 
     `PromptPool` ensures that prompts are sorted by the specific agent to make
     the manual cleaning of data more simple.
+
+    Prompts are stored in a columnar `PromptTable`, which holds interned agent
+    ids and a contiguous text buffer. The `pool` attribute materializes them as
+    a list of dictionaries with the keys `agent_name` and `prompt`, so
+    modifying that list does not modify the pool. Assigning a list to `pool`
+    replaces the prompts instead.
     """
     def __init__(self):
-        self.pool = []
+        self.table = PromptTable()
         self.agents = []
 
     def __len__(self):
-        return len(self.pool)
+        return len(self.table)
+
+    @property
+    def pool(self):
+        return self.table.to_records()
+
+    @pool.setter
+    def pool(self, records: list[dict]):
+        self.table = PromptTable(records)
 
     def set(self, agents: list[Agent]):
         """
@@ -33,7 +56,7 @@ class PromptPool:
             agents: A list of agents which the prompt pool should generate from
         """
         self.agents = agents
-        self.pool = []
+        self.table = PromptTable()
 
     def generate(
         self,
@@ -42,6 +65,9 @@ class PromptPool:
         batch_size: Optional[int],
         store_context: Optional[int],
         progress: bool = False,
+        workers: int = 1,
+        max_concurrency: Optional[int] = None,
+        rate_limit: Optional[float] = None,
     ):
         """
         Generates the specified number of training samples and stores them into
@@ -50,6 +76,11 @@ class PromptPool:
         training samples. If neither or both are specified, then a `ValueError`
         is thrown.
 
+        Agents can be generated concurrently by increasing `workers`, in which
+        case the model is called from multiple threads. Regardless of the
+        number of workers, the prompts of each agent are stored together and
+        in the order of `agents`.
+
         Args:
             model: A class implementing __call__ to inference a LLM given an
                    untokenized OpenAI-like context.
@@ -60,32 +91,192 @@ class PromptPool:
                    agents in order to find how many samples should be created
                    for each agent. If this number is not cleanly divisible by
                    the number of agents, a best-effort approach is made.
+            workers: The number of agents generated concurrently. Defaults to
+                     `1`.
+            max_concurrency: The maximum number of model calls in flight at
+                             once across all workers. Defaults to no limit.
+            rate_limit: The maximum number of model calls started per second
+                        across all workers. Defaults to no limit.
         """
         if not len(self.agents) > 0:
             raise ValueError("A list of agents must be specified first")
 
         per_agent = per_agent if per_agent is not None else total // len(self.agents)
+        if max_concurrency is not None or rate_limit is not None:
+            model = RateLimiter(model,
+                                max_concurrency=max_concurrency,
+                                rate=rate_limit)
+
+        generator = Generator(model,
+                              self.agents,
+                              batch_size=batch_size,
+                              store_context=store_context)
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(self._generate_agent,
+                                generator(agent.name),
+                                per_agent,
+                                progress)
+                for agent in self.agents
+            ]
+
+            for future in futures:
+                self.table.extend(future.result())
+
+    def generate_stream(
+        self,
+        model: Any,
+        per_agent: int,
+        path: str,
+        agent_path: str,
+        batch_size: Optional[int] = None,
+        store_context: Optional[int] = None,
+        progress: bool = False,
+        workers: int = 1,
+        max_concurrency: Optional[int] = None,
+        rate_limit: Optional[float] = None,
+        flush_every: int = FLUSH_EVERY,
+        overwrite: bool = False,
+    ):
+        """
+        Generates training samples like `generate`, but appends each batch to
+        the prompt file at `path` as soon as it is parsed rather than storing
+        it in the pool, so memory use does not grow with `per_agent`.
+
+        Progress is recorded in a small manifest next to the prompt file
+        whenever at least `flush_every` prompts were written. If generation is
+        interrupted, then calling this again with the same paths resumes
+        where the last manifest left off, discarding anything written after
+        it. The resulting files can be loaded with `load`, although prompts of
+        different agents may be interleaved when `workers` is greater than
+        `1`. A prompt file without a manifest was not written by this method,
+        so a `ValueError` is thrown instead of replacing it unless
+        `overwrite` is `True`.
+
+        Args:
+            model: A class implementing __call__ to inference a LLM given an
+                   untokenized OpenAI-like context.
+            per_agent: The number of training samples that should be generated
+                       for each agent, including any generated by previous
+                       runs.
+            path: The file path where the agent prompts are stored.
+            agent_path: The file path where the agent metadata is stored.
+            workers: See `generate`.
+            max_concurrency: See `generate`.
+            rate_limit: See `generate`.
+            flush_every: The number of prompts written between flushes of the
+                         prompt file and the manifest. Defaults to `50`.
+            overwrite: Whether an existing prompt file without a manifest is
+                       replaced. Defaults to `False`.
+        """
+        if not len(self.agents) > 0:
+            raise ValueError("A list of agents must be specified first")
+
+        if max_concurrency is not None or rate_limit is not None:
+            model = RateLimiter(model,
+                                max_concurrency=max_concurrency,
+                                rate=rate_limit)
+
         generator = Generator(model,
                               self.agents,
                               batch_size=batch_size,
                               store_context=store_context)
 
+        with _StreamWriter(path, flush_every, overwrite) as writer:
+            Path(agent_path).parent.mkdir(parents=True, exist_ok=True)
+            with jsonlines.open(agent_path, mode="w") as agent_file:
+                agent_file.write_all([agent.to_jsonl() for agent in self.agents])
+
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [
+                    executor.submit(self._generate_agent,
+                                    generator(agent.name),
+                                    per_agent,
+                                    progress,
+                                    writer)
+                    for agent in self.agents
+                ]
+
+                for future in futures:
+                    future.result()
+
+    async def agenerate(
+        self,
+        model: Any,
+        per_agent: int,
+        batch_size: Optional[int],
+        store_context: Optional[int],
+        progress: bool = False,
+        max_in_flight: int = 16,
+    ):
+        """
+        The asynchronous counterpart of `generate`, which keeps up to
+        `max_in_flight` model calls in flight at once through an
+        `AsyncGenerator`. The model may implement either an async or a
+        synchronous __call__. The prompts of each agent are stored together
+        and in the order of `agents`.
+
+        Args:
+            model: A class implementing __call__ or an async __call__ to
+                   inference a LLM given an untokenized OpenAI-like context.
+            per_agent: The number of training samples that should be generated
+                       for each agent.
+            max_in_flight: The maximum number of model calls in flight at
+                           once. Defaults to `16`.
+        """
+        if not len(self.agents) > 0:
+            raise ValueError("A list of agents must be specified first")
+
+        generator = AsyncGenerator(model,
+                                   self.agents,
+                                   batch_size=batch_size,
+                                   store_context=store_context,
+                                   max_in_flight=max_in_flight)
+
+        if progress:
+            print("[AgentRec] Generating prompts for", len(self.agents), "agents")
+
+        prompts = await generator.generate_all(per_agent)
         for agent in self.agents:
-            name      = agent.name
-            agent_gen = generator(name)
-            n         = 0
+            self.table.extend(prompts[agent.name])
 
             if progress:
-                print("[AgentRec] Generating prompts for", name)
+                print("[AgentRec]", agent.name, str(len(prompts[agent.name])),
+                      "/", str(per_agent))
+
+    def _generate_agent(
+        self,
+        agent_gen: Any,
+        per_agent: int,
+        progress: bool,
+        writer: Optional["_StreamWriter"] = None,
+    ):
+        """
+        Returns `per_agent` prompts generated by a single `AgentGenerator`. If
+        a writer is given, then each batch is written to it instead, and only
+        the prompts missing from previous runs are generated.
+        """
+        name    = agent_gen.agent
+        prompts = []
+        n       = writer.count(name) if writer is not None else 0
 
-            while n < per_agent:
-                prompt  = next(agent_gen)
-                n      += 1
+        if progress:
+            print("[AgentRec] Generating prompts for", name)
 
-                if progress:
-                    print("[AgentRec]", str(n), "/", str(per_agent))
+        while n < per_agent:
+            batch = agent_gen.next_batch()[:per_agent - n]
+            n    += len(batch)
 
-                self.pool.append(prompt)
+            if writer is not None:
+                writer.write(name, batch)
+            else:
+                prompts += batch
+
+            if progress:
+                print("[AgentRec]", name, str(n), "/", str(per_agent))
+
+        return prompts
 
     def shuffle(self, seed: Optional[int] = None):
         """
@@ -96,7 +287,11 @@ class PromptPool:
             seed: An optional random seed which allows deterministic shuffling
                   shuffling when specified.
         """
-        return random.Random(seed).shuffle(self.pool)
+        # Shuffling indices with `random` yields the same order as shuffling
+        # the prompts themselves did, so existing seeds reproduce old splits
+        order = list(range(len(self.table)))
+        random.Random(seed).shuffle(order)
+        self.table = self.table.take(np.asarray(order, dtype=np.int64))
 
     def split(self, n: int):
         """
@@ -109,9 +304,9 @@ class PromptPool:
             n: The number of training samples to remove from the `PromptPool`
                and return.
         """
-        popped    = self.pool[n:]
-        self.pool = self.pool[:n]
-        return popped
+        popped     = self.table.take(slice(n, None))
+        self.table = self.table.take(slice(None, n))
+        return popped.to_records()
 
     def uniform(self, n: int):
         """
@@ -125,24 +320,186 @@ class PromptPool:
                and return. The sum of all prompts of all agents will equal to
                this argument.
         """
-        per_agent = n // len(self.agents)
-        prompts = {}
-        for agent in self.agents:
-            name = agent["name"]
-            prompts[name] = []
-            idx = 0
-            while (len(prompts[name]) < per_agent) and (idx < len(self.pool)):
-                prompt = self.pool[idx]
-                if prompt["agent_name"] == name:
-                    prompts[name].append(self.pool.pop(idx))
-                else:
-                    idx += 1
-
-        pool = []
-        for agent in prompts:
-            pool += prompts[agent]
-
-        return pool
+        remaining, selected, _ = self.split_indices(n // len(self.agents),
+                                                    exact=False)
+
+        popped     = self.table.take(selected)
+        self.table = self.table.take(remaining)
+        return popped.to_records()
+
+    def split_indices(
+        self,
+        test_split: float | int | dict[str, int] = 0.2,
+        validation_split: Optional[float | int | dict[str, int]] = None,
+        seed: Optional[int] = None,
+        stratify: str = "uniform",
+        exact: bool = True,
+    ):
+        """
+        Computes a stratified train, test and validation split of the pool in
+        a single vectorized pass over the per-agent index arrays, without
+        copying any prompts.
+
+        Each split can be given as a fraction of the pool, as an exact number
+        of prompts per agent or as a dictionary mapping agent names to exact
+        numbers of prompts. With `stratify="uniform"`, a fraction is divided
+        evenly between the agents, matching `uniform`. With
+        `stratify="proportional"`, each agent contributes that fraction of its
+        own prompts instead.
+
+        Args:
+            test_split: The size of the test split. Defaults to 20%.
+            validation_split: The optional size of the validation split.
+            seed: If it is `None`, then the first prompts of each agent in pool
+                  order are selected. Otherwise they are sampled randomly
+                  with a generator seeded by `seed`.
+            stratify: Either `"uniform"` or `"proportional"`. Defaults to
+                      `"uniform"`.
+            exact: Whether a `ValueError` is thrown when an agent has fewer
+                   prompts than its exact quotas require. If it is `False`,
+                   then such an agent gives as many prompts as it has.
+                   Defaults to `True`.
+
+        Returns:
+            A tuple of three index arrays `(train, test, validation)`. The
+            train split is in pool order, while the test and validation splits
+            are grouped by agent in the order of `agents`. The validation split
+            is empty if `validation_split` is `None`.
+        """
+        if stratify not in ("uniform", "proportional"):
+            raise ValueError(f"Invalid stratification {stratify!r}")
+
+        table  = self.table
+        counts = table.counts()
+        test_quotas = self._quotas(test_split, counts, stratify)
+        validation_quotas = self._quotas(validation_split, counts, stratify)
+
+        if exact and np.any(test_quotas + validation_quotas > counts):
+            raise ValueError("Not enough prompts to fill the split quotas")
+
+        if seed is None:
+            order, _ = table.groups()
+        else:
+            keys  = np.random.default_rng(seed).random(len(table))
+            order = np.lexsort((keys, table.agent_ids))
+
+        # Rank every prompt within its agent, then assign splits by quota
+        grouped = table.agent_ids[order]
+        starts  = np.searchsorted(grouped, np.arange(len(table.agent_names)))
+        rank    = np.arange(len(order)) - starts[grouped]
+        in_test = rank < test_quotas[grouped]
+        in_validation = ~in_test & (rank < (test_quotas + validation_quotas)[grouped])
+
+        # Group the held out splits in the order of `agents`
+        agent_order = np.full(len(table.agent_names), len(self.agents))
+        for i, agent in enumerate(self.agents):
+            if table.agent_id(agent.name) >= 0:
+                agent_order[table.agent_id(agent.name)] = i
+
+        def held_out(mask: np.ndarray):
+            indices = order[mask]
+            return indices[np.argsort(agent_order[table.agent_ids[indices]],
+                                      kind="stable")]
+
+        train = np.sort(order[~in_test & ~in_validation])
+        return train, held_out(in_test), held_out(in_validation)
+
+    def _quotas(
+        self,
+        split: Optional[float | int | dict[str, int]],
+        counts: np.ndarray,
+        stratify: str,
+    ):
+        """
+        Returns the number of prompts that every agent id of the table
+        contributes to a split.
+        """
+        table  = self.table
+        quotas = np.zeros(len(table.agent_names), dtype=np.int64)
+        known  = [table.agent_id(agent.name) for agent in self.agents]
+        known  = np.array([i for i in known if i >= 0], dtype=np.int64)
+
+        if split is None:
+            return quotas
+
+        if isinstance(split, dict):
+            for agent, quota in split.items():
+                if table.agent_id(agent) >= 0:
+                    quotas[table.agent_id(agent)] = quota
+        elif isinstance(split, int):
+            quotas[known] = split
+        elif stratify == "uniform":
+            quotas[known] = int(len(table) * split) // len(self.agents)
+        else:
+            quotas[known] = np.floor(counts[known] * split).astype(np.int64)
+
+        return quotas
+
+    def dedup(
+        self,
+        threshold: float = minhash.THRESHOLD,
+        num_perm: int = minhash.NUM_PERM,
+        bands: Optional[int] = None,
+        ngram: int = minhash.NGRAM,
+        across_agents: bool = False,
+        workers: int = 1,
+        seed: int = 0,
+    ):
+        """
+        Removes near-duplicate prompts from the pool with MinHash and banded
+        locality sensitive hashing, which avoids comparing every pair of
+        prompts. Prompts are compared by the Jaccard similarity of their
+        character n-grams, ignoring case and whitespace, and the first prompt
+        of every set of near-duplicates in pool order is kept.
+
+        Args:
+            threshold: The estimated Jaccard similarity above which prompts are
+                       duplicates. Defaults to `0.8`.
+            num_perm: The number of MinHash functions. Defaults to `128`.
+            bands: The number of LSH bands, which must divide `num_perm`.
+                   Defaults to the number of bands whose detection threshold
+                   is closest to `threshold`.
+            ngram: The number of characters per shingle. Defaults to `5`.
+            across_agents: Whether prompts of different agents can be
+                           duplicates of each other. Defaults to `False`.
+            workers: The number of processes which compute signatures.
+                     Defaults to `1`.
+            seed: The random seed of the hash functions. Defaults to `0`.
+
+        Returns:
+            A dictionary mapping agent names to the number of prompts removed.
+        """
+        if bands is None:
+            bands = minhash.optimal_bands(num_perm, threshold)
+
+        signatures = minhash.parallel_signatures(self.table.prompts(),
+                                                 num_perm=num_perm,
+                                                 ngram=ngram,
+                                                 seed=seed,
+                                                 workers=workers)
+        groups = None if across_agents else self.table.agent_ids
+        duplicate = minhash.lsh_duplicates(signatures,
+                                           bands,
+                                           threshold=threshold,
+                                           groups=groups)
+
+        removed = np.bincount(self.table.agent_ids[duplicate],
+                              minlength=len(self.table.agent_names))
+        self.table = self.table.take(~duplicate)
+
+        return {
+            name: int(count)
+            for name, count in zip(self.table.agent_names, removed)
+        }
+
+    def agent_prompts(self, agent: str):
+        """
+        Returns the prompts of the given agent in pool order.
+
+        Args:
+            agent: The name of the agent.
+        """
+        return self.table.prompts(self.table.agent_indices(agent))
 
     def save(
         self,
@@ -156,6 +513,9 @@ class PromptPool:
         themselves at `path`. It is suggested that these files are stored
         together in the same directory.
 
+        If `path` ends with `.npz`, then the prompts are stored in a compact
+        binary format which loads much faster than jsonlines.
+
         Args:
             agent_path: The file path where the agent metadata is stored
             path: The file path where the agent prompts are stored
@@ -168,43 +528,86 @@ class PromptPool:
             agent_file.write_all(agents)
             agent_file.close()
 
+        self._write(path)
+
+    def _write(self, path: str, indices: Optional[np.ndarray] = None):
+        """
+        Writes the prompts at `indices`, or every prompt, to `path` in either
+        the jsonlines or the `.npz` format. Jsonlines are written one prompt
+        at a time without copying the selected prompts first.
+        """
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+
+        if path.endswith(".npz"):
+            table = self.table.take(indices) if indices is not None else self.table
+            table.save(path)
+            return
+
+        records = self.table
+        if indices is not None:
+            records = (self.table[i] for i in indices)
+
         with jsonlines.open(path, mode="w") as prompt_file:
-            prompt_file.write_all(self.pool)
+            prompt_file.write_all(records)
             prompt_file.close()
 
     def save_split(
         self,
         train_path: str,
         test_path: str,
-        test_split: float = 0.2,
+        test_split: float | int | dict[str, int] = 0.2,
+        validation_path: Optional[str] = None,
+        validation_split: Optional[float | int | dict[str, int]] = None,
+        seed: Optional[int] = None,
+        stratify: str = "uniform",
     ):
         """
         Saves a train and test split which are uniformly split. It is
         recommended to use the `save` method alongside this method, as it is
         not possible to load a `PromptPool` from split files.
 
+        The splits are computed by `split_indices` and written straight from
+        the pool, which is left unchanged.
+
         Args:
             train_path: The file path where the train split is stored
             test_path: The file path where the test split is stored
-            test_split: The percentage of all samples in the pool which are
-                        allocated to the test split. Defaults to 20%.
+            test_split: The size of the test split. See `split_indices`.
+                        Defaults to 20%.
+            validation_path: The optional file path where the validation
+                             split is stored.
+            validation_split: The size of the validation split. See
+                              `split_indices`.
+            seed: See `split_indices`.
+            stratify: See `split_indices`.
         """
-        train_pool = copy.deepcopy(self)
-        test_pool = train_pool.uniform(int(len(train_pool) * test_split))
+        if (validation_path is None) != (validation_split is None):
+            raise ValueError("A validation path and split must be given together")
+
+        train, test, validation = self.split_indices(test_split,
+                                                     validation_split,
+                                                     seed=seed,
+                                                     stratify=stratify,
+                                                     exact=False)
 
-        Path(train_path).parent.mkdir(parents=True, exist_ok=True)
-        Path(test_path).parent.mkdir(parents=True, exist_ok=True)
+        self._write(train_path, train)
+        self._write(test_path, test)
 
-        with jsonlines.open(train_path, mode="w") as train_file:
-            train_file.write_all(train_pool.pool)
-            train_file.close()
+        if validation_path is not None:
+            self._write(validation_path, validation)
 
-        with jsonlines.open(test_path, mode="w") as test_file:
-            test_file.write_all(test_pool)
-            test_file.close()
+    @staticmethod
+    def stream(path: str, agents: Optional[list[str]] = None):
+        """
+        Returns a lazy `PromptStream` over a prompt file instead of loading it
+        into memory. This is preferable to `load` for large prompt files which
+        only need to be read sequentially, such as by `SBERTAgentRec.fit`.
 
-        del train_pool
-        del test_pool
+        Args:
+            path: The file path where the agent prompts are stored
+            agents: An optional list of agent names to filter by.
+        """
+        return PromptStream(path, agents=agents)
 
     def load(
         self,
@@ -213,7 +616,9 @@ class PromptPool:
     ):
         """
         Loads a PromptPool from two jsonlines files, an agent metadata file
-        at `agent_path` and a prompt storage file at `path`.
+        at `agent_path` and a prompt storage file at `path`. If `path` ends
+        with `.npz`, then the prompts are loaded from the binary format
+        written by `save`.
 
         Args:
             agent_path: The file path where the agent metadata is stored
@@ -222,10 +627,141 @@ class PromptPool:
         self.agents = []
         with jsonlines.open(agent_path) as agent_file:
             for agent in agent_file:
-                self.agents.append(agent)
+                self.agents.append(Agent.from_jsonl(agent))
             agent_file.close()
 
-        with jsonlines.open(path) as prompt_file:
+        if path.endswith(".npz"):
+            self.table = PromptTable.load(path)
+        else:
+            self.table = PromptTable(PromptStream(path))
+
+class PromptStream:
+    """
+    A lazy view over a prompt file written by `PromptPool`. Prompts are read
+    one line at a time on every iteration, so a corpus of any size can be
+    processed with bounded memory. Unlike an iterator, a `PromptStream` can be
+    iterated over multiple times, with each iteration reopening the file.
+
+    Args:
+        path: The file path where the agent prompts are stored.
+        agents: An optional list of agent names. If it is given, then only the
+                prompts of these agents are yielded.
+    """
+    def __init__(self, path: str, agents: Optional[list[str]] = None):
+        self.path = path
+        self.agents = set(agents) if agents is not None else None
+
+    def __iter__(self) -> Iterator[dict]:
+        if self.path.endswith(".npz"):
+            for prompt in PromptTable.load(self.path):
+                if self.agents is None or prompt["agent_name"] in self.agents:
+                    yield prompt
+            return
+
+        with jsonlines.open(self.path) as prompt_file:
             for prompt in prompt_file:
-                self.pool.append(prompt)
-            prompt_file.close()
+                if self.agents is None or prompt["agent_name"] in self.agents:
+                    yield prompt
+
+    def chunks(self, chunk_size: int) -> Iterator[list[dict]]:
+        """
+        Yields lists of up to `chunk_size` consecutive prompts.
+
+        Args:
+            chunk_size: The maximum number of prompts per list.
+        """
+        iterator = iter(self)
+        while chunk := list(itertools.islice(iterator, chunk_size)):
+            yield chunk
+
+    def filter(self, agents: list[str]):
+        """
+        Returns a `PromptStream` over the same file which only yields the
+        prompts of the given agents.
+
+        Args:
+            agents: The names of the agents to keep.
+        """
+        if self.agents is not None:
+            agents = [agent for agent in agents if agent in self.agents]
+
+        return PromptStream(self.path, agents=agents)
+
+class _StreamWriter:
+    """
+    Appends prompts to a jsonlines file from multiple threads, recording the
+    number of prompts of each agent and the byte length of the file in a
+    manifest whenever it flushes. On opening, the file is truncated to the
+    length recorded by the manifest, so that prompts written after the last
+    flush, including any partially written line, are discarded. A non-empty
+    file without a manifest is only truncated if `overwrite` is `True`.
+    """
+    def __init__(
+        self,
+        path: str,
+        flush_every: int = FLUSH_EVERY,
+        overwrite: bool = False,
+    ):
+        self.path = Path(path)
+        self.manifest_path = self.path.with_suffix(".manifest.json")
+        self.flush_every = flush_every
+        self.pending = 0
+        self.lock = threading.Lock()
+
+        self.manifest = {"offset": 0, "counts": {}}
+        if self.manifest_path.exists() and self.path.exists():
+            with open(self.manifest_path) as manifest_file:
+                self.manifest = json.load(manifest_file)
+        elif self.path.exists() and self.path.stat().st_size > 0 and not overwrite:
+            raise ValueError(f"The prompt file {self.path} already exists without "
+                             "a manifest, pass overwrite=True to replace it")
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.file = open(self.path, "ab")
+        self.file.truncate(self.manifest["offset"])
+        self.file.seek(self.manifest["offset"])
+        self.writer = jsonlines.Writer(self.file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def count(self, agent: str):
+        """
+        Returns the number of prompts of the agent that have been written.
+        """
+        with self.lock:
+            return self.manifest["counts"].get(agent, 0)
+
+    def write(self, agent: str, prompts: list[dict]):
+        """
+        Appends the prompts of an agent, flushing if enough are pending.
+        """
+        with self.lock:
+            self.writer.write_all(prompts)
+            counts = self.manifest["counts"]
+            counts[agent] = counts.get(agent, 0) + len(prompts)
+            self.pending += len(prompts)
+
+            if self.pending >= self.flush_every:
+                self._flush()
+
+    def _flush(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.manifest["offset"] = self.file.tell()
+        self.pending = 0
+
+        with open(f"{self.manifest_path}.tmp", "w") as manifest_file:
+            json.dump(self.manifest, manifest_file)
+        os.replace(f"{self.manifest_path}.tmp", self.manifest_path)
+
+    def close(self):
+        """
+        Flushes any pending prompts and closes the file.
+        """
+        with self.lock:
+            self._flush()
+            self.file.close()
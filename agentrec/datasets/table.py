@@ -0,0 +1,227 @@
+import numpy as np
+
+from typing import Iterable, Iterator, Optional
+
+PENDING_LIMIT = 65536
+
+class PromptTable:
+    """
+    A compact columnar store of prompts, used internally by `PromptPool`.
+    Agent names are interned, so each prompt only stores an integer agent id,
+    and the prompt texts are stored back to back as UTF-8 in a single byte
+    buffer addressed by an offset array. Selecting, shuffling and grouping
+    prompts by agent are therefore index operations on a few NumPy arrays
+    rather than loops over a list of dictionaries.
+
+    Args:
+        records: An optional iterable of dictionaries with the keys
+                 `agent_name` and `prompt` to initialize the table with.
+    """
+    def __init__(self, records: Optional[Iterable[dict]] = None):
+        self.agent_names = []
+        self.agent_ids = np.empty(0, dtype=np.int32)
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.data = np.empty(0, dtype=np.uint8)
+
+        self._lookup = {}
+        self._pending = []
+        self._n_pending = 0
+        self._groups = None
+
+        if records is not None:
+            self.extend(records)
+
+    def __len__(self):
+        self._compact()
+        return len(self.agent_ids)
+
+    def __getitem__(self, i: int):
+        self._compact()
+        return {
+            "agent_name": self.agent_names[self.agent_ids[i]],
+            "prompt": self.prompt(i),
+        }
+
+    def __iter__(self) -> Iterator[dict]:
+        self._compact()
+        for i in range(len(self.agent_ids)):
+            yield self[i]
+
+    def intern(self, agent: str):
+        """
+        Returns the integer id of an agent name, assigning a new id if the
+        name has not been seen before.
+        """
+        if agent not in self._lookup:
+            self._lookup[agent] = len(self.agent_names)
+            self.agent_names.append(agent)
+
+        return self._lookup[agent]
+
+    def agent_id(self, agent: str):
+        """
+        Returns the integer id of an agent name, or `-1` if there are no
+        prompts for it.
+        """
+        return self._lookup.get(agent, -1)
+
+    def extend(self, records: Iterable[dict]):
+        """
+        Appends prompts to the table. The new prompts are buffered and merged
+        into the columns the next time the table is read, or once the buffer
+        grows as large as the table, so that repeated small appends do not
+        each copy the whole table.
+
+        Args:
+            records: An iterable of dictionaries with the keys `agent_name`
+                     and `prompt`.
+        """
+        ids = []
+        encoded = []
+        for record in records:
+            ids.append(self.intern(record["agent_name"]))
+            encoded.append(record["prompt"].encode())
+
+        if len(ids) > 0:
+            self._pending.append((ids, encoded))
+            self._n_pending += len(ids)
+            self._groups = None
+
+        if self._n_pending >= max(PENDING_LIMIT, len(self.agent_ids)):
+            self._compact()
+
+    def _compact(self):
+        """
+        Merges the buffered appends into the columns.
+        """
+        if len(self._pending) == 0:
+            return
+
+        ids = [self.agent_ids]
+        lengths = [np.diff(self.offsets)]
+        data = [self.data]
+        for pending_ids, encoded in self._pending:
+            ids.append(np.asarray(pending_ids, dtype=np.int32))
+            lengths.append(np.fromiter(map(len, encoded), dtype=np.int64,
+                                       count=len(encoded)))
+            data.append(np.frombuffer(b"".join(encoded), dtype=np.uint8))
+
+        self.agent_ids = np.concatenate(ids)
+        self.offsets = np.concatenate(([0], np.cumsum(np.concatenate(lengths))))
+        self.data = np.concatenate(data)
+        self._pending = []
+        self._n_pending = 0
+
+    def prompt(self, i: int):
+        """
+        Returns the text of the `i`-th prompt.
+        """
+        self._compact()
+        return self.data[self.offsets[i]:self.offsets[i + 1]].tobytes().decode()
+
+    def prompts(self, indices: Optional[np.ndarray] = None):
+        """
+        Returns the texts of the prompts at `indices`, or of every prompt.
+        """
+        table = self.take(indices) if indices is not None else self
+        table._compact()
+        buffer = table.data.tobytes()
+        offsets = table.offsets.tolist()
+        return [
+            buffer[offsets[i]:offsets[i + 1]].decode()
+            for i in range(len(offsets) - 1)
+        ]
+
+    def to_records(self):
+        """
+        Returns every prompt as a list of dictionaries with the keys
+        `agent_name` and `prompt`.
+        """
+        self._compact()
+        names = [self.agent_names[i] for i in self.agent_ids.tolist()]
+        return [
+            {"agent_name": name, "prompt": prompt}
+            for name, prompt in zip(names, self.prompts())
+        ]
+
+    def groups(self):
+        """
+        Returns the per-agent index arrays as a tuple `(order, bounds)`, where
+        the prompts of the agent with id `i` are at the indices
+        `order[bounds[i]:bounds[i + 1]]` in their original relative order.
+        """
+        self._compact()
+        if self._groups is None:
+            order = np.argsort(self.agent_ids, kind="stable")
+            bounds = np.searchsorted(self.agent_ids[order],
+                                     np.arange(len(self.agent_names) + 1))
+            self._groups = (order, bounds)
+
+        return self._groups
+
+    def counts(self):
+        """
+        Returns the number of prompts of every agent id.
+        """
+        self._compact()
+        return np.bincount(self.agent_ids, minlength=len(self.agent_names))
+
+    def agent_indices(self, agent: str):
+        """
+        Returns the indices of the prompts of the given agent in table order.
+        """
+        i = self.agent_id(agent)
+        if i < 0:
+            return np.empty(0, dtype=np.int64)
+
+        order, bounds = self.groups()
+        return order[bounds[i]:bounds[i + 1]]
+
+    def take(self, indices: np.ndarray):
+        """
+        Returns a new table holding the prompts at `indices` in that order.
+        The text buffer is gathered with a single vectorized index operation.
+
+        Args:
+            indices: An array of prompt indices or a boolean mask.
+        """
+        self._compact()
+        indices = np.arange(len(self.agent_ids))[indices]
+        starts  = self.offsets[indices]
+        lengths = self.offsets[indices + 1] - starts
+        offsets = np.concatenate(([0], np.cumsum(lengths)))
+        gather  = np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1])
+
+        table = PromptTable()
+        table.agent_names = list(self.agent_names)
+        table._lookup = dict(self._lookup)
+        table.agent_ids = self.agent_ids[indices]
+        table.offsets = offsets
+        table.data = self.data[gather]
+        return table
+
+    def save(self, path: str):
+        """
+        Saves the table in the NumPy `.npz` format.
+        """
+        self._compact()
+        np.savez(path,
+                 agent_names=np.array(self.agent_names, dtype=np.str_),
+                 agent_ids=self.agent_ids,
+                 offsets=self.offsets,
+                 data=self.data)
+
+    @staticmethod
+    def load(path: str):
+        """
+        Returns a table loaded from a `.npz` file written by `save`.
+        """
+        table = PromptTable()
+        with np.load(path, allow_pickle=False) as arrays:
+            table.agent_names = arrays["agent_names"].tolist()
+            table.agent_ids = arrays["agent_ids"]
+            table.offsets = arrays["offsets"]
+            table.data = arrays["data"]
+
+        table._lookup = {name: i for i, name in enumerate(table.agent_names)}
+        return table
@@ -0,0 +1,350 @@
+"""
+An evaluation harness for AgentRec. The test prompts are encoded once, and
+their similarities against the corpus are computed one block of prompts at a
+time. Every block is then scored by each requested score function and power,
+so a sweep over all registered score functions and values of `p` costs a
+single encoding pass.
+
+For every combination, the top-1 and top-k accuracy, the per-agent recall and
+the top-1 confusion matrix are reported. Encoders can also be compared on the
+same pool with `compare_encoders`, which reports their accuracy along with
+their fitting time, encoding throughput and recommendation latency.
+
+Usage:
+    python -m agentrec.eval --model ./models/test_model/ --p 50 100 200
+    python -m agentrec.eval --encoders all-mpnet-base-v2 hashing static:glove.txt
+"""
+import numpy as np
+
+from agentrec.models.encoders import HashingEncoder, StaticEncoder
+from agentrec.models.sbert import SBERTAgentRec
+from agentrec.models.scoring import SCORE_FUNCTIONS, get_score_function, top_k, uses_power
+
+from typing import Any, Callable, Iterable, Optional
+import argparse
+import json
+import time
+
+K = 3
+BATCH_SIZE = 256
+MAX_BLOCK_ELEMENTS = 1 << 24
+LATENCY_PROMPTS = 100
+
+def _name(score_function: str | Callable):
+    if isinstance(score_function, str):
+        return score_function
+
+    return getattr(score_function, "__name__", repr(score_function))
+
+def evaluate(
+    classifier,
+    prompts: list[str],
+    agent_names: list[str],
+    score_functions: Optional[list[str | Callable]] = None,
+    p: Optional[list[float]] = None,
+    k: int = K,
+    batch_size: int = BATCH_SIZE,
+    block_size: Optional[int] = None,
+):
+    """
+    Evaluates a fitted `SBERTAgentRec` on labeled prompts for every
+    combination of score function and power. The classifier itself is left
+    unchanged, and its exact scoring path is used even if it has an index.
+
+    Args:
+        classifier: A fitted `SBERTAgentRec`.
+        prompts: The prompts to evaluate on.
+        agent_names: The true agent of every prompt.
+        score_functions: The names of the score functions or callables to
+                         evaluate. Defaults to every registered score
+                         function.
+        p: The powers to evaluate every score function with. Score functions
+           which ignore the power are evaluated once, with a `p` of `None` in
+           their results. Defaults to the power of the classifier.
+        k: The number of recommendations considered for top-k accuracy.
+           Defaults to `3`.
+        batch_size: The batch size used to encode the prompts. Defaults to
+                    `256`.
+        block_size: The number of prompts whose similarities against the
+                    corpus are held in memory at once. Defaults to as many as
+                    fit in `2 ** 24` similarities.
+
+    Returns:
+        A dictionary with the keys `agents`, `prompts` (the number of
+        prompts), `k`, `encode_seconds`, `score_seconds` and `results`, a list
+        with one dictionary per combination with the keys `score_function`,
+        `p`, `accuracy`, `top_k_accuracy`, `recall` (a dictionary mapping
+        every agent to the fraction of its prompts ranked first) and
+        `confusion` (a nested list counting the prompts of every true agent,
+        by row, by the agent ranked first, by column).
+    """
+    if len(prompts) != len(agent_names):
+        raise ValueError("There must be one agent name per prompt")
+
+    index = {agent: i for i, agent in enumerate(classifier.agents)}
+    unknown = sorted(set(agent_names) - set(index))
+    if len(unknown) > 0:
+        raise ValueError(f"Unknown agents {unknown}")
+
+    if score_functions is None:
+        score_functions = list(SCORE_FUNCTIONS)
+    if p is None:
+        p = [classifier.p]
+
+    # Score functions which ignore the power are only evaluated once
+    combinations = []
+    for score_function in score_functions:
+        fn = get_score_function(score_function)
+        powers = p if uses_power(fn) else [None]
+        combinations += [(_name(score_function), fn, power) for power in powers]
+
+    n_agents = len(classifier.agents)
+    k        = min(k, n_agents)
+    truth    = np.array([index[name] for name in agent_names], dtype=np.int64)
+
+    if block_size is None:
+        block_size = max(1, MAX_BLOCK_ELEMENTS // max(len(classifier.embeddings), 1))
+
+    start   = time.perf_counter()
+    queries = classifier.encode(prompts, batch_size)
+    encode_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    top   = np.empty((len(combinations), len(prompts), k), dtype=np.int64)
+    for begin in range(0, len(prompts), block_size):
+        similarities = classifier._similarities(queries[begin:begin+block_size])
+        for i, (_, score_function, power) in enumerate(combinations):
+            scores = classifier.reduce(similarities,
+                                       classifier.offsets,
+                                       classifier.weights,
+                                       score_function=score_function,
+                                       p=power)
+            top[i, begin:begin+block_size] = top_k(scores, k)
+
+    score_seconds = time.perf_counter() - start
+
+    support = np.bincount(truth, minlength=n_agents)
+    results = []
+    for (name, _, power), predictions in zip(combinations, top):
+        confusion = np.bincount(truth * n_agents + predictions[:, 0],
+                                minlength=n_agents * n_agents)
+        confusion = confusion.reshape(n_agents, n_agents)
+        recall  = np.diag(confusion) / np.maximum(support, 1)
+        correct = predictions == truth[:, None]
+
+        results.append({
+            "score_function": name,
+            "p": power,
+            "accuracy": float(correct[:, 0].sum() / max(len(truth), 1)),
+            "top_k_accuracy": float(correct.any(axis=1).sum() / max(len(truth), 1)),
+            "recall": {
+                agent: float(recall[i])
+                for i, agent in enumerate(classifier.agents)
+                if support[i] > 0
+            },
+            "confusion": confusion.tolist(),
+        })
+
+    return {
+        "agents": list(classifier.agents),
+        "prompts": len(prompts),
+        "k": k,
+        "encode_seconds": encode_seconds,
+        "score_seconds": score_seconds,
+        "results": results,
+    }
+
+def format_report(report: dict):
+    """
+    Returns a table of the accuracies of an `evaluate` report, sorted from the
+    most to the least accurate combination, followed by the per-agent recall
+    of the best one.
+    """
+    results = sorted(report["results"],
+                     key=lambda result: (-result["accuracy"], -result["top_k_accuracy"]))
+    width = max([len("score function")] + [len(r["score_function"]) for r in results])
+
+    lines = [
+        f"{report['prompts']} prompts encoded in {report['encode_seconds']:.2f}s, "
+        f"{len(results)} combinations scored in {report['score_seconds']:.2f}s",
+        f"{'score function':<{width}}  {'p':>8}  {'top-1':>7}  {'top-' + str(report['k']):>7}",
+    ]
+    for result in results:
+        power = f"{result['p']:g}" if result["p"] is not None else "-"
+        lines.append(f"{result['score_function']:<{width}}  {power:>8}  "
+                     f"{result['accuracy']:>7.4f}  {result['top_k_accuracy']:>7.4f}")
+
+    if len(results) > 0:
+        best = results[0]
+        power = f", p={best['p']:g}" if best["p"] is not None else ""
+        lines.append(f"Recall per agent ({best['score_function']}{power}):")
+        for agent, recall in best["recall"].items():
+            lines.append(f"    {agent}: {recall:.4f}")
+
+    return "\n".join(lines)
+
+def compare_encoders(
+    encoders: dict[str, Any],
+    training_samples: Iterable[dict],
+    prompts: list[str],
+    agent_names: list[str],
+    k: int = K,
+    latency_prompts: int = LATENCY_PROMPTS,
+    **kwargs,
+):
+    """
+    Compares encoders on the same pool. An `SBERTAgentRec` is fitted with
+    every encoder on the same training samples, then evaluated on the same
+    prompts with its configured score function.
+
+    Args:
+        encoders: A dictionary mapping a label to anything `SBERTAgentRec`
+                  accepts as its model, such as a model name or an `Encoder`.
+        training_samples: The training samples to fit every classifier on.
+        prompts: The prompts to evaluate on.
+        agent_names: The true agent of every prompt.
+        k: The number of recommendations considered for top-k accuracy.
+           Defaults to `3`.
+        latency_prompts: The number of prompts recommended one at a time to
+                         measure the latency of a single recommendation.
+                         Defaults to `100`.
+        kwargs: The other arguments of `SBERTAgentRec`, such as
+                `score_function` and `p`.
+
+    Returns:
+        A list of dictionaries with the keys `encoder`, `dim`, `fit_seconds`
+        (which includes loading the model), `encode_throughput` (prompts
+        encoded per second in batches), `p50_seconds` and `p99_seconds` (the
+        latency of `get_agent`), `accuracy`, `top_k_accuracy` and `recall`.
+    """
+    if iter(training_samples) is training_samples:
+        training_samples = list(training_samples)
+
+    results = []
+    for label, encoder in encoders.items():
+        classifier = SBERTAgentRec(encoder, **kwargs)
+
+        start = time.perf_counter()
+        classifier.fit(training_samples)
+        fit_seconds = time.perf_counter() - start
+
+        report = evaluate(classifier,
+                          prompts,
+                          agent_names,
+                          score_functions=[classifier.score_function],
+                          p=[classifier.p],
+                          k=k)
+
+        latencies = []
+        for prompt in prompts[:latency_prompts]:
+            start = time.perf_counter()
+            classifier.get_agent(prompt)
+            latencies.append(time.perf_counter() - start)
+
+        latencies = latencies if len(latencies) > 0 else [0.0]
+        result = report["results"][0]
+        results.append({
+            "encoder": label,
+            "dim": int(classifier.encoder.dim),
+            "fit_seconds": fit_seconds,
+            "encode_throughput": len(prompts) / max(report["encode_seconds"], 1e-12),
+            "p50_seconds": float(np.percentile(latencies, 50)),
+            "p99_seconds": float(np.percentile(latencies, 99)),
+            "accuracy": result["accuracy"],
+            "top_k_accuracy": result["top_k_accuracy"],
+            "recall": result["recall"],
+        })
+
+    return results
+
+def format_comparison(results: list[dict]):
+    """
+    Returns a table of the results of `compare_encoders`.
+    """
+    width = max([len("encoder")] + [len(result["encoder"]) for result in results])
+    lines = [
+        f"{'encoder':<{width}}  {'dim':>5}  {'fit (s)':>8}  {'prompts/s':>10}  "
+        f"{'p50 (ms)':>8}  {'p99 (ms)':>8}  {'top-1':>7}  {'top-k':>7}",
+    ]
+    for result in results:
+        lines.append(f"{result['encoder']:<{width}}  {result['dim']:>5}  "
+                     f"{result['fit_seconds']:>8.2f}  "
+                     f"{result['encode_throughput']:>10.0f}  "
+                     f"{result['p50_seconds'] * 1000:>8.2f}  "
+                     f"{result['p99_seconds'] * 1000:>8.2f}  "
+                     f"{result['accuracy']:>7.4f}  "
+                     f"{result['top_k_accuracy']:>7.4f}")
+
+    return "\n".join(lines)
+
+def _parse_encoder(spec: str):
+    """
+    Returns the encoder described by a command line argument, which is either
+    `hashing`, `hashing:<dim>`, `static:<path>` or a SentenceTransformer model.
+    """
+    kind, _, argument = spec.partition(":")
+    if kind == "hashing":
+        return HashingEncoder(int(argument)) if argument else HashingEncoder()
+
+    if kind == "static":
+        return StaticEncoder.load(argument)
+
+    return spec
+
+def main(argv: Optional[list[str]] = None):
+    from agentrec.datasets import PromptPool
+
+    parser = argparse.ArgumentParser(description="Evaluate AgentRec on a test split")
+    parser.add_argument("--model", default="all-mpnet-base-v2")
+    parser.add_argument("--encoders", nargs="+", default=None,
+                        help="Compare encoders instead, each being hashing, "
+                             "hashing:<dim>, static:<path> or a model name")
+    parser.add_argument("--train", default="./data/train.jsonl")
+    parser.add_argument("--test", default="./data/test.jsonl")
+    parser.add_argument("--agents", default="./data/agents.jsonl")
+    parser.add_argument("--cache-dir", default=None)
+    parser.add_argument("--score-functions", nargs="+", default=None,
+                        help="Defaults to every registered score function")
+    parser.add_argument("--p", type=float, nargs="+", default=None)
+    parser.add_argument("--k", type=int, default=K)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--output", default=None,
+                        help="The file to write the full JSON report to")
+    args = parser.parse_args(argv)
+
+    test_pool = PromptPool()
+    test_pool.load(path=args.test, agent_path=args.agents)
+    prompts = [obj["prompt"] for obj in test_pool.pool]
+    labels  = [obj["agent_name"] for obj in test_pool.pool]
+
+    if args.encoders is not None:
+        results = compare_encoders({spec: _parse_encoder(spec) for spec in args.encoders},
+                                   PromptPool.stream(args.train),
+                                   prompts,
+                                   labels,
+                                   k=args.k)
+        print(format_comparison(results))
+
+        if args.output is not None:
+            with open(args.output, "w") as output_file:
+                json.dump(results, output_file, indent=2)
+        return
+
+    classifier = SBERTAgentRec(args.model, cache_dir=args.cache_dir)
+    classifier.fit(PromptPool.stream(args.train))
+
+    report = evaluate(classifier,
+                      prompts,
+                      labels,
+                      score_functions=args.score_functions,
+                      p=args.p,
+                      k=args.k,
+                      batch_size=args.batch_size)
+    print(format_report(report))
+
+    if args.output is not None:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Vectorized hashing of character shingles, shared by the MinHash
+near-duplicate detection of `agentrec.datasets` and the `HashingEncoder` of
+`agentrec.models`.
+"""
+import numpy as np
+
+NGRAM = 5
+
+def normalize(prompt: str):
+    """
+    Returns the form of a prompt which is shingled. Case and runs of
+    whitespace are ignored when looking for near-duplicates.
+    """
+    return " ".join(prompt.lower().split())
+
+def fmix(h: np.ndarray):
+    """
+    The 32-bit finalizer of MurmurHash3, which spreads the bits of a
+    polynomial shingle hash. It is used by MinHash to hash shingles and by
+    `HashingEncoder` to bucket them.
+    """
+    h = h ^ (h >> np.uint64(16))
+    h = (h * np.uint64(0x85ebca6b)) & np.uint64(0xffffffff)
+    h = h ^ (h >> np.uint64(13))
+    h = (h * np.uint64(0xc2b2ae35)) & np.uint64(0xffffffff)
+    return h ^ (h >> np.uint64(16))
+
+def shingle_hashes(prompts: list[str], ngram: int = NGRAM):
+    """
+    Hashes the character n-gram shingles of a list of prompts. The prompts
+    are packed into one byte buffer and every shingle is hashed by a
+    vectorized polynomial hash, so no Python loop runs per shingle.
+
+    Args:
+        prompts: The prompts to hash the shingles of.
+        ngram: The number of bytes per shingle. Defaults to `5`.
+
+    Returns:
+        A tuple `(hashes, counts)` of the 32-bit hashes of the shingles of
+        every prompt, stored back to back as `uint64`, and the number of
+        shingles of every prompt.
+    """
+    if len(prompts) == 0:
+        return np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.int64)
+
+    # Each prompt is followed by `ngram - 1` zero bytes, so prompts shorter
+    # than a shingle still hash to a single padded shingle
+    encoded = [normalize(prompt).encode() for prompt in prompts]
+    lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded))
+    padding = b"\0" * (ngram - 1)
+    buffer  = np.frombuffer(padding.join(encoded) + padding, dtype=np.uint8)
+    starts  = np.concatenate(([0], np.cumsum(lengths + ngram - 1)[:-1]))
+    counts  = np.maximum(lengths - ngram + 1, 1)
+
+    offsets  = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    position = np.repeat(starts - offsets, counts) + np.arange(counts.sum())
+
+    h = np.zeros(len(position), dtype=np.uint64)
+    for i in range(ngram):
+        h = (h * np.uint64(257) + buffer[position + i]) & np.uint64(0xffffffff)
+
+    return fmix(h), counts
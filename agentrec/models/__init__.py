@@ -1 +1,40 @@
-from agentrec.models.sbert import SBERTAgentRec
+"""
+The public classes and functions of `agentrec.models`. They are imported
+lazily on first access, so importing the package does not import
+sentence-transformers or any module which is not used.
+"""
+import importlib
+
+_EXPORTS = {
+    "SBERTAgentRec": "agentrec.models.sbert",
+    "SCORE_FUNCTIONS": "agentrec.models.scoring",
+    "get_score_function": "agentrec.models.scoring",
+    "register": "agentrec.models.scoring",
+    "IVFIndex": "agentrec.models.ann",
+    "evaluate_index": "agentrec.models.ann",
+    "QueryCache": "agentrec.models.cache",
+    "clean": "agentrec.models.cleaning",
+    "evaluate_compression": "agentrec.models.prototypes",
+    "evaluate_quantization": "agentrec.models.quantize",
+    "Metrics": "agentrec.models.metrics",
+    "profile": "agentrec.models.metrics",
+    "parallel_encode": "agentrec.models.parallel",
+    "Encoder": "agentrec.models.encoders",
+    "SentenceTransformerEncoder": "agentrec.models.encoders",
+    "HashingEncoder": "agentrec.models.encoders",
+    "StaticEncoder": "agentrec.models.encoders",
+    "get_encoder": "agentrec.models.encoders",
+}
+
+__all__ = list(_EXPORTS)
+
+def __getattr__(name: str):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    value = getattr(importlib.import_module(_EXPORTS[name]), name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,325 @@
+import numpy as np
+
+from agentrec.models.quantize import nearest_per_segment
+from agentrec.models.scoring import top_k
+
+from typing import Optional
+import math
+import time
+
+N_ITER = 10
+N_PROBE = 8
+TOP_N = 32
+BLOCK_SIZE = 4096
+TRAIN_PER_CELL = 64
+
+def per_agent_top_n(
+    similarities: np.ndarray,
+    rows: np.ndarray,
+    labels: np.ndarray,
+    n_agents: int,
+    top_n: int,
+):
+    """
+    Selects the `top_n` largest similarities of every agent among a set of
+    candidate corpus rows. Agents with fewer than `top_n` candidates are padded
+    with a row id of `-1` and a similarity of `-1`, the lowest possible, and
+    `SBERTAgentRec` leaves the padding out of the agent scores.
+
+    The labels only have to identify groups of candidates, so the candidates
+    of several queries can be selected at once by labelling them with
+    `query * n_agents + agent` and passing `n_queries * n_agents` agents.
+
+    Args:
+        similarities: The similarities between a query and the candidates.
+        rows: The corpus row ids of the candidates.
+        labels: The agent index of every candidate.
+        n_agents: The total number of agents.
+        top_n: The number of candidates to keep per agent.
+
+    Returns:
+        A tuple of two `(n_agents, top_n)` arrays holding the selected
+        similarities and their corpus row ids, sorted from best to worst.
+    """
+    values = np.full((n_agents, top_n), -1, dtype=np.float32)
+    ids    = np.full((n_agents, top_n), -1, dtype=np.int64)
+
+    # Similarities lie in [-1, 1], so one sort of this key orders the
+    # candidates by agent and then from the most to the least similar
+    order  = np.argsort(labels * 4.0 + (1 - np.asarray(similarities, dtype=np.float64)))
+    sorted_labels = labels[order]
+    starts = np.searchsorted(sorted_labels, np.arange(n_agents))
+    rank   = np.arange(len(order)) - starts[sorted_labels]
+    keep   = rank < top_n
+
+    values[sorted_labels[keep], rank[keep]] = similarities[order][keep]
+    ids[sorted_labels[keep], rank[keep]] = rows[order][keep]
+    return values, ids
+
+def spherical_kmeans(
+    x: np.ndarray,
+    n_clusters: int,
+    n_iter: int = N_ITER,
+    rng: Optional[np.random.Generator] = None,
+):
+    """
+    Runs spherical k-means on the normalized rows of `x`, starting from
+    randomly chosen rows. Clusters which become empty keep their previous
+    centroid.
+
+    Returns:
+        A tuple of the normalized `(n_clusters, dim)` centroids and the
+        cluster of every row.
+    """
+    rng = rng if rng is not None else np.random.default_rng(0)
+    centroids = x[rng.choice(len(x), n_clusters, replace=False)]
+
+    for _ in range(n_iter):
+        cells = np.argmax(x @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, cells, x)
+
+        # Empty cells keep their previous centroid
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        centroids = np.where(norms > 0,
+                             sums / np.maximum(norms, 1e-12),
+                             centroids)
+
+    return centroids, np.argmax(x @ centroids.T, axis=1)
+
+class IVFIndex:
+    """
+    An approximate nearest neighbour index over the normalized corpus
+    embeddings of an `SBERTAgentRec`, implemented as an inverted file (IVF).
+    The corpus is partitioned into cells by spherical k-means, and a query is
+    only compared to the prompts in the `n_probe` cells whose centroids are
+    the most similar to it.
+
+    The index returns the `top_n` most similar prompts of every agent, so that
+    the score function runs on a small candidate set. This works best with
+    score functions dominated by the largest similarities such as `log_pmean`
+    or `max`.
+
+    Args:
+        n_cells: The number of k-means cells. Defaults to `4 * sqrt(n)` for a
+                 corpus of `n` prompts.
+        n_probe: The number of cells visited per query. Defaults to `8`.
+        n_iter: The number of k-means iterations. Defaults to `10`.
+        train_size: The maximum number of prompts that k-means is trained on.
+                    Defaults to `64` prompts per cell.
+        seed: The random seed used for k-means. Defaults to `0`.
+    """
+    def __init__(
+        self,
+        n_cells: Optional[int] = None,
+        n_probe: int = N_PROBE,
+        n_iter: int = N_ITER,
+        train_size: Optional[int] = None,
+        seed: int = 0,
+    ):
+        self.n_cells = n_cells
+        self.n_probe = n_probe
+        self.n_iter = n_iter
+        self.train_size = train_size
+        self.seed = seed
+
+        self.centroids = None
+        self.order = None
+        self.cell_offsets = None
+        self.embeddings = None
+        self.labels = None
+        self.n_agents = 0
+
+    def build(
+        self,
+        embeddings: np.ndarray,
+        labels: np.ndarray,
+        n_agents: int,
+        retrain: bool = True,
+    ):
+        """
+        Partitions the corpus into cells. If `retrain` is `False` and the
+        index has already been trained, then the existing centroids are kept
+        and the corpus is only reassigned to them, which is much cheaper.
+
+        Args:
+            embeddings: The normalized corpus embedding matrix.
+            labels: The agent index of every corpus row.
+            n_agents: The total number of agents.
+            retrain: Whether the k-means centroids should be trained again.
+        """
+        self.embeddings = embeddings
+        self.labels = np.asarray(labels)
+        self.n_agents = n_agents
+
+        if retrain or self.centroids is None:
+            self.centroids = self._train(embeddings)
+
+        cells = self._assign(embeddings)
+        self.order = np.argsort(cells, kind="stable")
+        self.cell_offsets = np.searchsorted(cells[self.order],
+                                            np.arange(len(self.centroids) + 1))
+
+    def _train(self, embeddings: np.ndarray):
+        """
+        Runs spherical k-means on a random sample of the corpus and returns
+        the normalized centroids.
+        """
+        rng = np.random.default_rng(self.seed)
+        n_cells = self.n_cells
+        if n_cells is None:
+            n_cells = int(4 * math.sqrt(len(embeddings)))
+        n_cells = max(1, min(n_cells, len(embeddings)))
+
+        train_size = self.train_size
+        if train_size is None:
+            train_size = TRAIN_PER_CELL * n_cells
+        train_size = min(train_size, len(embeddings))
+
+        sample = np.sort(rng.choice(len(embeddings), train_size, replace=False))
+        sample = np.asarray(embeddings[sample], dtype=np.float32)
+        centroids, _ = spherical_kmeans(sample, n_cells, self.n_iter, rng)
+        return centroids
+
+    def _assign(self, embeddings: np.ndarray):
+        """
+        Returns the nearest cell of every embedding, computed in blocks so
+        that the full similarity matrix is never materialized.
+        """
+        cells = np.empty(len(embeddings), dtype=np.int64)
+        for start in range(0, len(embeddings), BLOCK_SIZE):
+            block = np.asarray(embeddings[start:start+BLOCK_SIZE])
+            cells[start:start+BLOCK_SIZE] = np.argmax(block @ self.centroids.T,
+                                                      axis=1)
+
+        return cells
+
+    def search(self, queries: np.ndarray, top_n: int = TOP_N):
+        """
+        Returns the `top_n` most similar corpus prompts of every agent for
+        each query among the prompts of the probed cells.
+
+        Args:
+            queries: A 2D array of normalized query embeddings.
+            top_n: The number of candidates to return per agent.
+
+        Returns:
+            A tuple of two `(len(queries), n_agents, top_n)` arrays holding the
+            similarities and corpus row ids of the candidates. Missing
+            candidates have a similarity of `-1` and a row id of `-1`.
+        """
+        if self.centroids is None:
+            raise RuntimeError("The index must be built before searching")
+
+        queries = np.atleast_2d(queries)
+        n_probe = min(self.n_probe, len(self.centroids))
+        probes  = np.argpartition(-(queries @ self.centroids.T),
+                                  n_probe - 1,
+                                  axis=1)[:, :n_probe]
+
+        # The probed cells of a block of queries are gathered together, with
+        # blocks sized so that about `BLOCK_SIZE` candidates are compared
+        counts = np.diff(self.cell_offsets)[probes]
+        totals = counts.sum(axis=1)
+        step   = max(1, BLOCK_SIZE // max(1, int(totals.mean())))
+
+        values = np.empty((len(queries), self.n_agents, top_n), dtype=np.float32)
+        ids    = np.empty((len(queries), self.n_agents, top_n), dtype=np.int64)
+        for start in range(0, len(queries), step):
+            block   = slice(start, start + step)
+            n_block = len(totals[block])
+            sizes   = counts[block].ravel()
+            firsts  = self.cell_offsets[probes[block]].ravel()
+            rows    = self.order[np.repeat(firsts - np.cumsum(sizes) + sizes, sizes) +
+                                 np.arange(sizes.sum())]
+            owners  = np.repeat(np.arange(n_block), totals[block])
+
+            # Queries of a block often probe the same cells, so every distinct
+            # row is read once and compared to all queries of the block
+            unique, inverse = np.unique(rows, return_inverse=True)
+            similarities = np.asarray(self.embeddings[unique]) @ queries[block].T
+            block_values, block_ids = per_agent_top_n(similarities[inverse, owners],
+                                                      rows,
+                                                      owners * self.n_agents + self.labels[rows],
+                                                      n_block * self.n_agents,
+                                                      top_n)
+            values[block] = block_values.reshape(n_block, self.n_agents, top_n)
+            ids[block]    = block_ids.reshape(n_block, self.n_agents, top_n)
+
+        return values, ids
+
+def evaluate_index(
+    classifier,
+    prompts: list[str],
+    agent_names: Optional[list[str]] = None,
+    k: int = 1,
+):
+    """
+    Compares the approximate nearest neighbour path of a fitted
+    `SBERTAgentRec` against its exact path on the given prompts. The prompts
+    are encoded once and scored by both paths.
+
+    Args:
+        classifier: A fitted `SBERTAgentRec` with an index.
+        prompts: The prompts to evaluate on.
+        agent_names: The optional true agent of every prompt. If it is given,
+                     then the top-k accuracy of both paths is reported.
+        k: The number of recommendations considered for top-k accuracy and
+           agreement. Defaults to `1`.
+
+    Returns:
+        A dictionary with the keys `recall` (the fraction of the exact per-agent
+        top-n neighbours found by the index), `agreement` (the fraction of
+        prompts where both paths recommend the same top-k agents), the seconds
+        spent scoring by each path and, if `agent_names` is given, the
+        accuracy of each path.
+    """
+    index = classifier.index
+    if index is None:
+        raise ValueError("The classifier does not have an index")
+
+    queries = classifier.encode(prompts)
+
+    start = time.perf_counter()
+    exact = classifier._score_matrix(queries, exact=True)
+    exact_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    approximate = classifier._score_matrix(queries)
+    approximate_seconds = time.perf_counter() - start
+
+    # The exact neighbours of every agent are selected for a block of
+    # queries at a time, and an exact neighbour can only have been found
+    # among the candidates of the same query and agent
+    _, ids = index.search(queries, classifier.top_n)
+    found = 0
+    total = 0
+    step  = max(1, BLOCK_SIZE * 256 // max(1, len(classifier.embeddings)))
+    for start in range(0, len(queries), step):
+        similarities = classifier._similarities(queries[start:start+step])
+        true_ids = nearest_per_segment(-similarities,
+                                       classifier.offsets,
+                                       classifier.top_n)
+        matches = true_ids[..., :, None] == ids[start:start+step, :, None, :]
+        found  += np.sum(np.any(matches, axis=-1) & (true_ids >= 0))
+        total  += np.sum(true_ids >= 0)
+
+    exact_top = top_k(exact, k)
+    approximate_top = top_k(approximate, k)
+    report = {
+        "recall": float(found / max(total, 1)),
+        "agreement": float(np.mean(np.all(np.sort(exact_top, axis=1) ==
+                                          np.sort(approximate_top, axis=1),
+                                          axis=1))),
+        "exact_seconds": exact_seconds,
+        "approximate_seconds": approximate_seconds,
+    }
+
+    if agent_names is not None:
+        truth = np.array([[classifier.agents.index(name)] for name in agent_names])
+        report["exact_accuracy"] = \
+            float(np.mean(np.any(exact_top == truth, axis=1)))
+        report["approximate_accuracy"] = \
+            float(np.mean(np.any(approximate_top == truth, axis=1)))
+
+    return report
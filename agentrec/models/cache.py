@@ -0,0 +1,377 @@
+import numpy as np
+
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Hashable, Optional
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+import unicodedata
+
+EMBEDDINGS_FILE = "embeddings.npy"
+HASHES_FILE = "hashes.npy"
+METADATA_FILE = "metadata.json"
+CACHE_VERSION = 2
+
+def _prompt_sha256(agent: str, prompt: str):
+    return hashlib.sha256(f"{agent}\0{prompt}".encode()).digest()
+
+def prompt_digest(agent: str, prompts: list[str]):
+    """
+    Returns an order-independent digest of an agent's prompts. The digest is
+    the sum of the SHA-256 hashes of every prompt modulo `2 ** 256`, so it can
+    be updated incrementally as prompts are added or removed.
+
+    Args:
+        agent: The name of the agent which the prompts belong to.
+        prompts: The prompts to compute the digest of.
+    """
+    digest = 0
+    for prompt in prompts:
+        digest += int.from_bytes(_prompt_sha256(agent, prompt), "big")
+
+    return digest % (1 << 256)
+
+def prompt_hashes(agent: str, prompts: list[str]):
+    """
+    Returns a 64-bit hash of every prompt of an agent as a `uint64` array.
+    Unlike `prompt_digest`, these identify individual rows of a corpus, so
+    that rows can be matched to their prompts regardless of their order.
+
+    Args:
+        agent: The name of the agent which the prompts belong to.
+        prompts: The prompts to hash.
+    """
+    return np.array([
+        int.from_bytes(_prompt_sha256(agent, prompt)[:8], "big")
+        for prompt in prompts
+    ], dtype=np.uint64)
+
+def match_rows(source: np.ndarray, target: np.ndarray):
+    """
+    Returns the permutation `order` such that `source[order]` equals
+    `target`, where both are arrays of row hashes computed by
+    `prompt_hashes`, or `None` if they do not hold the same hashes. Rows with
+    equal hashes hold the same prompt, so they are interchangeable.
+    """
+    source = np.asarray(source)
+    target = np.asarray(target)
+    if len(source) != len(target):
+        return None
+
+    by_source = np.argsort(source, kind="stable")
+    by_target = np.argsort(target, kind="stable")
+    if not np.array_equal(source[by_source], target[by_target]):
+        return None
+
+    order = np.empty(len(target), dtype=np.int64)
+    order[by_target] = by_source
+    return order
+
+def corpus_hash(agents: list[str], digests: dict[str, int]):
+    """
+    Returns the content hash of a corpus given its agent order and the
+    per-agent digests computed by `prompt_digest`.
+    """
+    content = hashlib.sha256()
+    for agent in agents:
+        content.update(agent.encode())
+        content.update(digests[agent].to_bytes(32, "big"))
+
+    return content.hexdigest()
+
+def cache_key(fingerprint: str, content_hash: str):
+    """
+    Returns the key which a cached corpus is validated against. The key
+    changes whenever either the model weights or the corpus change.
+    """
+    return hashlib.sha256(
+        f"{CACHE_VERSION}:{fingerprint}:{content_hash}".encode()
+    ).hexdigest()
+
+class EmbeddingCache:
+    """
+    A directory which persists the fitted corpus embeddings of an
+    `SBERTAgentRec` as a `.npy` matrix alongside a small JSON metadata file.
+    Cached embeddings are memory-mapped when loaded, so a warm start costs
+    little more than opening the file.
+
+    The cache key only covers the set of prompts of every agent, so the same
+    cache is valid for any order of the training samples. The hash of the
+    prompt of every row is therefore stored as well, and row `i` of the
+    cached embeddings always holds the prompt whose hash is `hashes[i]`.
+
+    Args:
+        path: The directory where the cache is stored. It is created when the
+              cache is first saved.
+    """
+    def __init__(self, path: str):
+        self.path = Path(path)
+
+    def load(self, key: Optional[str] = None):
+        """
+        Returns the cached corpus as a dictionary with the keys `embeddings`,
+        `hashes`, `agents`, `sizes`, `digests` and `fingerprint`, or `None`
+        if there is no cache or its key does not match `key`. The embeddings
+        are a read-only memory map whose rows are in the order of `hashes`,
+        which may differ from the order of the samples given to `fit`. The
+        fingerprint is `None` for caches written before it was recorded.
+
+        Args:
+            key: The expected cache key. If it is `None`, then the cache is
+                 loaded without validation.
+        """
+        metadata_path = self.path / METADATA_FILE
+        if not metadata_path.exists():
+            return None
+
+        with open(metadata_path) as metadata_file:
+            metadata = json.load(metadata_file)
+
+        if metadata.get("version") != CACHE_VERSION:
+            return None
+
+        if key is not None and metadata["key"] != key:
+            return None
+
+        embeddings = np.load(self.path / EMBEDDINGS_FILE, mmap_mode="r")
+        hashes = np.load(self.path / HASHES_FILE)
+        if not len(embeddings) == len(hashes) == sum(metadata["sizes"]):
+            return None
+
+        return {
+            "key": metadata["key"],
+            "fingerprint": metadata.get("fingerprint"),
+            "embeddings": embeddings,
+            "hashes": hashes,
+            "agents": metadata["agents"],
+            "sizes": metadata["sizes"],
+            "digests": {
+                agent: int(digest, 16)
+                for agent, digest in metadata["digests"].items()
+            },
+        }
+
+    def allocate(self, shape: tuple[int, int]):
+        """
+        Returns a writable `float32` memory map of the given shape, backed by
+        a temporary file in the cache directory. Embeddings can be encoded
+        directly into it, and passing it to `save` then moves it into place
+        instead of writing the matrix again.
+        """
+        self.path.mkdir(parents=True, exist_ok=True)
+        return np.lib.format.open_memmap(f"{self.path / EMBEDDINGS_FILE}.tmp",
+                                         mode="w+",
+                                         dtype=np.float32,
+                                         shape=tuple(int(n) for n in shape))
+
+    def save(
+        self,
+        key: str,
+        embeddings: np.ndarray,
+        agents: list[str],
+        sizes: list[int],
+        digests: dict[str, int],
+        hashes: np.ndarray,
+        fingerprint: Optional[str] = None,
+    ):
+        """
+        Writes the corpus to the cache, replacing any previous contents. The
+        files are written to temporary paths first and then renamed, so a
+        crash never leaves a cache that validates against a partial matrix.
+        Returns the saved embeddings as a read-only memory map, which should
+        replace a memory map returned by `allocate`, since that one still
+        refers to the temporary path.
+
+        Args:
+            key: The key computed by `cache_key`.
+            embeddings: The contiguous embedding matrix, which may be a
+                        memory map returned by `allocate`.
+            agents: The agent order of the embedding segments.
+            sizes: The number of rows belonging to each agent.
+            digests: The per-agent digests computed by `prompt_digest`.
+            hashes: The hash of the prompt of every row computed by
+                    `prompt_hashes`.
+            fingerprint: The fingerprint of the model which computed the
+                         embeddings, so that they can be loaded without
+                         loading the model. Defaults to `None`.
+        """
+        self.path.mkdir(parents=True, exist_ok=True)
+        metadata_path = self.path / METADATA_FILE
+        embeddings_path = self.path / EMBEDDINGS_FILE
+        hashes_path = self.path / HASHES_FILE
+
+        # Invalidate first so that readers never pair new metadata with an
+        # old matrix or vice versa
+        metadata_path.unlink(missing_ok=True)
+
+        # A memory map which was already moved into place by an earlier save
+        # still refers to the temporary path, so the file must exist too
+        allocated = isinstance(embeddings, np.memmap) and \
+                    os.path.abspath(embeddings.filename) == \
+                    os.path.abspath(f"{embeddings_path}.tmp") and \
+                    os.path.exists(f"{embeddings_path}.tmp")
+        if allocated:
+            embeddings.flush()
+        else:
+            with open(f"{embeddings_path}.tmp", "wb") as embeddings_file:
+                np.save(embeddings_file, np.asarray(embeddings))
+        os.replace(f"{embeddings_path}.tmp", embeddings_path)
+
+        with open(f"{hashes_path}.tmp", "wb") as hashes_file:
+            np.save(hashes_file, np.asarray(hashes, dtype=np.uint64))
+        os.replace(f"{hashes_path}.tmp", hashes_path)
+
+        metadata = {
+            "version": CACHE_VERSION,
+            "key": key,
+            "fingerprint": fingerprint,
+            "agents": list(agents),
+            "sizes": [int(size) for size in sizes],
+            "digests": {agent: f"{digest:064x}" for agent, digest in digests.items()},
+        }
+
+        with open(f"{metadata_path}.tmp", "w") as metadata_file:
+            json.dump(metadata, metadata_file)
+        os.replace(f"{metadata_path}.tmp", metadata_path)
+
+        return np.load(embeddings_path, mmap_mode="r")
+
+def normalize_prompt(prompt: str):
+    """
+    Returns the form of a prompt used as a query cache key. Unicode is
+    normalized and runs of whitespace are collapsed, so prompts that only
+    differ in formatting share a cache entry.
+    """
+    return " ".join(unicodedata.normalize("NFKC", prompt).split())
+
+def _sizeof(value: Any):
+    """
+    Estimates the number of bytes held by a cached value.
+    """
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(_sizeof(item) for item in value)
+
+    return sys.getsizeof(value)
+
+class QueryCache:
+    """
+    A thread-safe least recently used cache for query embeddings and
+    recommendations, bounded by both its number of entries and the estimated
+    number of bytes that it holds. Entries optionally expire after a time to
+    live.
+
+    Args:
+        max_entries: The maximum number of entries. Defaults to `10000`.
+        max_bytes: The maximum number of bytes held by all entries. If it is
+                   `None`, then the cache is only bounded by `max_entries`.
+                   Defaults to `None`.
+        ttl: The number of seconds after which an entry expires. If it is
+             `None`, then entries never expire. Defaults to `None`.
+    """
+    def __init__(
+        self,
+        max_entries: int = 10000,
+        max_bytes: Optional[int] = None,
+        ttl: Optional[float] = None,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.nbytes = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: Hashable, default: Any = None):
+        """
+        Returns the value cached under `key`, marking it as recently used, or
+        `default` if there is no such entry or it has expired.
+
+        Args:
+            key: The key of the entry.
+            default: The value returned on a miss. Defaults to `None`.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] is not None and \
+               entry[2] <= time.monotonic():
+                self._remove(key)
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return default
+
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any, nbytes: Optional[int] = None):
+        """
+        Caches `value` under `key`, evicting the least recently used entries
+        until the cache is within its bounds again. Values larger than
+        `max_bytes` are not cached.
+
+        Args:
+            key: The key of the entry.
+            value: The value to cache.
+            nbytes: The size of the value in bytes. It is estimated if it is
+                    not specified.
+        """
+        nbytes = nbytes if nbytes is not None else _sizeof(value)
+        if self.max_bytes is not None and nbytes > self.max_bytes:
+            return
+
+        expiry = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            self._entries[key] = (value, nbytes, expiry)
+            self.nbytes += nbytes
+
+            while len(self._entries) > self.max_entries or \
+                  (self.max_bytes is not None and self.nbytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key: Hashable):
+        _, nbytes, _ = self._entries.pop(key)
+        self.nbytes -= nbytes
+
+    def clear(self):
+        """
+        Removes every entry from the cache. The counters are left untouched.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        """
+        Returns a dictionary of the cache counters and its current size.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups > 0 else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self.nbytes,
+            }
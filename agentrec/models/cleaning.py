@@ -0,0 +1,187 @@
+import numpy as np
+
+from agentrec.models.ann import BLOCK_SIZE
+from agentrec.models.cache import match_rows, prompt_hashes
+
+from typing import Any
+
+THRESHOLD = 0.95
+MARGIN = 0.0
+
+def semantic_duplicates(
+    embeddings: np.ndarray,
+    offsets: np.ndarray,
+    threshold: float = THRESHOLD,
+    block_size: int = BLOCK_SIZE,
+):
+    """
+    Finds paraphrases within each agent segment of a normalized embedding
+    matrix. A row is a duplicate if its cosine similarity to an earlier row of
+    the same agent is at least `threshold`. Similarities are computed in
+    `(block_size, block_size)` tiles, so the full similarity matrix is never
+    materialized.
+
+    Args:
+        embeddings: The normalized corpus embedding matrix, grouped by agent.
+        offsets: The first row of every agent segment.
+        threshold: The minimum cosine similarity of duplicates. Defaults to
+                   `0.95`.
+        block_size: The number of rows per tile. Defaults to `4096`.
+
+    Returns:
+        A boolean mask of the rows which duplicate an earlier row of the same
+        agent. The first row of every set of paraphrases is kept.
+    """
+    duplicate = np.zeros(len(embeddings), dtype=bool)
+    bounds = np.append(offsets, len(embeddings))
+
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        for row in range(start, end, block_size):
+            queries = np.asarray(embeddings[row:min(row+block_size, end)])
+            rows = np.arange(row, row + len(queries))
+
+            # Only the tiles on or before the diagonal hold earlier rows
+            for column in range(start, row + len(queries), block_size):
+                stop = min(column + block_size, row + len(queries))
+                similarities = queries @ np.asarray(embeddings[column:stop]).T
+                earlier = np.arange(column, stop)[None, :] < rows[:, None]
+                duplicate[rows] |= np.any(earlier & (similarities >= threshold),
+                                          axis=1)
+
+    return duplicate
+
+def centroids(embeddings: np.ndarray, offsets: np.ndarray):
+    """
+    Returns the normalized mean embedding of every agent segment.
+    """
+    sums  = np.add.reduceat(np.asarray(embeddings, dtype=np.float32), offsets, axis=0)
+    norms = np.linalg.norm(sums, axis=1, keepdims=True)
+    return sums / np.maximum(norms, 1e-12)
+
+def centroid_outliers(
+    embeddings: np.ndarray,
+    offsets: np.ndarray,
+    labels: np.ndarray,
+    margin: float = MARGIN,
+    block_size: int = BLOCK_SIZE,
+):
+    """
+    Finds rows which are closer to the centroid of another agent than to the
+    centroid of their own agent, which usually means they are mislabeled.
+
+    Args:
+        embeddings: The normalized corpus embedding matrix, grouped by agent.
+        offsets: The first row of every agent segment.
+        labels: The agent index of every row.
+        margin: How much more similar the nearest centroid must be than the
+                own centroid for a row to be flagged. Defaults to `0`.
+        block_size: The number of rows compared at a time. Defaults to `4096`.
+
+    Returns:
+        A tuple `(outliers, nearest)` of a boolean mask of the flagged rows
+        and the agent index of the nearest centroid of every row.
+    """
+    means   = centroids(embeddings, offsets)
+    nearest = np.empty(len(embeddings), dtype=np.int64)
+    outlier = np.zeros(len(embeddings), dtype=bool)
+
+    for row in range(0, len(embeddings), block_size):
+        similarities = np.asarray(embeddings[row:row+block_size]) @ means.T
+        block  = labels[row:row+block_size]
+        best   = np.argmax(similarities, axis=1)
+        indices = np.arange(len(block))
+
+        nearest[row:row+block_size] = best
+        outlier[row:row+block_size] = \
+            similarities[indices, best] - similarities[indices, block] > margin
+
+    return outlier, nearest
+
+def clean(
+    classifier: Any,
+    pool: Any,
+    threshold: float = THRESHOLD,
+    margin: float = MARGIN,
+    drop_outliers: bool = False,
+    block_size: int = BLOCK_SIZE,
+):
+    """
+    Removes paraphrases from a `PromptPool` and flags mislabeled prompts
+    using the corpus embeddings of an `SBERTAgentRec`. The classifier is
+    fitted on the pool, which is free when its embeddings are cached, and the
+    removed prompts are then dropped from both the pool and the fitted corpus
+    so that neither has to be encoded again.
+
+    Args:
+        classifier: An `SBERTAgentRec`.
+        pool: The `PromptPool` to clean.
+        threshold: The minimum cosine similarity of paraphrases. Defaults to
+                   `0.95`.
+        margin: See `centroid_outliers`. Defaults to `0`.
+        drop_outliers: Whether flagged prompts are removed as well. Defaults to
+                       `False`.
+        block_size: The number of rows compared at a time. Defaults to `4096`.
+
+    Returns:
+        A dictionary with the keys `duplicates`, mapping agent names to the
+        number of paraphrases removed, and `outliers`, a list of dictionaries
+        with the keys `agent_name`, `prompt` and `nearest_agent`.
+    """
+    classifier.fit(pool.table)
+
+    # Every corpus row is mapped back to its prompt in the pool by the hash of
+    # the prompt, since the rows need not be in pool order
+    table  = pool.table
+    hashes = np.empty(len(table), dtype=np.uint64)
+    for agent in table.agent_names:
+        indices = table.agent_indices(agent)
+        hashes[indices] = prompt_hashes(agent, table.prompts(indices))
+
+    rows = match_rows(hashes, classifier.hashes) if classifier.hashes is not None else None
+    if rows is None:
+        raise RuntimeError("The fitted corpus does not match the prompts of the pool")
+
+    duplicate = semantic_duplicates(classifier.embeddings,
+                                    classifier.offsets,
+                                    threshold=threshold,
+                                    block_size=block_size)
+    outlier, nearest = centroid_outliers(classifier.embeddings,
+                                         classifier.offsets,
+                                         classifier.labels,
+                                         margin=margin,
+                                         block_size=block_size)
+    outlier &= ~duplicate
+
+    flagged = np.flatnonzero(outlier)
+    report = {
+        "duplicates": {
+            agent: int(count) for agent, count in zip(
+                classifier.agents,
+                np.bincount(classifier.labels[duplicate],
+                            minlength=len(classifier.agents)),
+            )
+        },
+        "outliers": [
+            {
+                "agent_name": classifier.agents[classifier.labels[i]],
+                "prompt": prompt,
+                "nearest_agent": classifier.agents[nearest[i]],
+            }
+            for i, prompt in zip(flagged, table.prompts(rows[flagged]))
+        ],
+    }
+
+    remove = duplicate | outlier if drop_outliers else duplicate
+    if not np.any(remove):
+        return report
+
+    removed = {}
+    for i, prompt in zip(np.flatnonzero(remove), table.prompts(rows[remove])):
+        removed.setdefault(classifier.agents[classifier.labels[i]], []).append(prompt)
+
+    keep = np.ones(len(table), dtype=bool)
+    keep[rows[remove]] = False
+    pool.table = table.take(keep)
+    classifier._prune(~remove, removed)
+
+    return report
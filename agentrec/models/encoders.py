@@ -0,0 +1,297 @@
+import numpy as np
+
+from agentrec.hashing import fmix, shingle_hashes
+
+from typing import Any, Optional, Protocol
+import hashlib
+import re
+import threading
+
+BATCH_SIZE = 32
+FINGERPRINT_SAMPLES = 4096
+HASHING_DIM = 1024
+NGRAM_RANGE = (3, 5)
+TOKEN = re.compile(r"\w+")
+
+class Encoder(Protocol):
+    """
+    The interface of the encoders which `SBERTAgentRec` embeds prompts with.
+    Any object with these members can be passed to `SBERTAgentRec` in place
+    of a model name.
+
+    Attributes:
+        dim: The embedding dimension.
+    """
+    dim: int
+
+    def encode_batch(self, texts: list[str], batch_size: int = BATCH_SIZE) -> np.ndarray:
+        """
+        Returns the L2-normalized `float32` embeddings of the texts as a
+        `(len(texts), dim)` matrix.
+        """
+        ...
+
+    def fingerprint(self) -> str:
+        """
+        Returns a string which changes whenever the embeddings would, such as
+        a digest of the weights. Cached corpus and query embeddings are keyed
+        by it.
+        """
+        ...
+
+def model_fingerprint(model: Any):
+    """
+    Returns a fingerprint of the weights of a model. Every parameter tensor
+    contributes its name, shape and an evenly strided sample of its values,
+    which is enough to tell a finetuned model apart from its base without
+    hashing every weight. Models which provide their own `fingerprint` method
+    are fingerprinted by it instead.
+    """
+    if hasattr(model, "fingerprint"):
+        return str(model.fingerprint())
+
+    digest = hashlib.sha256()
+    for name, tensor in model.state_dict().items():
+        values = tensor.detach().flatten()
+        stride = max(1, values.numel() // FINGERPRINT_SAMPLES)
+        digest.update(f"{name}:{tuple(tensor.shape)}".encode())
+        digest.update(values[::stride].float().cpu().numpy().tobytes())
+
+    return digest.hexdigest()
+
+def _normalize(embeddings: np.ndarray):
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    embeddings /= np.maximum(norms, 1e-12)
+    return embeddings
+
+class SentenceTransformerEncoder:
+    """
+    The default encoder, which wraps a SentenceTransformer model. A model
+    given by name is only loaded when it is first used, so that importing
+    and constructing it stays fast. Exported or quantized transformers can be
+    used through the `backend` and `model_kwargs` arguments of
+    SentenceTransformer, which are passed through.
+
+    Args:
+        model: The name or path of the SentenceTransformer model, or an
+               already loaded model. Any object with a SentenceTransformer
+               compatible `encode` method can be given, in which case it
+               should also provide a `fingerprint` method returning a string
+               unless it has a `state_dict`.
+        kwargs: Arguments passed to SentenceTransformer when loading a model
+                by name.
+
+    A model loaded by name is pickled as its name and arguments rather than
+    its weights, such as when it is sent to the workers of
+    `parallel_encode`, unless its weights were modified after loading.
+    """
+    def __init__(self, model: str | Any, **kwargs):
+        self.model_name = model if isinstance(model, str) else None
+        self.kwargs = kwargs
+        self._model = model if not isinstance(model, str) else None
+        self._loaded = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state["_lock"]
+
+        # Loading the model again is cheaper than pickling its weights, but
+        # only gives the same model if it has not been finetuned since
+        if self._loaded is not None and model_fingerprint(self._model) == self._loaded:
+            state["_model"]  = None
+            state["_loaded"] = None
+
+        return state
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @property
+    def model(self):
+        """
+        The SentenceTransformer model, which is loaded on first access if it
+        was given by name.
+        """
+        if self._model is not None:
+            return self._model
+
+        with self._lock:
+            if self._model is None:
+                from sentence_transformers import SentenceTransformer
+
+                model = SentenceTransformer(self.model_name, **self.kwargs)
+                self._loaded = model_fingerprint(model)
+                self._model = model
+
+        return self._model
+
+    @property
+    def dim(self):
+        return self.model.get_sentence_embedding_dimension()
+
+    @property
+    def tokenizer(self):
+        return getattr(self.model, "tokenizer", None)
+
+    def encode_batch(self, texts: list[str], batch_size: int = BATCH_SIZE):
+        embeddings = self.model.encode(list(texts),
+                                       batch_size=batch_size,
+                                       normalize_embeddings=True)
+        return np.asarray(embeddings, dtype=np.float32)
+
+    def fingerprint(self):
+        return model_fingerprint(self.model)
+
+class HashingEncoder:
+    """
+    A training-free encoder which hashes the byte n-grams of a prompt into
+    `dim` signed buckets, in the manner of a hashing vectorizer. It needs no
+    model and encodes thousands of prompts per second on a CPU, so it suits a
+    cheap first-pass route or a baseline for the learned encoders. Prompts
+    are compared by their surface form only.
+
+    Args:
+        dim: The embedding dimension. Defaults to `1024`.
+        ngram_range: The smallest and largest n-gram sizes in bytes.
+                     Defaults to `(3, 5)`.
+        seed: The seed mixed into every hash. Defaults to `0`.
+    """
+    def __init__(
+        self,
+        dim: int = HASHING_DIM,
+        ngram_range: tuple[int, int] = NGRAM_RANGE,
+        seed: int = 0,
+    ):
+        self.dim = dim
+        self.ngram_range = tuple(ngram_range)
+        self.seed = seed
+
+    def encode_batch(self, texts: list[str], batch_size: int = BATCH_SIZE):
+        texts = list(texts)
+        seed  = np.uint64((self.seed * 0x9e3779b9) & 0xffffffff)
+        flat  = np.zeros(len(texts) * self.dim, dtype=np.float64)
+
+        for ngram in range(self.ngram_range[0], self.ngram_range[1] + 1):
+            hashes, counts = shingle_hashes(texts, ngram)
+            hashes  = fmix(hashes ^ seed)
+            buckets = (hashes % np.uint64(self.dim)).astype(np.int64)
+            signs   = np.where(hashes & np.uint64(1 << 31), 1.0, -1.0)
+            rows    = np.repeat(np.arange(len(texts)), counts)
+            flat   += np.bincount(rows * self.dim + buckets,
+                                  weights=signs,
+                                  minlength=len(flat))
+
+        embeddings = flat.reshape(len(texts), self.dim).astype(np.float32)
+        return _normalize(embeddings)
+
+    def fingerprint(self):
+        return f"hashing:{self.dim}:{self.ngram_range[0]}-{self.ngram_range[1]}:{self.seed}"
+
+class StaticEncoder:
+    """
+    An encoder which averages static token embeddings, such as GloVe or
+    word2vec vectors or the distilled vocabularies of model2vec. Encoding is
+    a lookup and a sum per prompt, so it runs at a tiny fraction of the cost
+    of a transformer. Tokens are the lowercased words of a prompt, and words
+    outside the vocabulary are skipped.
+
+    Args:
+        vocabulary: The token of every row of `vectors`.
+        vectors: The `(len(vocabulary), dim)` token embedding matrix.
+        lowercase: Whether prompts are lowercased before being split into
+                   tokens. Defaults to `True`.
+    """
+    def __init__(
+        self,
+        vocabulary: list[str],
+        vectors: np.ndarray,
+        lowercase: bool = True,
+    ):
+        if len(vocabulary) != len(vectors):
+            raise ValueError("There must be one vector per token")
+
+        self.vocabulary = {token: i for i, token in enumerate(vocabulary)}
+        self.vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        self.dim = self.vectors.shape[1]
+        self.lowercase = lowercase
+        self._fingerprint = None
+
+    @classmethod
+    def load(cls, path: str, limit: Optional[int] = None, lowercase: bool = True):
+        """
+        Loads token embeddings from a text file in the GloVe or word2vec
+        format, with one token followed by its vector per line. A word2vec
+        header line is skipped.
+
+        Args:
+            path: The path of the file.
+            limit: The optional number of leading tokens to load, since these
+                   files are usually sorted by frequency. Defaults to `None`.
+            lowercase: See the class.
+        """
+        vocabulary = []
+        vectors    = []
+        with open(path, encoding="utf-8") as vectors_file:
+            for line in vectors_file:
+                if limit is not None and len(vocabulary) >= limit:
+                    break
+
+                fields = line.rstrip().split(" ")
+                if len(vocabulary) == 0 and len(fields) == 2:
+                    continue
+
+                vocabulary.append(fields[0])
+                vectors.append(np.asarray(fields[1:], dtype=np.float32))
+
+        return cls(vocabulary, np.stack(vectors), lowercase=lowercase)
+
+    def encode_batch(self, texts: list[str], batch_size: int = BATCH_SIZE):
+        ids    = []
+        counts = []
+        for text in texts:
+            text   = text.lower() if self.lowercase else text
+            tokens = [self.vocabulary.get(token) for token in TOKEN.findall(text)]
+            tokens = [token for token in tokens if token is not None]
+            ids   += tokens
+            counts.append(len(tokens))
+
+        embeddings = np.zeros((len(counts), self.dim), dtype=np.float32)
+        rows = np.repeat(np.arange(len(counts)), counts)
+        np.add.at(embeddings, rows, self.vectors[np.asarray(ids, dtype=np.int64)])
+        return _normalize(embeddings)
+
+    def fingerprint(self):
+        if self._fingerprint is None:
+            stride = max(1, self.vectors.size // FINGERPRINT_SAMPLES)
+            digest = hashlib.sha256(f"static:{self.vectors.shape}:{self.lowercase}".encode())
+            for token in list(self.vocabulary)[::max(1, len(self.vocabulary) // FINGERPRINT_SAMPLES)]:
+                digest.update(token.encode() + b"\0")
+            digest.update(self.vectors.ravel()[::stride].tobytes())
+            self._fingerprint = digest.hexdigest()
+
+        return self._fingerprint
+
+def get_encoder(encoder: str | Any):
+    """
+    Returns the encoder which `SBERTAgentRec` embeds prompts with. Names and
+    SentenceTransformer compatible models are wrapped in a
+    `SentenceTransformerEncoder`, and objects implementing `Encoder` are
+    returned as-is.
+
+    Args:
+        encoder: The name of a SentenceTransformer model, a loaded model or
+                 an `Encoder`.
+    """
+    if isinstance(encoder, str):
+        return SentenceTransformerEncoder(encoder)
+
+    if callable(getattr(encoder, "encode_batch", None)):
+        return encoder
+
+    if callable(getattr(encoder, "encode", None)):
+        return SentenceTransformerEncoder(encoder)
+
+    raise ValueError(f"Invalid encoder {encoder!r}, expected a model name, a "
+                     "SentenceTransformer or an Encoder")
@@ -0,0 +1,220 @@
+from contextlib import contextmanager, nullcontext
+from typing import Any, Callable, Optional
+import bisect
+import json
+import threading
+import time
+
+BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+    0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+# Returned instead of a timer when metrics are disabled, so that the hot path
+# only pays for entering an empty context
+NULL_TIMER = nullcontext()
+
+class _Timer:
+    __slots__ = ("metrics", "stage", "items", "start")
+
+    def __init__(self, metrics: "Metrics", stage: str, items: int):
+        self.metrics = metrics
+        self.stage = stage
+        self.items = items
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.metrics.record(self.stage, time.perf_counter() - self.start, self.items)
+
+class Metrics:
+    """
+    Records the number of calls, the number of items and a latency histogram
+    for every stage of the inference path of an `SBERTAgentRec`, namely
+    `encode`, `similarity`, `reduce`, `top_k` and the end-to-end `recommend`.
+    Tokenization is part of `encode`, since SentenceTransformer tokenizes
+    inside `encode`.
+
+    Metrics are recorded only if an instance is passed to `SBERTAgentRec`, so
+    a classifier without one pays next to nothing. They can be exported in
+    the Prometheus text format or as JSON.
+
+    Args:
+        buckets: The upper bounds in seconds of the histogram buckets.
+                 Defaults to `BUCKETS`, which span 100 microseconds to 10
+                 seconds.
+        hooks: Optional callables which are called with the stage, the
+               seconds and the number of items of every record, for example
+               to forward timings to another monitoring system.
+    """
+    def __init__(
+        self,
+        buckets: tuple[float] = BUCKETS,
+        hooks: Optional[list[Callable[[str, float, int], Any]]] = None,
+    ):
+        self.buckets = tuple(sorted(buckets))
+        self.hooks = list(hooks) if hooks is not None else []
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def time(self, stage: str, items: int = 1):
+        """
+        Returns a context manager which records the time spent inside it.
+
+        Args:
+            stage: The name of the stage.
+            items: The number of items processed by the stage. Defaults to
+                   `1`.
+        """
+        return _Timer(self, stage, items)
+
+    def record(self, stage: str, seconds: float, items: int = 1):
+        """
+        Records a single call of a stage.
+
+        Args:
+            stage: The name of the stage.
+            seconds: The seconds spent in the call.
+            items: The number of items processed by the call. Defaults to `1`.
+        """
+        bucket = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            entry = self.stages.get(stage)
+            if entry is None:
+                entry = self.stages[stage] = {
+                    "calls": 0,
+                    "items": 0,
+                    "seconds": 0.0,
+                    "max_seconds": 0.0,
+                    "counts": [0] * (len(self.buckets) + 1),
+                }
+
+            entry["calls"] += 1
+            entry["items"] += items
+            entry["seconds"] += seconds
+            entry["max_seconds"] = max(entry["max_seconds"], seconds)
+            entry["counts"][bucket] += 1
+
+        for hook in self.hooks:
+            hook(stage, seconds, items)
+
+    def reset(self):
+        """
+        Removes every recorded call.
+        """
+        with self._lock:
+            self.stages = {}
+
+    def quantile(self, stage: str, q: float):
+        """
+        Returns an estimate of the `q`-th quantile of the latency of a stage,
+        which is the upper bound of the bucket it falls into, or `0` if the
+        stage has not been recorded.
+        """
+        with self._lock:
+            entry = self.stages.get(stage)
+            if entry is None:
+                return 0.0
+
+            rank = q * entry["calls"]
+            total = 0
+            for bound, count in zip(self.buckets, entry["counts"]):
+                total += count
+                if total >= rank:
+                    return min(bound, entry["max_seconds"])
+
+            return entry["max_seconds"]
+
+    def to_dict(self):
+        """
+        Returns the recorded metrics as a dictionary mapping every stage to
+        its counters, mean, estimated p50 and p99 latency and histogram.
+        """
+        with self._lock:
+            stages = {
+                stage: dict(entry, counts=list(entry["counts"]))
+                for stage, entry in self.stages.items()
+            }
+
+        return {
+            stage: {
+                "calls": entry["calls"],
+                "items": entry["items"],
+                "seconds": entry["seconds"],
+                "mean_seconds": entry["seconds"] / entry["calls"],
+                "p50_seconds": self.quantile(stage, 0.5),
+                "p99_seconds": self.quantile(stage, 0.99),
+                "max_seconds": entry["max_seconds"],
+                "buckets": dict(zip([str(bound) for bound in self.buckets] + ["+Inf"],
+                                    entry["counts"])),
+            }
+            for stage, entry in stages.items()
+        }
+
+    def to_json(self):
+        """
+        Returns the recorded metrics as a JSON string. See `to_dict`.
+        """
+        return json.dumps(self.to_dict())
+
+    def to_prometheus(self, prefix: str = "agentrec"):
+        """
+        Returns the recorded metrics in the Prometheus text exposition format,
+        as a `<prefix>_stage_seconds` histogram and a
+        `<prefix>_stage_items_total` counter labeled by stage.
+        """
+        with self._lock:
+            stages = {
+                stage: dict(entry, counts=list(entry["counts"]))
+                for stage, entry in self.stages.items()
+            }
+
+        lines = [
+            f"# HELP {prefix}_stage_seconds Seconds spent per call of each stage.",
+            f"# TYPE {prefix}_stage_seconds histogram",
+        ]
+        for stage, entry in stages.items():
+            total = 0
+            for bound, count in zip(list(self.buckets) + ["+Inf"], entry["counts"]):
+                total += count
+                lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",'
+                             f'le="{bound}"}} {total}')
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} '
+                         f'{entry["seconds"]}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} '
+                         f'{entry["calls"]}')
+
+        lines += [
+            f"# HELP {prefix}_stage_items_total Items processed by each stage.",
+            f"# TYPE {prefix}_stage_items_total counter",
+        ]
+        for stage, entry in stages.items():
+            lines.append(f'{prefix}_stage_items_total{{stage="{stage}"}} '
+                         f'{entry["items"]}')
+
+        return "\n".join(lines) + "\n"
+
+@contextmanager
+def profile(classifier: Any, metrics: Optional[Metrics] = None):
+    """
+    A context manager which records the metrics of a classifier only while
+    it is active, then restores the previous metrics of the classifier.
+
+    Args:
+        classifier: An `SBERTAgentRec`.
+        metrics: The `Metrics` to record into. Defaults to a new instance.
+
+    Example:
+        with profile(classifier) as metrics:
+            classifier.recommend_batch(prompts)
+        print(metrics.to_json())
+    """
+    metrics = metrics if metrics is not None else Metrics()
+    previous = classifier.metrics
+    classifier.metrics = metrics
+    try:
+        yield metrics
+    finally:
+        classifier.metrics = previous
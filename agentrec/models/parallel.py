@@ -0,0 +1,119 @@
+import numpy as np
+
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Any, Optional
+import multiprocessing
+import os
+import sys
+
+BATCH_SIZE = 32
+CHUNK_SIZE = 1024
+
+_encoder = None
+
+def token_lengths(encoder: Any, prompts: list[str]):
+    """
+    Returns the number of tokens of every prompt according to the tokenizer of
+    the encoder, or the number of characters if it has no tokenizer.
+    """
+    tokenizer = getattr(encoder, "tokenizer", None)
+    if tokenizer is None:
+        return np.array([len(prompt) for prompt in prompts], dtype=np.int64)
+
+    encoded = tokenizer(prompts, add_special_tokens=False)["input_ids"]
+    return np.array([len(ids) for ids in encoded], dtype=np.int64)
+
+def _init_worker(encoder: Any, threads: int):
+    global _encoder
+    _encoder = encoder
+
+    # Each worker gets an equal share of the cores instead of every worker
+    # spawning a thread per core
+    torch = sys.modules.get("torch")
+    if torch is not None:
+        torch.set_num_threads(threads)
+
+def _encode_worker(prompts: list[str], batch_size: int):
+    return np.asarray(_encoder.encode_batch(prompts, batch_size), dtype=np.float32)
+
+def parallel_encode(
+    encoder: Any,
+    prompts: list[str],
+    out: np.ndarray,
+    rows: Optional[np.ndarray] = None,
+    workers: Optional[int] = None,
+    chunk_size: int = CHUNK_SIZE,
+    batch_size: int = BATCH_SIZE,
+    sort: bool = True,
+):
+    """
+    Encodes prompts across a pool of CPU processes and writes the normalized
+    embeddings into a preallocated matrix, such as a memory map, as chunks
+    complete. Only a few chunks per worker are in flight at once, so memory
+    does not grow with the number of prompts.
+
+    If `sort` is `True`, then the prompts are ordered by token length before
+    being chunked, so every batch holds prompts of similar lengths and little
+    time is spent encoding padding.
+
+    The encoder is copied into every worker once. A
+    `SentenceTransformerEncoder` loaded by name is copied as its name and
+    arguments instead, and every worker loads the model itself. Note that
+    reading the `dim` of such an encoder, or its tokenizer when `sort` is
+    `True`, loads the model in the calling process as well. Workers are
+    spawned rather than forked, so scripts calling this must guard their
+    entry point with `if __name__ == "__main__":`.
+
+    Args:
+        encoder: A picklable `Encoder`.
+        prompts: The prompts to encode.
+        out: The matrix to write into, with at least `len(prompts)` rows.
+        rows: The row of `out` to write the embedding of every prompt into.
+              Defaults to the position of the prompt.
+        workers: The number of processes. Defaults to the number of cores.
+        chunk_size: The maximum number of prompts sent to a worker at a time.
+                    Defaults to `1024`.
+        batch_size: The batch size used by every worker. Defaults to `32`.
+        sort: Whether to order the prompts by token length. Defaults to
+              `True`.
+    """
+    workers = workers if workers is not None else os.cpu_count() or 1
+    rows = np.arange(len(prompts)) if rows is None else np.asarray(rows)
+    if len(prompts) == 0:
+        return out
+
+    # Chunks are kept small enough for every worker to get several of them
+    chunk_size = max(1, min(chunk_size, -(-len(prompts) // (4 * workers))))
+
+    order = np.arange(len(prompts))
+    if sort:
+        order = np.argsort(-token_lengths(encoder, prompts), kind="stable")
+
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    context = multiprocessing.get_context("spawn")
+    pending = {}
+
+    def write(done: set):
+        for future in done:
+            out[rows[pending.pop(future)]] = future.result()
+
+    with ProcessPoolExecutor(max_workers=workers,
+                             mp_context=context,
+                             initializer=_init_worker,
+                             initargs=(encoder, threads)) as executor:
+        for start in range(0, len(prompts), chunk_size):
+            if len(pending) >= 2 * workers:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                write(done)
+
+            chunk = order[start:start+chunk_size]
+            future = executor.submit(_encode_worker,
+                                     [prompts[i] for i in chunk],
+                                     batch_size)
+            pending[future] = chunk
+
+        while len(pending) > 0:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            write(done)
+
+    return out
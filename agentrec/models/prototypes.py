@@ -0,0 +1,161 @@
+import numpy as np
+
+from agentrec.models.ann import N_ITER, spherical_kmeans
+from agentrec.models.scoring import top_k
+
+from typing import Optional
+import time
+
+METHODS = ("kmeans", "medoids")
+N_PROTOTYPES = (4, 8, 16, 32, 64)
+
+def compress_segments(
+    embeddings: np.ndarray,
+    offsets: np.ndarray,
+    n_prototypes: int,
+    method: str = "kmeans",
+    n_iter: int = N_ITER,
+    seed: int = 0,
+    weights: Optional[np.ndarray] = None,
+):
+    """
+    Replaces every agent segment of a normalized embedding matrix with at most
+    `n_prototypes` weighted prototypes found by spherical k-means. The weight
+    of a prototype is the number of prompts in its cluster, so weighted score
+    functions treat it as that many prompts. Segments which are not larger
+    than `n_prototypes` are kept as they are.
+
+    Args:
+        embeddings: The normalized corpus embedding matrix, grouped by agent.
+        offsets: The first row of every agent segment.
+        n_prototypes: The maximum number of prototypes per agent.
+        method: Either `"kmeans"`, which uses the normalized cluster
+                centroids, or `"medoids"`, which uses the prompt nearest to
+                each centroid. Defaults to `"kmeans"`.
+        n_iter: The number of k-means iterations. Defaults to `10`.
+        seed: The random seed used for k-means. Defaults to `0`.
+        weights: The optional weights of the rows if they are prototypes
+                 already. Defaults to a weight of `1` per row.
+
+    Returns:
+        A tuple `(prototypes, sizes, weights)` of the prototype matrix, the
+        number of prototypes of every agent and the weight of every prototype.
+    """
+    if method not in METHODS:
+        raise ValueError(f"Invalid method {method!r}, expected one of {METHODS}")
+
+    if weights is None:
+        weights = np.ones(len(embeddings), dtype=np.float64)
+
+    rng    = np.random.default_rng(seed)
+    bounds = np.append(offsets, len(embeddings))
+    blocks = []
+    sizes  = []
+    totals = []
+
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        segment = np.asarray(embeddings[start:end], dtype=np.float32)
+        if len(segment) <= n_prototypes:
+            blocks.append(segment)
+            sizes.append(len(segment))
+            totals.append(weights[start:end])
+            continue
+
+        centroids, cells = spherical_kmeans(segment, n_prototypes, n_iter, rng)
+        mass = np.bincount(cells, weights=weights[start:end],
+                           minlength=n_prototypes)
+
+        if method == "medoids":
+            similarities = np.sum(segment * centroids[cells], axis=1)
+            order = np.lexsort((-similarities, cells))
+            first = np.searchsorted(cells[order], np.arange(n_prototypes))
+            first = np.minimum(first, len(order) - 1)
+            centroids = segment[order[first]]
+
+        # Clusters left empty by k-means are dropped
+        used = mass > 0
+        blocks.append(centroids[used])
+        sizes.append(int(used.sum()))
+        totals.append(mass[used])
+
+    return (np.ascontiguousarray(np.concatenate(blocks), dtype=np.float32),
+            np.asarray(sizes, dtype=np.int64),
+            np.concatenate(totals).astype(np.float64))
+
+def evaluate_compression(
+    classifier,
+    prompts: list[str],
+    agent_names: list[str],
+    n_prototypes: tuple[int, ...] = N_PROTOTYPES,
+    method: str = "kmeans",
+    k: int = 1,
+    repeat: int = 3,
+):
+    """
+    Reports the accuracy and scoring latency of a fitted `SBERTAgentRec` when
+    its corpus is compressed to different numbers of prototypes per agent.
+    The classifier itself is left unchanged. The prompts are encoded once,
+    and the full corpus is reported as the baseline with `n_prototypes` set
+    to `None`.
+
+    Args:
+        classifier: A fitted `SBERTAgentRec`.
+        prompts: The prompts to evaluate on.
+        agent_names: The true agent of every prompt.
+        n_prototypes: The numbers of prototypes per agent to evaluate.
+                      Defaults to `(4, 8, 16, 32, 64)`.
+        method: See `compress_segments`. Defaults to `"kmeans"`.
+        k: The number of recommendations considered for top-k accuracy.
+           Defaults to `1`.
+        repeat: The number of timed scoring runs, of which the fastest is
+                reported. Defaults to `3`.
+
+    Returns:
+        A list of dictionaries with the keys `n_prototypes`, `rows` (the
+        number of corpus rows scored per query), `accuracy`, `seconds` (the
+        time spent scoring every prompt) and `compress_seconds`.
+    """
+    queries = classifier.encode(prompts)
+    truth   = np.array([[classifier.agents.index(name)] for name in agent_names])
+
+    def measure(embeddings, offsets, weights):
+        seconds = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            similarities = queries @ embeddings.T
+            scores = classifier.reduce(similarities, offsets, weights)
+            seconds = min(seconds, time.perf_counter() - start)
+
+        return float(np.mean(np.any(top_k(scores, k) == truth, axis=1))), seconds
+
+    accuracy, seconds = measure(np.asarray(classifier.embeddings),
+                                classifier.offsets,
+                                classifier.weights)
+    report = [{
+        "n_prototypes": None,
+        "rows": len(classifier.embeddings),
+        "accuracy": accuracy,
+        "seconds": seconds,
+        "compress_seconds": 0.0,
+    }]
+
+    for m in n_prototypes:
+        start = time.perf_counter()
+        embeddings, sizes, weights = compress_segments(classifier.embeddings,
+                                                       classifier.offsets,
+                                                       m,
+                                                       method=method,
+                                                       weights=classifier.weights)
+        compress_seconds = time.perf_counter() - start
+
+        offsets = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+        accuracy, seconds = measure(embeddings, offsets, weights)
+        report.append({
+            "n_prototypes": m,
+            "rows": len(embeddings),
+            "accuracy": accuracy,
+            "seconds": seconds,
+            "compress_seconds": compress_seconds,
+        })
+
+    return report
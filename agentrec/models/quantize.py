@@ -0,0 +1,242 @@
+import numpy as np
+
+from agentrec.models.scoring import top_k
+
+import copy
+import time
+
+QUANTIZATIONS = ("float32", "float16", "int8", "binary")
+BLOCK_SIZE = 4096
+HAMMING_BLOCK_SIZE = 1024
+
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+def popcount(x: np.ndarray):
+    """
+    Returns the number of set bits of every element of an unsigned integer
+    array.
+    """
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(x)
+
+    counts = _POPCOUNT[x.view(np.uint8)]
+    return counts.reshape(x.shape + (x.itemsize,)).sum(axis=-1, dtype=np.uint8)
+
+def pack_signs(x: np.ndarray):
+    """
+    Packs the signs of the rows of `x` into bits, padded to whole 64-bit
+    words so that Hamming distances can be computed a word at a time.
+    """
+    bits  = np.packbits(np.asarray(x) > 0, axis=-1)
+    width = -(-bits.shape[-1] // 8) * 8
+    bits  = np.pad(bits, [(0, 0)] * (bits.ndim - 1) + [(0, width - bits.shape[-1])])
+    return np.ascontiguousarray(bits).view(np.uint64)
+
+class QuantizedEmbeddings:
+    """
+    A normalized embedding matrix stored in a compact form. It can be sliced
+    and indexed like a NumPy array, which returns dequantized `float32` rows,
+    so it can stand in for the corpus matrix of an `SBERTAgentRec`.
+
+    `"float16"` halves the memory of the matrix. `"int8"` stores every row as
+    signed bytes along with a per-row scale, using a quarter of the memory.
+    `"binary"` only keeps the sign of every dimension as a bit, using a
+    thirty-second of the memory, and its rows dequantize to normalized sign
+    vectors.
+
+    Args:
+        embeddings: The normalized `float32` embedding matrix.
+        kind: Either `"float16"`, `"int8"` or `"binary"`.
+    """
+    def __init__(self, embeddings: np.ndarray, kind: str):
+        if kind not in QUANTIZATIONS[1:]:
+            raise ValueError(f"Invalid quantization {kind!r}, expected one of "
+                             f"{QUANTIZATIONS[1:]}")
+
+        self.kind = kind
+        self.dim = np.shape(embeddings)[-1]
+        self.scales = None
+        self.data = np.empty((0, 0))
+
+        blocks = []
+        scales = []
+        for start in range(0, len(embeddings), BLOCK_SIZE):
+            block = np.asarray(embeddings[start:start+BLOCK_SIZE], dtype=np.float32)
+            if kind == "float16":
+                blocks.append(block.astype(np.float16))
+            elif kind == "int8":
+                scale = np.maximum(np.abs(block).max(axis=1), 1e-12) / 127
+                blocks.append(np.round(block / scale[:, None]).astype(np.int8))
+                scales.append(scale.astype(np.float32))
+            else:
+                blocks.append(pack_signs(block))
+
+        if len(blocks) > 0:
+            self.data = np.concatenate(blocks)
+        if kind == "int8":
+            self.scales = np.concatenate([np.empty(0, dtype=np.float32)] + scales)
+
+    def __len__(self):
+        return len(self.data)
+
+    @property
+    def shape(self):
+        return (len(self), self.dim)
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def __getitem__(self, index):
+        data = self.data[index]
+        if self.kind == "float16":
+            return data.astype(np.float32)
+
+        if self.kind == "int8":
+            return data.astype(np.float32) * self.scales[index][..., None]
+
+        bits = np.unpackbits(np.atleast_2d(data).view(np.uint8), axis=-1)
+        signs = bits[:, :self.dim].astype(np.float32) * 2 - 1
+        signs /= np.sqrt(self.dim)
+        return signs if np.ndim(data) > 1 else signs[0]
+
+    def __array__(self, dtype=None, copy=None):
+        embeddings = self[:]
+        return embeddings if dtype is None else embeddings.astype(dtype)
+
+    def dot(self, queries: np.ndarray):
+        """
+        Returns the similarities between `float32` queries and every row as a
+        `(len(queries), len(self))` matrix, dequantizing one block at a time.
+        For binary rows, this is the asymmetric similarity between the full
+        precision queries and the sign vectors.
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        similarities = np.empty((len(queries), len(self)), dtype=np.float32)
+        for start in range(0, len(self), BLOCK_SIZE):
+            block = self[start:start+BLOCK_SIZE]
+            similarities[:, start:start+BLOCK_SIZE] = queries @ block.T
+
+        return similarities
+
+    def hamming(self, queries: np.ndarray):
+        """
+        Returns the Hamming distances between the sign bits of the queries and
+        every row of a binary matrix as a `(len(queries), len(self))` matrix.
+        """
+        if self.kind != "binary":
+            raise ValueError("Hamming distances require a binary quantization")
+
+        bits = pack_signs(np.atleast_2d(queries))
+        distances = np.empty((len(bits), len(self)), dtype=np.int32)
+        for start in range(0, len(self), HAMMING_BLOCK_SIZE):
+            block = self.data[start:start+HAMMING_BLOCK_SIZE]
+            distances[:, start:start+HAMMING_BLOCK_SIZE] = \
+                popcount(bits[:, None, :] ^ block[None, :, :]).sum(axis=-1)
+
+        return distances
+
+def nearest_per_segment(
+    distances: np.ndarray,
+    offsets: np.ndarray,
+    top_n: int,
+):
+    """
+    Selects the `top_n` rows with the smallest distances, such as Hamming
+    distances, within every segment of the columns of a `(n_queries, n_rows)`
+    distance matrix, where segment `i` starts at column `offsets[i]`. Every
+    segment is partitioned for all queries at once, so only the selected
+    rows are ever sorted.
+
+    Returns:
+        A `(n_queries, len(offsets), top_n)` array of the selected column
+        ids, sorted from nearest to farthest. Segments with fewer than
+        `top_n` rows are padded with `-1`.
+    """
+    distances = np.atleast_2d(distances)
+    n_queries, n_rows = distances.shape
+    sizes = np.diff(offsets, append=n_rows)
+    ids   = np.full((n_queries, len(offsets), top_n), -1, dtype=np.int64)
+
+    for segment, (start, size) in enumerate(zip(offsets, sizes)):
+        n = min(size, top_n)
+        if n == 0:
+            continue
+        if n == size:
+            ids[:, segment, :n] = np.arange(start, start + size)
+        else:
+            nearest = np.argpartition(distances[:, start:start+size], n - 1, axis=1)
+            ids[:, segment, :n] = nearest[:, :n] + start
+
+    # Padding sorts after every selected row
+    selected = np.take_along_axis(distances, np.maximum(ids, 0).reshape(n_queries, -1), axis=1)
+    selected = np.where(ids >= 0, selected.reshape(ids.shape), np.inf)
+    order = np.argsort(selected, axis=-1, kind="stable")
+    return np.take_along_axis(ids, order, axis=-1)
+
+def evaluate_quantization(
+    classifier,
+    prompts: list[str],
+    agent_names: list[str],
+    kinds: tuple[str] = QUANTIZATIONS[1:],
+    k: int = 1,
+):
+    """
+    Reports the memory, scoring latency and accuracy of a fitted full
+    precision `SBERTAgentRec` when its corpus is quantized. The classifier
+    itself is left unchanged. The prompts are encoded once, and every
+    quantization is scored on a copy of the classifier without an index.
+
+    Args:
+        classifier: A fitted `SBERTAgentRec` which is not quantized.
+        prompts: The prompts to evaluate on.
+        agent_names: The true agent of every prompt.
+        kinds: The quantizations to evaluate. Defaults to every quantization.
+        k: The number of recommendations considered for top-k accuracy.
+           Defaults to `1`.
+
+    Returns:
+        A list of dictionaries with the keys `quantization`, `bytes` (the
+        memory of the corpus including any rescoring copy),
+        `accuracy`, `accuracy_delta` (relative to `float32`), `agreement`
+        (the fraction of prompts with the same top-k agents as `float32`) and
+        `seconds`, starting with `float32` itself.
+    """
+    if classifier.quantization is not None:
+        raise ValueError("The classifier must not be quantized")
+
+    queries = classifier.encode(prompts)
+    truth   = np.array([[classifier.agents.index(name)] for name in agent_names])
+
+    baseline = None
+    report   = []
+    for kind in ("float32",) + tuple(kinds):
+        quantized = copy.copy(classifier)
+        quantized.index = None
+        quantized.query_cache = None
+        if kind != "float32":
+            quantized.quantize(kind)
+
+        start   = time.perf_counter()
+        scores  = quantized._score_matrix(queries)
+        seconds = time.perf_counter() - start
+
+        top = np.sort(top_k(scores, k), axis=1)
+        if baseline is None:
+            baseline = top
+
+        accuracy = float(np.mean(np.any(top == truth, axis=1)))
+        nbytes = quantized.embeddings.nbytes
+        if quantized.rescore_embeddings is not None:
+            nbytes += quantized.rescore_embeddings.nbytes
+
+        report.append({
+            "quantization": kind,
+            "bytes": int(nbytes),
+            "accuracy": accuracy,
+            "accuracy_delta": accuracy - report[0]["accuracy"] if report else 0.0,
+            "agreement": float(np.mean(np.all(top == baseline, axis=1))),
+            "seconds": seconds,
+        })
+
+    return report
@@ -1,18 +1,286 @@
-from sentence_transformers import SentenceTransformer
+import numpy as np
 
-import math
+from agentrec.models.ann import IVFIndex, N_ITER, TOP_N
+from agentrec.models.cache import EmbeddingCache, QueryCache
+from agentrec.models.cache import cache_key, corpus_hash, match_rows, normalize_prompt
+from agentrec.models.cache import prompt_digest, prompt_hashes
+from agentrec.models.encoders import Encoder, get_encoder
+from agentrec.models.metrics import NULL_TIMER, Metrics
+from agentrec.models.parallel import parallel_encode
+from agentrec.models.prototypes import compress_segments
+from agentrec.models.quantize import BLOCK_SIZE, QUANTIZATIONS, QuantizedEmbeddings
+from agentrec.models.quantize import nearest_per_segment
+from agentrec.models.scoring import PMEAN, accepts_weights, get_score_function, top_k
+
+from typing import Any, Callable, Iterable, Optional
+import itertools
+
+BATCH_SIZE = 32
+CHUNK_SIZE = 4096
+
+def _chunked(iterable: Iterable, size: int):
+    """
+    Yields lists of up to `size` consecutive items of `iterable`.
+    """
+    iterator = iter(iterable)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
 
 class SBERTAgentRec:
-    def __init__(self, model_name: str):
-        self.model = SentenceTransformer(model_name)
-        self.embeddings = {}
+    """
+    An agent recommender which compares the sentence embedding of a prompt to
+    the embeddings of every agent's capability corpus, then reduces the
+    similarities of each agent into a single score using a score function.
+
+    Args:
+        model_name: The name or path of the SentenceTransformer model, an
+                    already loaded model or an `Encoder` such as a
+                    `HashingEncoder` or a `StaticEncoder`. Prompts are always
+                    embedded through the `Encoder` interface, see
+                    `get_encoder`. A model given by name is only loaded when
+                    it is first used, so that importing and constructing the
+                    class stays fast.
+        score_function: The name of a score function registered in
+                        `agentrec.models.scoring`, or a callable with the same
+                        signature. Defaults to `"log_pmean"`.
+        p: The power used by the power mean score functions. Defaults to
+           `200`.
+        cache_dir: An optional directory where `fit` persists the corpus
+                   embeddings. If the cached embeddings were computed by the
+                   same model weights from the same corpus, then they are
+                   memory-mapped instead of being encoded again. Defaults to
+                   `None`.
+        index: An optional `IVFIndex` for approximate nearest neighbour
+               search. If it is given, then each agent is scored on only its
+               `top_n` most similar prompts among the probed cells rather than
+               its whole corpus. Defaults to `None`.
+        top_n: The number of candidates per agent retrieved from the index.
+               Defaults to `32`.
+        query_cache: An optional `QueryCache` for query embeddings and
+                     recommendations. Repeated prompts are then served
+                     without encoding them again. Entries are keyed by the
+                     normalized prompt and the model and corpus version, so
+                     they never outlive a change to either. Defaults to
+                     `None`.
+        quantization: An optional compact storage for the fitted corpus,
+                      either `"float16"`, `"int8"` or `"binary"`. See
+                      `quantize`. Defaults to `None`, which keeps `float32`.
+        rescore: Whether a binary corpus keeps an `int8` copy to rescore the
+                 candidates of its Hamming prefilter. The copy takes four
+                 times the memory of the sign bits, so a rescored binary
+                 corpus is larger than an `int8` one and only saves time,
+                 not memory. Otherwise candidates are rescored against
+                 their sign vectors. Defaults to `False`.
+        metrics: An optional `Metrics` which records the time spent in every
+                 stage of a recommendation. Defaults to `None`.
+    """
+    def __init__(
+        self,
+        model_name: str | Encoder | Any,
+        score_function: str | Callable = "log_pmean",
+        p: float = PMEAN,
+        cache_dir: Optional[str] = None,
+        index: Optional[IVFIndex] = None,
+        top_n: int = TOP_N,
+        query_cache: Optional[QueryCache] = None,
+        quantization: Optional[str] = None,
+        rescore: bool = False,
+        metrics: Optional[Metrics] = None,
+    ):
+        if quantization not in (None,) + QUANTIZATIONS:
+            raise ValueError(f"Invalid quantization {quantization!r}, expected "
+                             f"one of {QUANTIZATIONS}")
+
+        self.encoder = get_encoder(model_name)
+        self.embeddings = np.empty((0, 0), dtype=np.float32)
+        self.agents = []
+        self.offsets = np.empty(0, dtype=np.int64)
+        self.labels = np.empty(0, dtype=np.int64)
+        self.weights = None
+        self.compression = None
+        self.digests = {}
+        self.hashes = np.empty(0, dtype=np.uint64)
+        self.score_function = get_score_function(score_function)
+        self.p = p
+        self.cache = EmbeddingCache(cache_dir) if cache_dir is not None else None
+        self.index = index
+        self.top_n = top_n
+        self.query_cache = query_cache
+        self.quantization = quantization if quantization != "float32" else None
+        self.rescore = rescore
+        self.rescore_embeddings = None
+        self.metrics = metrics
+        self._fingerprint = None
+        self._unverified = False
+        self._content = None
+
+    @classmethod
+    def precomputed(cls, model_name: str | Encoder | Any, cache_dir: str, **kwargs):
+        """
+        Returns a classifier which serves from the corpus embeddings cached in
+        `cache_dir` without loading the model. The model is only loaded by the
+        first query which has to be encoded, at which point the fingerprint of
+        the encoder is checked against the one recorded in the cache. Queries
+        answered by a `QueryCache` never load it.
+
+        Args:
+            model_name: See the class.
+            cache_dir: The directory which `fit` or `save` wrote the corpus to.
+            kwargs: The other arguments of the class.
+        """
+        classifier = cls(model_name, cache_dir=cache_dir, **kwargs)
+        classifier.load(precomputed=True)
+        return classifier
+
+    @property
+    def model(self):
+        """
+        The underlying model of the encoder, such as the SentenceTransformer
+        to finetune, or the encoder itself if it does not wrap a model.
+        """
+        return getattr(self.encoder, "model", self.encoder)
 
-    def fit(self, training_samples: list[dict]):
+    def fit(
+        self,
+        training_samples: Iterable[dict],
+        chunk_size: int = CHUNK_SIZE,
+        workers: int = 1,
+    ):
         """
         Generates initial embeddings for AgentRec. These are used to generate
         agent recommendations by comparing these embeddings to an unseen
         candidate.
 
+        The embeddings of all agents are stored as a single contiguous matrix
+        of L2-normalized rows in `embeddings`, grouped by agent. The corpus of
+        the agent `agents[i]` spans the rows starting at `offsets[i]`, and
+        `labels` holds the agent index of every row. The rows of every agent
+        are in the order of its training samples, even when they are read
+        from a cache which was written for a different order, and `hashes`
+        holds the `prompt_hashes` hash of the prompt of every row.
+
+        The training samples are read twice, once to size the matrix and once
+        to encode them `chunk_size` at a time, so only a single chunk of
+        prompts is held in memory. This allows a lazy `PromptStream` to be
+        passed directly. A one-shot iterator is read into a list first.
+
+        If `workers` is greater than `1`, then the prompts are sorted by token
+        length and encoded across a pool of processes by `parallel_encode`
+        instead, which holds every prompt in memory but scales with the
+        number of cores. In both modes, the embeddings are written straight
+        into a memory map in the cache directory if there is one.
+
+        Args:
+            training_samples: An iterable of training samples. Each sample is a
+                              dictionary with keys "agent_name" and "prompt"
+            chunk_size: The number of prompts encoded at a time. Defaults to
+                        `4096`.
+            workers: The number of processes which encode the prompts.
+                     Defaults to `1`, which encodes them in this process.
+        """
+        if iter(training_samples) is training_samples:
+            training_samples = list(training_samples)
+
+        sizes   = {}
+        digests = {}
+        hashes  = {}
+        for sample in training_samples:
+            agent  = sample["agent_name"]
+            digest = digests.get(agent, 0) + prompt_digest(agent, [sample["prompt"]])
+            sizes[agent]   = sizes.get(agent, 0) + 1
+            digests[agent] = digest % (1 << 256)
+            hashes.setdefault(agent, []).append(sample["prompt"])
+
+        if not len(sizes) > 0:
+            raise ValueError("At least one training sample must be given")
+
+        agents = list(sizes)
+        hashes = np.concatenate([prompt_hashes(agent, hashes[agent]) for agent in agents])
+        key    = None
+        self.weights = None
+        self.compression = None
+
+        if self.cache is not None:
+            key = cache_key(self.fingerprint(), corpus_hash(agents, digests))
+            cached = self.cache.load(key)
+            order  = match_rows(cached["hashes"], hashes) if cached is not None else None
+            if order is not None:
+                # The key does not depend on the sample order, so the cached
+                # rows are reordered unless they are already in sample order
+                embeddings = cached["embeddings"]
+                if not np.array_equal(order, np.arange(len(order))):
+                    embeddings = np.ascontiguousarray(embeddings[order])
+
+                self.embeddings = embeddings
+                self.digests = cached["digests"]
+                self.hashes = hashes
+                self._quantize()
+                self._set_index(cached["agents"], cached["sizes"])
+                return
+
+        starts  = np.cumsum([0] + [sizes[agent] for agent in agents])
+        cursors = dict(zip(agents, starts[:-1].tolist()))
+        embeddings = None
+
+        if workers > 1:
+            prompts = []
+            rows    = []
+            for sample in training_samples:
+                prompts.append(sample["prompt"])
+                rows.append(cursors[sample["agent_name"]])
+                cursors[sample["agent_name"]] += 1
+
+            embeddings = parallel_encode(self.encoder,
+                                         prompts,
+                                         self._allocate((starts[-1], self.encoder.dim)),
+                                         rows=rows,
+                                         workers=workers,
+                                         chunk_size=chunk_size)
+        else:
+            for chunk in _chunked(training_samples, chunk_size):
+                encoded = self._embed([sample["prompt"] for sample in chunk])
+                if embeddings is None:
+                    embeddings = self._allocate((starts[-1], encoded.shape[-1]))
+
+                rows = []
+                for sample in chunk:
+                    rows.append(cursors[sample["agent_name"]])
+                    cursors[sample["agent_name"]] += 1
+
+                embeddings[rows] = encoded
+
+        if self.cache is not None:
+            embeddings = self.cache.save(key,
+                                         embeddings,
+                                         agents,
+                                         [sizes[agent] for agent in agents],
+                                         digests,
+                                         hashes,
+                                         self.fingerprint())
+
+        self.embeddings = embeddings
+        self.digests = digests
+        self.hashes = hashes
+        self._quantize()
+        self._set_index(agents, [sizes[agent] for agent in agents])
+
+    def _allocate(self, shape: tuple[int, int]):
+        """
+        Returns an uninitialized `float32` corpus matrix, which is a memory
+        map in the cache directory if there is one.
+        """
+        if self.cache is not None:
+            return self.cache.allocate(shape)
+
+        return np.empty(shape, dtype=np.float32)
+
+    def partial_fit(self, training_samples: list[dict]):
+        """
+        Adds training samples to the fitted corpus without encoding the
+        existing corpus again. Only the new prompts are encoded, and agents
+        which have not been seen before are appended. If a cache directory
+        was given, then the cache is rewritten to match.
+
         Args:
             training_samples: A list of training samples. Each sample is a
                               dictionary with keys "agent_name" and "prompt"
@@ -27,26 +295,442 @@ class SBERTAgentRec:
             else:
                 samples[agent].append(prompt)
 
-        self.embeddings = {}
+        if not len(samples) > 0:
+            return
+
+        prompts = [prompt for agent in samples for prompt in samples[agent]]
+        sizes   = [len(samples[agent]) for agent in samples]
+        embeddings = self._embed(prompts)
+
+        additions = dict(zip(samples, np.split(embeddings, np.cumsum(sizes)[:-1])))
+        hashes    = {agent: prompt_hashes(agent, samples[agent]) for agent in samples}
         for agent in samples:
-            self.embeddings[agent] = self.model.encode(samples[agent])
+            digest = self.digests.get(agent, 0) + prompt_digest(agent, samples[agent])
+            self.digests[agent] = digest % (1 << 256)
+
+        self._splice(additions=additions, hashes=hashes)
+
+    def add_agent(self, agent: str, prompts: list[str]):
+        """
+        Adds a new agent along with its capability corpus. A `ValueError` is
+        thrown if the agent already exists, in which case `add_prompts`
+        should be used instead.
+
+        Args:
+            agent: The name of the new agent.
+            prompts: The prompts which the agent is able to handle.
+        """
+        if agent in self.agents:
+            raise ValueError(f"The agent {agent!r} already exists")
+
+        if not len(prompts) > 0:
+            raise ValueError("At least one prompt must be given")
+
+        self.add_prompts(agent, prompts)
+
+    def add_prompts(self, agent: str, prompts: list[str]):
+        """
+        Adds prompts to the capability corpus of an agent, creating the agent
+        if it does not exist yet.
+
+        Args:
+            agent: The name of the agent.
+            prompts: The prompts to add to the agent's corpus.
+        """
+        self.partial_fit([
+            {"agent_name": agent, "prompt": prompt} for prompt in prompts
+        ])
+
+    def remove_agent(self, agent: str):
+        """
+        Removes an agent and its capability corpus. A `ValueError` is thrown
+        if the agent does not exist.
+
+        Args:
+            agent: The name of the agent to remove.
+        """
+        if agent not in self.agents:
+            raise ValueError(f"The agent {agent!r} does not exist")
+
+        del self.digests[agent]
+        self._splice(removals={agent})
+
+    def _splice(
+        self,
+        additions: Optional[dict[str, np.ndarray]] = None,
+        removals: Optional[set[str]] = None,
+        hashes: Optional[dict[str, np.ndarray]] = None,
+    ):
+        """
+        Rebuilds the contiguous embedding matrix from the existing agent
+        segments, appending the rows in `additions` to the end of each
+        agent's segment and dropping the agents in `removals`. The row hashes
+        of the additions are given by agent in `hashes`. This copies the
+        matrix once but never encodes it again.
+        """
+        additions = additions if additions is not None else {}
+        removals  = removals if removals is not None else set()
+        hashes    = hashes if hashes is not None else {}
+        segments = {}
+        weights  = {}
+        existing = {}
+        if len(self.agents) > 0:
+            segments = dict(zip(self.agents,
+                                np.split(np.asarray(self._full_precision()), self.offsets[1:])))
+            if self.weights is not None:
+                weights = dict(zip(self.agents,
+                                   np.split(self.weights, self.offsets[1:])))
+            if self.hashes is not None:
+                existing = dict(zip(self.agents,
+                                    np.split(self.hashes, self.offsets[1:])))
+
+        agents = [agent for agent in self.agents if agent not in removals]
+        agents += [agent for agent in additions if agent not in segments]
+
+        blocks = []
+        sizes  = []
+        masses = []
+        for agent in agents:
+            parts = [block[agent] for block in (segments, additions) if agent in block]
+            blocks += parts
+            sizes.append(sum(len(part) for part in parts))
+
+            # New prompts of a compressed corpus count as one prompt each
+            if self.weights is not None:
+                masses.append(weights.get(agent, np.empty(0)))
+                if agent in additions:
+                    masses.append(np.ones(len(additions[agent])))
+
+        if len(blocks) > 0:
+            self.embeddings = np.ascontiguousarray(np.concatenate(blocks),
+                                                   dtype=np.float32)
+        else:
+            self.embeddings = np.empty((0, self.embeddings.shape[-1]),
+                                       dtype=np.float32)
+
+        if self.weights is not None:
+            self.weights = np.concatenate([np.empty(0)] + masses)
+
+        if self.hashes is not None:
+            self.hashes = np.concatenate([np.empty(0, dtype=np.uint64)] + [
+                block[agent]
+                for agent in agents
+                for block in (existing, hashes)
+                if agent in block
+            ])
+
+        self._quantize()
+        self._set_index(agents, sizes, retrain_index=False)
+
+        if self.cache is not None and self._cacheable():
+            self.save()
+
+    def _prune(self, keep: np.ndarray, removed: dict[str, list[str]]):
+        """
+        Drops the corpus rows where `keep` is `False`. The prompts of the
+        dropped rows are given by agent in `removed`, so that their hashes can
+        be subtracted from the agent digests. Agents left without prompts are
+        removed.
+        """
+        for agent, prompts in removed.items():
+            digest = self.digests[agent] - prompt_digest(agent, prompts)
+            self.digests[agent] = digest % (1 << 256)
+
+        sizes  = np.bincount(self.labels[keep], minlength=len(self.agents))
+        agents = [agent for agent, size in zip(self.agents, sizes) if size > 0]
+        for agent, size in zip(self.agents, sizes):
+            if size == 0:
+                del self.digests[agent]
+
+        self.embeddings = np.ascontiguousarray(self._full_precision()[keep],
+                                               dtype=np.float32)
+        if self.weights is not None:
+            self.weights = self.weights[keep]
+        if self.hashes is not None:
+            self.hashes = self.hashes[keep]
+
+        self._quantize()
+        self._set_index(agents, sizes[sizes > 0], retrain_index=False)
+
+        if self.cache is not None and self._cacheable():
+            self.save()
+
+    def save(self, cache_dir: Optional[str] = None):
+        """
+        Saves the fitted corpus embeddings so that they can be loaded later
+        with `load`, even without the training samples.
+
+        Args:
+            cache_dir: The directory to save to. Defaults to the `cache_dir`
+                       given when the class was created.
+        """
+        if self.weights is not None:
+            raise ValueError("A compressed corpus cannot be saved, save it "
+                             "before calling compress instead")
+
+        if self.quantization is not None:
+            raise ValueError("A quantized corpus cannot be saved, since the "
+                             "cache always holds full precision embeddings")
+
+        cache = self._get_cache(cache_dir)
+        key   = cache_key(self.fingerprint(), corpus_hash(self.agents, self.digests))
+        cache.save(key,
+                   self.embeddings,
+                   self.agents,
+                   self.sizes(),
+                   self.digests,
+                   self.hashes,
+                   self.fingerprint())
+
+    def load(self, cache_dir: Optional[str] = None, precomputed: bool = False):
+        """
+        Loads corpus embeddings that were saved by `fit` or `save`, memory
+        mapping them instead of reading them into memory. A `ValueError` is
+        thrown if there is no cache or if it was computed by different model
+        weights.
+
+        Args:
+            cache_dir: The directory to load from. Defaults to the `cache_dir`
+                       given when the class was created.
+            precomputed: Whether to trust the model fingerprint recorded in
+                         the cache instead of loading the model to compute
+                         it. The fingerprint is checked before the first
+                         prompt is encoded. Defaults to `False`.
+        """
+        cache  = self._get_cache(cache_dir)
+        cached = cache.load()
+        if cached is None:
+            raise ValueError(f"No cached embeddings found at {cache.path}")
+
+        content_hash = corpus_hash(cached["agents"], cached["digests"])
+        if precomputed:
+            if cached["fingerprint"] is None:
+                raise ValueError(f"The cached embeddings at {cache.path} do not "
+                                 "record their model fingerprint, save them "
+                                 "again to use them precomputed")
+
+            if cache_key(cached["fingerprint"], content_hash) != cached["key"]:
+                raise ValueError(f"The cached embeddings at {cache.path} do not "
+                                 "match their metadata")
+
+            self._fingerprint = cached["fingerprint"]
+            self._unverified = True
+        elif cache_key(self.fingerprint(), content_hash) != cached["key"]:
+            raise ValueError(f"The cached embeddings at {cache.path} were "
+                             "computed by different model weights")
+
+        self.embeddings = cached["embeddings"]
+        self.digests = cached["digests"]
+        self.hashes = cached["hashes"]
+        self.weights = None
+        self.compression = None
+        self._quantize()
+        self._set_index(cached["agents"], cached["sizes"])
+
+    def _get_cache(self, cache_dir: Optional[str]):
+        if cache_dir is not None:
+            return EmbeddingCache(cache_dir)
+
+        if self.cache is None:
+            raise ValueError("A cache directory must be specified")
+
+        return self.cache
+
+    def fingerprint(self):
+        """
+        Returns the fingerprint of the encoder, which identifies the model
+        weights. It is computed on every call, so that embeddings cached
+        before the model was finetuned or replaced are never served. Until
+        the first prompt is encoded, precomputed embeddings provide the
+        fingerprint recorded in their cache instead, so the model does not
+        have to be loaded to compute it.
+        """
+        if self._unverified:
+            return self._fingerprint
+
+        return str(self.encoder.fingerprint())
+
+    def _corpus_version(self):
+        """
+        Returns a key which identifies both the model weights and the fitted
+        corpus. The corpus part is recomputed only after the corpus changes.
+        """
+        if self._content is None:
+            content = corpus_hash(self.agents, self.digests)
+            if self.compression is not None:
+                content += repr(self.compression)
+            if self.quantization is not None:
+                content += f":{self.quantization}:{self.rescore}"
+
+            self._content = content
+
+        return cache_key(self.fingerprint(), self._content)
+
+    def _set_index(
+        self,
+        agents: list[str],
+        sizes: list[int],
+        retrain_index: bool = True,
+    ):
+        """
+        Rebuilds the agent segment index from the number of rows per agent,
+        along with the nearest neighbour index if there is one.
+        """
+        sizes = np.asarray(sizes, dtype=np.int64)
+        self.agents  = list(agents)
+        self.offsets = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+        self.labels  = np.repeat(np.arange(len(sizes)), sizes)
+        self._content = None
+
+        if self.index is not None and len(self.embeddings) > 0:
+            self.index.build(self.embeddings,
+                             self.labels,
+                             len(self.agents),
+                             retrain=retrain_index)
+
+    def compress(
+        self,
+        n_prototypes: int,
+        method: str = "kmeans",
+        n_iter: int = N_ITER,
+        seed: int = 0,
+    ):
+        """
+        Replaces the corpus of every agent with at most `n_prototypes`
+        weighted prototypes, so that each query is compared to far fewer
+        rows. The weight of a prototype is the number of prompts it stands
+        for, and the score functions count it as that many prompts. Use
+        `agentrec.models.prototypes.evaluate_compression` to choose
+        `n_prototypes` by its accuracy and latency.
+
+        A compressed corpus can still be extended by `partial_fit`, but it
+        cannot be saved, so `fit` or `load` must be called to restore the
+        full corpus.
+
+        Args:
+            n_prototypes: The maximum number of prototypes per agent.
+            method: Either `"kmeans"` or `"medoids"`. See
+                    `agentrec.models.prototypes.compress_segments`. Defaults to
+                    `"kmeans"`.
+            n_iter: The number of k-means iterations. Defaults to `10`.
+            seed: The random seed used for k-means. Defaults to `0`.
+        """
+        embeddings, sizes, weights = compress_segments(self._full_precision(),
+                                                       self.offsets,
+                                                       n_prototypes,
+                                                       method=method,
+                                                       n_iter=n_iter,
+                                                       seed=seed,
+                                                       weights=self.weights)
+        self.embeddings = embeddings
+        self.weights = weights
+        self.hashes = None
+        self.compression = (self.compression, n_prototypes, method, n_iter, seed)
+        self._quantize()
+        self._set_index(self.agents, sizes)
+
+    def quantize(self, quantization: str, rescore: Optional[bool] = None):
+        """
+        Stores the fitted corpus in a compact form, which `fit` and `load`
+        then also apply to every corpus they read. The embedding cache keeps
+        full precision embeddings either way.
+
+        `"float16"` and `"int8"` are scored like the full precision corpus.
+        A `"binary"` corpus is first searched by the Hamming distance between
+        sign bits, and only the `top_n` nearest prompts of every agent are
+        rescored in floating point and reduced by the score function. This
+        suits score functions dominated by the largest similarities, such as
+        `log_pmean` or `max`. Use
+        `agentrec.models.quantize.evaluate_quantization` to measure the effect
+        on accuracy.
+
+        Args:
+            quantization: Either `"float16"`, `"int8"` or `"binary"`. A
+                          quantized corpus cannot be quantized again, so `fit`
+                          or `load` must be called first to change it.
+            rescore: See `SBERTAgentRec`. Defaults to the current setting.
+        """
+        if quantization not in QUANTIZATIONS[1:]:
+            raise ValueError(f"Invalid quantization {quantization!r}, expected "
+                             f"one of {QUANTIZATIONS[1:]}")
+
+        if self.quantization is not None:
+            raise ValueError(f"The corpus is already quantized as "
+                             f"{self.quantization!r}")
+
+        self.quantization = quantization
+        self.rescore = rescore if rescore is not None else self.rescore
+        self._quantize()
+        self._set_index(self.agents, self.sizes(), retrain_index=False)
+
+    def _quantize(self):
+        """
+        Quantizes `embeddings` in place if a quantization is configured and
+        the current embeddings are full precision.
+        """
+        if self.quantization is None or \
+           isinstance(self.embeddings, QuantizedEmbeddings):
+            return
+
+        self.rescore_embeddings = None
+        if self.quantization == "binary" and self.rescore:
+            self.rescore_embeddings = QuantizedEmbeddings(self.embeddings, "int8")
+
+        self.embeddings = QuantizedEmbeddings(self.embeddings, self.quantization)
+
+    def _full_precision(self):
+        """
+        Returns the most precise form of the corpus which is available, which
+        is the rescoring copy of a binary corpus.
+        """
+        if self.rescore_embeddings is not None:
+            return self.rescore_embeddings
+
+        return self.embeddings
+
+    def _cacheable(self):
+        return self.weights is None and self.quantization is None
+
+    def sizes(self):
+        """
+        Returns the number of corpus prompts of every agent in `agents`.
+        """
+        return np.diff(self.offsets, append=len(self.embeddings))
+
+    def agent_embeddings(self, agent: str):
+        """
+        Returns a view of the embedding rows which belong to the given agent.
+
+        Args:
+            agent: The name of the agent.
+        """
+        i = self.agents.index(agent)
+        end = self.offsets[i + 1] if i + 1 < len(self.agents) else None
+        return self.embeddings[self.offsets[i]:end]
 
     def transform(self, prompt: str):
         """
-        Returns cosine similarity scores that must be manually put into a score
-        function. For a more streamlined function, use `get_agent`.
+        Returns the cosine similarities between the prompt and every prompt of
+        each agent's corpus. These must be reduced by a score function before
+        they can be ranked. For a more streamlined function, use `get_agent`.
 
         Args:
             prompt: The prompt to compare to the initial embeddings
         """
-        embedded_prompt = self.model.encode(prompt)
-        similarities = {}
+        similarities = self._similarities(self.encode([prompt]))[0]
+        return dict(zip(self.agents, np.split(similarities, self.offsets[1:])))
 
-        for agent in self.embeddings:
-            raw = self.model.similarity(embedded_prompt, self.embeddings[agent])
-            similarities[agent] = sum(raw) / len(raw)
+    def score(self, prompt: str):
+        """
+        Returns a dictionary mapping each agent to its score for the given
+        prompt, as computed by the configured score function.
 
-        return similarities
+        Args:
+            prompt: The prompt to score the agents against.
+        """
+        query  = self.encode([prompt])
+        scores = self._score_matrix(query)[0]
+        return dict(zip(self.agents, scores.tolist()))
 
     def get_agent(
         self,
@@ -60,4 +744,258 @@ class SBERTAgentRec:
         Args:
             prompt: The prompt to generate a recommendation from.
         """
-        similarities = self.transform(prompt)
+        return self.recommend_batch([prompt], k=1)[0][0][0]
+
+    def recommend_batch(
+        self,
+        prompts: list[str],
+        k: int = 1,
+        batch_size: int = BATCH_SIZE,
+    ):
+        """
+        Returns the top-k agent recommendations for each of the given prompts.
+        All prompts are encoded together and compared against the corpora of
+        every agent with a single matrix multiplication, which is much faster
+        than calling `get_agent` once per prompt.
+
+        Args:
+            prompts: A list of prompts to generate recommendations for.
+            k: The number of agents to recommend per prompt. Defaults to `1`.
+            batch_size: The batch size used when encoding the prompts.
+                        Defaults to `32`.
+
+        Returns:
+            A list with one entry per prompt, each being a list of up to `k`
+            `(agent_name, score)` tuples sorted from best to worst.
+        """
+        if len(self.agents) == 0:
+            raise ValueError("The classifier must be fitted or loaded before "
+                             "recommending agents")
+
+        with self._timer("recommend", len(prompts)):
+            if len(prompts) == 0:
+                return []
+
+            if self.query_cache is None:
+                return self._recommend(prompts, k, batch_size)
+
+            # The score function itself is part of the key, since lambdas and
+            # closures share their names
+            config = (
+                "recommendation",
+                self._corpus_version(),
+                self.score_function,
+                self.p,
+                self.top_n if self.index is not None else None,
+                k,
+            )
+            keys = [config + (normalize_prompt(prompt),) for prompt in prompts]
+            recommendations = [self.query_cache.get(key) for key in keys]
+
+            missing = {}
+            for i, recommendation in enumerate(recommendations):
+                if recommendation is None:
+                    missing.setdefault(keys[i], []).append(i)
+
+            if len(missing) > 0:
+                first = [indices[0] for indices in missing.values()]
+                computed = self._recommend([prompts[i] for i in first], k, batch_size)
+                for key, recommendation in zip(missing, computed):
+                    self.query_cache.put(key, recommendation)
+                    for i in missing[key]:
+                        recommendations[i] = recommendation
+
+            return [list(recommendation) for recommendation in recommendations]
+
+    def _recommend(self, prompts: list[str], k: int, batch_size: int):
+        queries = self.encode(prompts, batch_size)
+        scores = self._score_matrix(queries)
+
+        with self._timer("top_k", len(prompts)):
+            indices = top_k(scores, k)
+
+        return [
+            [(self.agents[i], float(scores[row, i])) for i in indices]
+            for row, indices in enumerate(indices)
+        ]
+
+    def _timer(self, stage: str, items: int = 1):
+        """
+        Returns a context manager which records the time spent in a stage if
+        there are metrics, and an empty context otherwise.
+        """
+        if self.metrics is None:
+            return NULL_TIMER
+
+        return self.metrics.time(stage, items)
+
+    def _embed(self, prompts: list[str], batch_size: int = BATCH_SIZE):
+        """
+        Encodes prompts with the encoder. The first call after loading
+        precomputed embeddings checks that the encoder matches them.
+        """
+        if self._unverified:
+            if str(self.encoder.fingerprint()) != self._fingerprint:
+                raise ValueError("The precomputed embeddings were not computed "
+                                 "by this encoder")
+
+            self._unverified = False
+            self._fingerprint = None
+
+        return np.asarray(self.encoder.encode_batch(list(prompts), batch_size),
+                          dtype=np.float32)
+
+    def encode(self, prompts: list[str], batch_size: int = BATCH_SIZE):
+        """
+        Returns the normalized embeddings of the given prompts as a 2D array,
+        which can be compared to the rows of `embeddings`. If there is a query
+        cache, then only the prompts which are not cached are encoded.
+
+        Args:
+            prompts: The prompts to encode.
+            batch_size: The batch size used by the encoder. Defaults to `32`.
+        """
+        if self.query_cache is None:
+            with self._timer("encode", len(prompts)):
+                return self._embed(prompts, batch_size)
+
+        fingerprint = self.fingerprint()
+        keys = [("embedding", fingerprint, normalize_prompt(prompt)) for prompt in prompts]
+        embeddings = [self.query_cache.get(key) for key in keys]
+
+        missing = {}
+        for i, embedding in enumerate(embeddings):
+            if embedding is None:
+                missing.setdefault(keys[i], []).append(i)
+
+        if len(missing) > 0:
+            first = [indices[0] for indices in missing.values()]
+            with self._timer("encode", len(first)):
+                encoded = self._embed([prompts[i] for i in first], batch_size)
+            for key, embedding in zip(missing, encoded):
+                self.query_cache.put(key, embedding)
+                for i in missing[key]:
+                    embeddings[i] = embedding
+
+        return np.stack(embeddings)
+
+    def _score_matrix(self, queries: np.ndarray, exact: bool = False):
+        """
+        Returns a `(len(queries), len(agents))` matrix of agent scores for the
+        given normalized query embeddings. The similarities against the whole
+        corpus are computed with one matrix multiplication and then reduced
+        per agent segment. If there is an index and `exact` is `False`, then
+        only the candidates retrieved from the index are reduced instead.
+        """
+        offsets = self.offsets
+        weights = self.weights
+
+        with self._timer("similarity", len(queries)):
+            if self.index is not None and not exact:
+                similarities, ids = self.index.search(queries, self.top_n)
+                offsets = None
+            elif self.quantization == "binary" and not exact:
+                similarities, ids = self._prefilter(queries)
+                offsets = None
+            else:
+                similarities = self._similarities(queries)
+
+            # Candidates are gathered per agent, so their weights are too,
+            # and missing candidates are left out by a weight of zero
+            found = None
+            if offsets is None:
+                found = ids >= 0
+                if weights is not None:
+                    weights = np.where(found, weights[ids], 0.0)
+                elif not np.all(found):
+                    weights = found.astype(np.float64)
+
+        with self._timer("reduce", len(queries)):
+            if found is None:
+                return self.reduce(similarities, offsets, weights)
+
+            # Agents without any candidates cannot be scored
+            with np.errstate(divide="ignore", invalid="ignore"):
+                scores = self.reduce(similarities, offsets, weights)
+
+            return np.where(np.any(found, axis=-1), scores, -np.inf)
+
+    def _similarities(self, queries: np.ndarray):
+        """
+        Returns the similarities between the queries and every corpus row.
+        """
+        if isinstance(self.embeddings, QuantizedEmbeddings):
+            return self.embeddings.dot(queries)
+
+        return queries @ self.embeddings.T
+
+    def _prefilter(self, queries: np.ndarray):
+        """
+        Selects the `top_n` prompts of every agent of a binary corpus with the
+        smallest Hamming distances to each query, and returns their floating
+        point similarities along with their row ids in the same layout as
+        `IVFIndex.search`, including its padding. The similarities are taken
+        from the rescoring copy if there is one.
+        """
+        # The Hamming distances are computed and selected for a block of
+        # queries at a time, so at most `BLOCK_SIZE * 256` distances are held
+        # at once, and the candidates are gathered for smaller blocks, so at
+        # most `BLOCK_SIZE` rows are dequantized at once
+        source = self._full_precision()
+        ids    = np.empty((len(queries), len(self.agents), self.top_n), dtype=np.int64)
+        values = np.empty(ids.shape, dtype=np.float32)
+        rows   = max(1, BLOCK_SIZE * 256 // len(self.embeddings))
+        step   = max(1, BLOCK_SIZE // (len(self.agents) * self.top_n))
+        for start in range(0, len(queries), rows):
+            ids[start:start+rows] = nearest_per_segment(
+                self.embeddings.hamming(queries[start:start+rows]),
+                self.offsets,
+                self.top_n,
+            )
+
+        for start in range(0, len(queries), step):
+            block = ids[start:start+step]
+            candidates = source[np.maximum(block, 0).ravel()]
+            candidates = candidates.reshape(block.shape + (-1,))
+            values[start:start+step] = np.where(
+                block >= 0,
+                np.einsum("qand,qd->qan", candidates, queries[start:start+step]),
+                -1.0,
+            )
+
+        return values, ids
+
+    def reduce(
+        self,
+        similarities: np.ndarray,
+        offsets: Optional[np.ndarray] = None,
+        weights: Optional[np.ndarray] = None,
+        score_function: Optional[Callable] = None,
+        p: Optional[float] = None,
+    ):
+        """
+        Reduces similarities into agent scores with the configured score
+        function and power. The prototype weights are only passed when they
+        are given, so that custom score functions without a `weights`
+        argument keep working on full corpora. The weights which only mask
+        missing candidates are dropped for such functions.
+
+        Args:
+            similarities: The similarities between queries and corpus rows,
+                          with the rows along the last axis.
+            offsets: The first row of every agent segment. If it is `None`,
+                     then the last axis is reduced as a single segment.
+            weights: The optional weight of every row. Defaults to `None`.
+            score_function: The score function used instead of the configured
+                            one. Defaults to `None`.
+            p: The power used instead of the configured one. Defaults to
+               `None`.
+        """
+        score_function = score_function if score_function is not None else self.score_function
+        p = p if p is not None else self.p
+
+        if weights is None or \
+           (self.weights is None and not accepts_weights(score_function)):
+            return score_function(similarities, p=p, offsets=offsets)
+
+        return score_function(similarities, p=p, offsets=offsets, weights=weights)
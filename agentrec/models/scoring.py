@@ -0,0 +1,259 @@
+import numpy as np
+
+from typing import Callable, Optional
+import inspect
+
+PMEAN = 200
+EPSILON = 1e-12
+
+SCORE_FUNCTIONS: dict[str, Callable] = {}
+POWERLESS: set[Callable] = set()
+
+def register(name: str, power: bool = True):
+    """
+    A decorator which registers a score function under the given name so that
+    it can be selected by name, e.g. through `SBERTAgentRec(score_function=...)`.
+
+    A score function receives an array of cosine similarities whose last axis
+    holds the comparisons against the capability corpora, and returns an array
+    with that axis reduced. If `offsets` is given, the last axis is treated as
+    consecutive agent segments starting at each offset and one score is
+    returned per segment. Otherwise the whole last axis is a single segment.
+
+    Score functions may also accept `weights`, an array broadcastable to the
+    similarities which counts each comparison as that many prompts. It is
+    passed when the corpus has been compressed into weighted prototypes, and
+    when candidates retrieved by an index are missing, whose weight is zero.
+
+    Args:
+        name: The name which the score function is registered under.
+        power: Whether the score function depends on the power `p`. Sweeps
+               over `p` evaluate functions which ignore it only once.
+               Defaults to `True`.
+    """
+    def decorator(fn: Callable):
+        SCORE_FUNCTIONS[name] = fn
+        if not power:
+            POWERLESS.add(fn)
+        return fn
+
+    return decorator
+
+def get_score_function(name: str | Callable):
+    """
+    Returns the score function registered under `name`. Callables are returned
+    as-is so that custom reducers can be passed wherever a name is accepted.
+
+    Args:
+        name: The name of a registered score function or a callable.
+    """
+    if callable(name):
+        return name
+
+    if name not in SCORE_FUNCTIONS:
+        raise ValueError(f"Invalid score function {name!r}, expected one of "
+                         f"{sorted(SCORE_FUNCTIONS)}")
+
+    return SCORE_FUNCTIONS[name]
+
+def accepts_weights(fn: Callable):
+    """
+    Returns whether a score function accepts the `weights` argument.
+    """
+    try:
+        parameters = inspect.signature(fn).parameters.values()
+    except (TypeError, ValueError):
+        return False
+
+    return any(parameter.name == "weights" or parameter.kind == parameter.VAR_KEYWORD
+               for parameter in parameters)
+
+def uses_power(fn: Callable):
+    """
+    Returns whether a score function depends on the power `p`. Custom score
+    functions are assumed to.
+    """
+    return fn not in POWERLESS
+
+def segment_reduce(
+    ufunc: np.ufunc,
+    x: np.ndarray,
+    offsets: Optional[np.ndarray] = None,
+):
+    """
+    Reduces the last axis of `x` with `ufunc`, either as a whole or once per
+    segment starting at each of `offsets`. Segments must not be empty.
+    """
+    if offsets is None:
+        return ufunc.reduce(x, axis=-1)
+
+    return ufunc.reduceat(x, offsets, axis=-1)
+
+def segment_sizes(x: np.ndarray, offsets: Optional[np.ndarray] = None):
+    """
+    Returns the number of elements in each segment of the last axis of `x`.
+    """
+    if offsets is None:
+        return np.shape(x)[-1]
+
+    return np.diff(offsets, append=np.shape(x)[-1])
+
+def _expand(values: np.ndarray, x: np.ndarray, offsets: Optional[np.ndarray]):
+    """
+    Broadcasts one value per segment back onto every element of its segment.
+    """
+    if offsets is None:
+        return values[..., None]
+
+    return np.repeat(values, segment_sizes(x, offsets), axis=-1)
+
+def logsumexp(x: np.ndarray, offsets: Optional[np.ndarray] = None):
+    """
+    Computes `log(sum(exp(x)))` over the last axis (or each of its segments)
+    without overflow or underflow by factoring out the largest element.
+    """
+    peak = segment_reduce(np.maximum, x, offsets)
+    peak = np.where(np.isfinite(peak), peak, 0.0)
+    with np.errstate(divide="ignore"):
+        total = np.log(segment_reduce(np.add,
+                                      np.exp(x - _expand(peak, x, offsets)),
+                                      offsets))
+    return total + peak
+
+def segment_weights(
+    x: np.ndarray,
+    weights: Optional[np.ndarray] = None,
+    offsets: Optional[np.ndarray] = None,
+):
+    """
+    Returns the total weight of each segment of the last axis of `x`, which
+    is its number of elements if there are no weights.
+    """
+    if weights is None:
+        return segment_sizes(x, offsets)
+
+    weights = np.broadcast_to(np.asarray(weights, dtype=np.float64),
+                              np.shape(weights)[:-1] + np.shape(x)[-1:])
+    return segment_reduce(np.add, weights, offsets)
+
+def _log_weights(weights: Optional[np.ndarray]):
+    if weights is None:
+        return 0.0
+
+    with np.errstate(divide="ignore"):
+        return np.log(np.asarray(weights, dtype=np.float64))
+
+def _log_abs(similarities: np.ndarray):
+    with np.errstate(divide="ignore"):
+        return np.log(np.abs(np.asarray(similarities, dtype=np.float64)))
+
+@register("arithmetic_mean", power=False)
+def arithmetic_mean(
+    similarities: np.ndarray,
+    p: float = PMEAN,
+    offsets: Optional[np.ndarray] = None,
+    weights: Optional[np.ndarray] = None,
+):
+    """
+    The arithmetic mean of all similarities.
+    """
+    similarities = np.asarray(similarities, dtype=np.float64)
+    weighted = similarities * weights if weights is not None else similarities
+    return segment_reduce(np.add, weighted, offsets) / \
+           segment_weights(similarities, weights, offsets)
+
+@register("geometric_mean", power=False)
+def geometric_mean(
+    similarities: np.ndarray,
+    p: float = PMEAN,
+    offsets: Optional[np.ndarray] = None,
+    weights: Optional[np.ndarray] = None,
+):
+    """
+    The geometric mean of all similarities, computed as the exponent of the
+    mean log similarity. Non-positive similarities are clamped to `EPSILON` so
+    that the result stays real.
+    """
+    clamped = np.clip(np.asarray(similarities, dtype=np.float64), EPSILON, None)
+    return np.exp(arithmetic_mean(np.log(clamped), offsets=offsets, weights=weights))
+
+@register("pmean")
+def pmean(
+    similarities: np.ndarray,
+    p: float = PMEAN,
+    offsets: Optional[np.ndarray] = None,
+    weights: Optional[np.ndarray] = None,
+):
+    """
+    The power mean `(mean(|s| ** p)) ** (1 / p)` of all similarities. This is
+    evaluated in log space, so large values of `p` do not underflow.
+    """
+    return np.exp(log_pmean(similarities, p=p, offsets=offsets, weights=weights))
+
+@register("weighted_pmean")
+def weighted_pmean(
+    similarities: np.ndarray,
+    p: float = PMEAN,
+    offsets: Optional[np.ndarray] = None,
+    weights: Optional[np.ndarray] = None,
+):
+    """
+    The mean of `|s| ** p` where each similarity is weighted by
+    `1 / (1 - |s|)`, so that near-identical prompts dominate the score.
+    """
+    log_s = _log_abs(similarities)
+    log_w = -np.log(np.clip(1 - np.exp(log_s), EPSILON, None)) + \
+            _log_weights(weights)
+    return np.exp(logsumexp(log_w + p * log_s, offsets) -
+                  logsumexp(log_w, offsets))
+
+@register("max", power=False)
+def maximum(
+    similarities: np.ndarray,
+    p: float = PMEAN,
+    offsets: Optional[np.ndarray] = None,
+    weights: Optional[np.ndarray] = None,
+):
+    """
+    The largest similarity, i.e. the nearest capability prompt. Weights do not
+    change the largest similarity and are ignored.
+    """
+    return segment_reduce(np.maximum, np.asarray(similarities), offsets)
+
+@register("log_pmean")
+def log_pmean(
+    similarities: np.ndarray,
+    p: float = PMEAN,
+    offsets: Optional[np.ndarray] = None,
+    weights: Optional[np.ndarray] = None,
+):
+    """
+    The logarithm of the power mean, `(log(sum(|s| ** p)) - log(n)) / p`,
+    computed with a numerically stable log-sum-exp. This ranks agents the same
+    way as `pmean`.
+    """
+    log_s = _log_abs(similarities)
+    n = segment_weights(log_s, weights, offsets)
+    return (logsumexp(p * log_s + _log_weights(weights), offsets) - np.log(n)) / p
+
+def top_k(scores: np.ndarray, k: int):
+    """
+    Returns the column indices of the `k` largest scores of every row, sorted
+    from best to worst. Only the selected columns are sorted, so this costs
+    `O(n + k log k)` per row rather than a full sort.
+
+    Args:
+        scores: A 2D array of scores with one row per prompt.
+        k: The number of indices to return per row.
+    """
+    scores = np.asarray(scores)
+    k = min(k, scores.shape[-1])
+    if k < scores.shape[-1]:
+        candidates = np.argpartition(-scores, k - 1, axis=-1)[..., :k]
+    else:
+        candidates = np.broadcast_to(np.arange(k), scores.shape).copy()
+
+    order = np.argsort(-np.take_along_axis(scores, candidates, axis=-1),
+                       axis=-1,
+                       kind="stable")
+    return np.take_along_axis(candidates, order, axis=-1)
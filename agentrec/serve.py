@@ -0,0 +1,470 @@
+"""
+An asyncio HTTP/JSON server for agent recommendations. Incoming prompts are
+queued and flushed to an `SBERTAgentRec` in micro-batches, which lets the
+encoder process many concurrent requests with one forward pass.
+
+Endpoints:
+    POST /recommend: Accepts `{"prompt": str, "k": int}` or
+                     `{"prompts": list[str], "k": int}` and returns
+                     `{"recommendations": [[{"agent": str, "score": float}]]}`
+                     with one list per prompt.
+    GET /health: Returns `{"status": "ok"}`.
+    GET /metrics: Returns the batching and latency statistics, along with the
+                  per-stage metrics of the classifier if it has a `Metrics`.
+                  With `?format=prometheus`, the per-stage metrics are
+                  returned in the Prometheus text format instead.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from typing import Any, Optional
+import argparse
+import asyncio
+import json
+import time
+
+HOST = "127.0.0.1"
+PORT = 8000
+MAX_BATCH_SIZE = 64
+MAX_WAIT = 0.005
+MAX_QUEUE_SIZE = 4096
+MAX_BODY_SIZE = 1 << 20
+LATENCY_WINDOW = 10000
+
+REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+def percentile(values: list[float], q: float):
+    """
+    Returns the `q`-th percentile of `values` by the nearest-rank method, or
+    `0` if there are no values.
+    """
+    if len(values) == 0:
+        return 0.0
+
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+class MicroBatcher:
+    """
+    Queues prompts and flushes them to a classifier in batches. A batch is
+    flushed as soon as it holds `max_batch_size` prompts or `max_wait`
+    seconds after its first prompt arrived, whichever happens first. Larger
+    batches improve throughput while a shorter wait lowers the latency of
+    lightly loaded servers.
+
+    Batches are recommended in a single worker thread so that the event loop
+    stays responsive while the encoder runs.
+
+    Args:
+        classifier: A fitted `SBERTAgentRec`.
+        max_batch_size: The maximum number of prompts per batch. Defaults to
+                        `64`.
+        max_wait: The maximum number of seconds a prompt waits for its batch
+                  to fill up. Defaults to `0.005`.
+        max_queue_size: The maximum number of queued prompts. Once it is
+                        reached, `submit` and `submit_batch` raise
+                        `asyncio.QueueFull`.
+                        Defaults to `4096`.
+    """
+    def __init__(
+        self,
+        classifier: Any,
+        max_batch_size: int = MAX_BATCH_SIZE,
+        max_wait: float = MAX_WAIT,
+        max_queue_size: int = MAX_QUEUE_SIZE,
+    ):
+        self.classifier = classifier
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.queue = asyncio.Queue(maxsize=max_queue_size)
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+        self.batches = 0
+        self.prompts = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self._task = None
+
+    def start(self):
+        """
+        Starts flushing batches on the running event loop.
+        """
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """
+        Stops flushing batches and shuts down the worker thread.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        self.executor.shutdown(wait=False)
+
+    async def submit(self, prompt: str, k: int = 1):
+        """
+        Queues a prompt and waits for its top-k recommendations.
+
+        Args:
+            prompt: The prompt to generate recommendations for.
+            k: The number of agents to recommend. Defaults to `1`.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((prompt, k, future, time.perf_counter()))
+        return await future
+
+    async def submit_batch(self, prompts: list[str], k: int = 1):
+        """
+        Queues several prompts and waits for their top-k recommendations. The
+        prompts are either all queued or, if the queue cannot hold all of
+        them, none are and `asyncio.QueueFull` is raised.
+
+        Args:
+            prompts: The prompts to generate recommendations for.
+            k: The number of agents to recommend per prompt. Defaults to `1`.
+        """
+        if self.queue.maxsize > 0 and \
+           self.queue.qsize() + len(prompts) > self.queue.maxsize:
+            raise asyncio.QueueFull
+
+        loop    = asyncio.get_running_loop()
+        start   = time.perf_counter()
+        futures = [loop.create_future() for _ in prompts]
+        for prompt, future in zip(prompts, futures):
+            self.queue.put_nowait((prompt, k, future, start))
+
+        return await asyncio.gather(*futures)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # Also take whatever else arrived while waiting, up to the limit
+            while len(batch) < self.max_batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+
+            await self._flush(batch)
+
+    async def _flush(self, batch: list[tuple]):
+        prompts = [prompt for prompt, _, _, _ in batch]
+        k = max(k for _, k, _, _ in batch)
+
+        try:
+            recommendations = await asyncio.get_running_loop().run_in_executor(
+                self.executor,
+                self.classifier.recommend_batch,
+                prompts,
+                k,
+            )
+        except Exception as e:
+            for _, _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        now = time.perf_counter()
+        self.batches += 1
+        self.prompts += len(batch)
+        for (_, k, future, start), recommendation in zip(batch, recommendations):
+            self.latencies.append(now - start)
+            if not future.done():
+                future.set_result(recommendation[:k])
+
+    def stats(self):
+        """
+        Returns a dictionary of batching counters and the p50/p99 latency in
+        seconds over the most recent prompts.
+        """
+        latencies = list(self.latencies)
+        return {
+            "batches": self.batches,
+            "prompts": self.prompts,
+            "mean_batch_size": self.prompts / self.batches if self.batches > 0 else 0.0,
+            "queued": self.queue.qsize(),
+            "latency_p50": percentile(latencies, 50),
+            "latency_p99": percentile(latencies, 99),
+        }
+
+class RecommendationServer:
+    """
+    A minimal HTTP/1.1 server which routes recommendation requests through a
+    `MicroBatcher`. Only the standard library is used, so no web framework is
+    required.
+
+    Args:
+        classifier: A fitted `SBERTAgentRec`.
+        host: The host to listen on. Defaults to `"127.0.0.1"`.
+        port: The port to listen on. Defaults to `8000`.
+        max_batch_size: See `MicroBatcher`.
+        max_wait: See `MicroBatcher`.
+        max_queue_size: See `MicroBatcher`.
+    """
+    def __init__(
+        self,
+        classifier: Any,
+        host: str = HOST,
+        port: int = PORT,
+        max_batch_size: int = MAX_BATCH_SIZE,
+        max_wait: float = MAX_WAIT,
+        max_queue_size: int = MAX_QUEUE_SIZE,
+    ):
+        self.classifier = classifier
+        self.host = host
+        self.port = port
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.max_queue_size = max_queue_size
+        self.batcher = None
+        self.server = None
+
+    async def start(self):
+        """
+        Starts the batcher and begins accepting connections.
+        """
+        self.batcher = MicroBatcher(self.classifier,
+                                    max_batch_size=self.max_batch_size,
+                                    max_wait=self.max_wait,
+                                    max_queue_size=self.max_queue_size)
+        self.batcher.start()
+        self.server = await asyncio.start_server(self._handle, self.host, self.port)
+
+    async def stop(self):
+        """
+        Stops accepting connections and shuts down the batcher.
+        """
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+
+        if self.batcher is not None:
+            await self.batcher.stop()
+
+    async def serve_forever(self):
+        """
+        Starts the server and serves until it is cancelled.
+        """
+        await self.start()
+        try:
+            await self.server.serve_forever()
+        finally:
+            await self.stop()
+
+    async def _handle(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+    ):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+
+                try:
+                    method, path, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    await self._respond(writer, 400, {"error": "Malformed request"}, False)
+                    break
+
+                headers = {}
+                while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                keep_alive = headers.get("connection", "").lower() != "close" and \
+                             version == "HTTP/1.1"
+                try:
+                    length = int(headers.get("content-length", 0))
+                    if length < 0:
+                        raise ValueError(length)
+                except ValueError:
+                    await self._respond(writer, 400, {"error": "Invalid Content-Length"}, False)
+                    break
+
+                if length > MAX_BODY_SIZE:
+                    await self._respond(writer, 413, {"error": "Body too large"}, False)
+                    break
+
+                body = await reader.readexactly(length) if length > 0 else b""
+                status, payload = await self._route(method, path, body)
+                await self._respond(writer, status, payload, keep_alive)
+
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _route(self, method: str, path: str, body: bytes):
+        path, _, query = path.partition("?")
+
+        if path == "/health":
+            return 200, {"status": "ok"}
+
+        if path == "/metrics":
+            metrics = getattr(self.classifier, "metrics", None)
+            if "format=prometheus" in query.split("&"):
+                return 200, metrics.to_prometheus() if metrics is not None else ""
+
+            stats = self.batcher.stats()
+            if metrics is not None:
+                stats["stages"] = metrics.to_dict()
+
+            return 200, stats
+
+        if path != "/recommend":
+            return 404, {"error": f"Unknown path {path}"}
+
+        if method != "POST":
+            return 405, {"error": "Only POST is supported"}
+
+        try:
+            request = json.loads(body)
+            k = request.get("k", 1)
+            if isinstance(k, bool) or not isinstance(k, int) or k < 1:
+                raise ValueError("k must be a positive integer")
+
+            if "prompts" in request:
+                prompts = request["prompts"]
+            else:
+                prompts = [request["prompt"]]
+
+            if not isinstance(prompts, list):
+                raise ValueError("Prompts must be a list")
+
+            if not all(isinstance(prompt, str) for prompt in prompts):
+                raise ValueError("Prompts must be strings")
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            return 400, {"error": f"Invalid request: {e}"}
+
+        try:
+            results = await self.batcher.submit_batch(prompts, k)
+        except asyncio.QueueFull:
+            return 503, {"error": "Too many queued prompts"}
+        except Exception as e:
+            return 500, {"error": str(e)}
+
+        return 200, {
+            "recommendations": [
+                [{"agent": agent, "score": score} for agent, score in result]
+                for result in results
+            ]
+        }
+
+    async def _respond(
+        self,
+        writer: asyncio.StreamWriter,
+        status: int,
+        payload: dict | str,
+        keep_alive: bool,
+    ):
+        if isinstance(payload, str):
+            body = payload.encode()
+            content_type = "text/plain; version=0.0.4"
+        else:
+            body = json.dumps(payload).encode()
+            content_type = "application/json"
+
+        head = f"HTTP/1.1 {status} {REASONS[status]}\r\n" \
+               f"Content-Type: {content_type}\r\n" \
+               f"Content-Length: {len(body)}\r\n" \
+               f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        writer.write(head.encode() + body)
+        await writer.drain()
+
+def serve(
+    classifier: Any,
+    host: str = HOST,
+    port: int = PORT,
+    max_batch_size: int = MAX_BATCH_SIZE,
+    max_wait: float = MAX_WAIT,
+    max_queue_size: int = MAX_QUEUE_SIZE,
+):
+    """
+    Serves recommendations from a fitted `SBERTAgentRec` until interrupted.
+    See `RecommendationServer` for the arguments.
+    """
+    server = RecommendationServer(classifier,
+                                  host=host,
+                                  port=port,
+                                  max_batch_size=max_batch_size,
+                                  max_wait=max_wait,
+                                  max_queue_size=max_queue_size)
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+def main(argv: Optional[list[str]] = None):
+    from agentrec.datasets import PromptPool
+    from agentrec.models import Metrics, SBERTAgentRec
+
+    parser = argparse.ArgumentParser(description="Serve agent recommendations")
+    parser.add_argument("--model", default="all-mpnet-base-v2")
+    parser.add_argument("--prompts", default="./data/train.jsonl")
+    parser.add_argument("--agents", default="./data/agents.jsonl")
+    parser.add_argument("--cache-dir", default=None)
+    parser.add_argument("--score-function", default="log_pmean")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--max-batch-size", type=int, default=MAX_BATCH_SIZE)
+    parser.add_argument("--max-wait", type=float, default=MAX_WAIT)
+    parser.add_argument("--max-queue-size", type=int, default=MAX_QUEUE_SIZE)
+    parser.add_argument("--metrics", action="store_true",
+                        help="Record per-stage latency metrics")
+    parser.add_argument("--precomputed", action="store_true",
+                        help="Serve the corpus cached in --cache-dir and load "
+                             "the model on the first query")
+    args = parser.parse_args(argv)
+
+    if args.precomputed and args.cache_dir is None:
+        parser.error("--precomputed requires --cache-dir")
+
+    options = {
+        "score_function": args.score_function,
+        "cache_dir": args.cache_dir,
+        "metrics": Metrics() if args.metrics else None,
+    }
+
+    if args.precomputed:
+        classifier = SBERTAgentRec.precomputed(args.model, **options)
+    else:
+        classifier = SBERTAgentRec(args.model, **options)
+        pool = PromptPool()
+        pool.load(path=args.prompts, agent_path=args.agents)
+        classifier.fit(pool.pool)
+
+    print(f"[AgentRec] Serving on http://{args.host}:{args.port}")
+    serve(classifier,
+          host=args.host,
+          port=args.port,
+          max_batch_size=args.max_batch_size,
+          max_wait=args.max_wait,
+          max_queue_size=args.max_queue_size)
+
+if __name__ == "__main__":
+    main()
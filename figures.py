@@ -18,6 +18,7 @@ BASE_MODEL_ID = "all-mpnet-base-v2"
 FILENAME_FORMAT = "./figures/test{dim}d.png"
 PROMPT_PATH = "./data/test.jsonl"
 AGENTS_PATH = "./data/agents.jsonl"
+CACHE_DIR = "./cache/figures/{name}/"
 
 def embed_pca(x, dim=2):
     scaler = StandardScaler()
@@ -29,20 +30,8 @@ def embed_pca(x, dim=2):
     pca.fit(x)
     return pca.transform(x)
 
-def separate(embeddings):
-    x = []
-    y = []
-    label_map = []
-
-    for agent in embeddings:
-        if agent not in label_map:
-            label_map.append(agent)
-
-        for prompt in embeddings[agent]:
-            x.append(prompt)
-            y.append(label_map.index(agent))
-
-    return np.array(x), np.array(y), label_map
+def separate(classifier):
+    return classifier.embeddings, classifier.labels, classifier.agents
 
 def plot3d(x, y, label_map, filename, s=2):
     fig  = plt.figure()
@@ -94,13 +83,15 @@ def main():
               agent_path=AGENTS_PATH)
     pool.shuffle(SHUFFLE_SEED)
 
-    classifier = SBERTAgentRec(MODEL_ID)
-    base_classifier = SBERTAgentRec(BASE_MODEL_ID)
+    classifier = SBERTAgentRec(MODEL_ID,
+                               cache_dir=CACHE_DIR.format(name="test"))
+    base_classifier = SBERTAgentRec(BASE_MODEL_ID,
+                                    cache_dir=CACHE_DIR.format(name="base"))
     classifier.fit(pool.pool)
     base_classifier.fit(pool.pool)
 
-    x, y, labels = separate(classifier.embeddings)
-    base_x, base_y, base_labels = separate(base_classifier.embeddings)
+    x, y, labels = separate(classifier)
+    base_x, base_y, base_labels = separate(base_classifier)
 
     plot2d(embed_pca(x, dim=2), y, labels, "./figures/pcatest2d.png")
     plot3d(embed_pca(x, dim=3), y, labels, "./figures/pcatest3d.png")
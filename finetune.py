@@ -4,45 +4,66 @@ from datasets import Dataset
 from sentence_transformers import SentenceTransformerTrainer, SentenceTransformerTrainingArguments
 from sentence_transformers.losses import BatchAllTripletLoss
 
+import hashlib
+
 AGENT_FILE = "./data/agents.jsonl"
 PROMPT_FILE = "./data/prompts.jsonl"
+TRAIN_FILE = "./data/train.jsonl"
+TEST_FILE = "./data/test.jsonl"
 OUTPUT_DIR = "./models/test_model/"
 BASE_MODEL_ID = "all-mpnet-base-v2"
 SHUFFLE_SEED = 42
 
+def file_digest(path: str):
+    """
+    Returns the SHA-256 hex digest of the contents of a file.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+def samples(path: str, agents: list[str], digest: str):
+    """
+    Yields the finetuning samples of a prompt file one at a time.
+
+    `Dataset.from_generator` caches the generated dataset under a hash of the
+    generator and its `gen_kwargs`, not of the file which the generator
+    reads. Passing the digest of the file contents as an argument therefore
+    makes a changed file produce a new dataset instead of the cached one,
+    while an unchanged file keeps hitting the cache.
+
+    Args:
+        path: The prompt file to read.
+        agents: The agent names, whose indices are the labels.
+        digest: The `file_digest` of `path`. It is not read by the generator.
+    """
+    for item in PromptPool.stream(path):
+        yield {
+            "sentence": item["prompt"],
+            "label": agents.index(item["agent_name"]),
+        }
+
 def main():
     pool = PromptPool()
     pool.load(PROMPT_FILE, AGENT_FILE)
     pool.shuffle(SHUFFLE_SEED)
 
     pool.save_split(
-        train_path="./data/train.jsonl",
-        test_path="./data/test.jsonl",
+        train_path=TRAIN_FILE,
+        test_path=TEST_FILE,
     )
 
-    pool = PromptPool()
-    pool.load("./data/train.jsonl", AGENT_FILE)
-
-    label_map = []
-
-    data = {
-        "sentence": [],
-        "label": [],
-    }
-
-    for item in pool.pool:
-        data["sentence"].append(item["prompt"])
-
-        label = None
-        if item["agent_name"] in label_map:
-            label = label_map.index(item["agent_name"])
-        else:
-            label = len(label_map)
-            label_map.append(item["agent_name"])
-
-        data["label"].append(label)
+    agents = [agent.name for agent in pool.agents]
+    del pool
 
-    train_dataset = Dataset.from_dict(data)
+    train_dataset = Dataset.from_generator(samples, gen_kwargs={
+        "path": TRAIN_FILE,
+        "agents": agents,
+        "digest": file_digest(TRAIN_FILE),
+    })
     model = SBERTAgentRec(BASE_MODEL_ID)
     loss = BatchAllTripletLoss(model.model)
     args = SentenceTransformerTrainingArguments(
@@ -60,14 +60,13 @@ def main():
     pool  = PromptPool()
 
     pool.set(AGENTS)
-    pool.generate(model,
-                  per_agent=1250,
-                  batch_size=50,
-                  store_context=0,
-                  progress=True)
-
-    pool.save(path="./data/prompts.jsonl",
-              agent_path="./data/agents.jsonl")
+    pool.generate_stream(model,
+                         per_agent=1250,
+                         path="./data/prompts.jsonl",
+                         agent_path="./data/agents.jsonl",
+                         batch_size=50,
+                         store_context=0,
+                         progress=True)
 
 if __name__ == "__main__":
     load_dotenv()
@@ -0,0 +1,45 @@
+import numpy as np
+
+from agentrec.models import IVFIndex, SBERTAgentRec
+from agentrec.models.ann import per_agent_top_n
+from agentrec.models.encoders import HashingEncoder
+
+SAMPLES = [
+    {"agent_name": f"agent {i % 3}", "prompt": f"prompt {i} about topic {i % 3}"}
+    for i in range(30)
+]
+
+def test_missing_candidates_are_left_out_of_scores():
+    classifier = SBERTAgentRec(HashingEncoder(),
+                               score_function="arithmetic_mean",
+                               index=IVFIndex(n_cells=4, n_probe=1),
+                               top_n=32)
+    classifier.fit(SAMPLES)
+
+    queries = classifier.encode(["prompt about topic 1", "topic 2"])
+    values, ids = classifier.index.search(queries, classifier.top_n)
+    assert np.any(ids < 0)
+
+    scores = classifier._score_matrix(queries)
+    for query in range(len(queries)):
+        for agent in range(len(classifier.agents)):
+            found = ids[query, agent] >= 0
+            if np.any(found):
+                assert np.isclose(scores[query, agent], values[query, agent][found].mean())
+            else:
+                assert scores[query, agent] == -np.inf
+
+def test_search_matches_exact_top_n_when_probing_every_cell():
+    classifier = SBERTAgentRec(HashingEncoder(), index=IVFIndex(n_cells=4, n_probe=4), top_n=4)
+    classifier.fit(SAMPLES)
+
+    queries = classifier.encode(["prompt about topic 1", "topic 2"])
+    values, ids = classifier.index.search(queries, classifier.top_n)
+    for query in range(len(queries)):
+        similarities = classifier.embeddings @ queries[query]
+        expected, _ = per_agent_top_n(similarities,
+                                      np.arange(len(similarities)),
+                                      classifier.labels,
+                                      len(classifier.agents),
+                                      classifier.top_n)
+        np.testing.assert_allclose(values[query], expected, atol=1e-6)
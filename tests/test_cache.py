@@ -0,0 +1,47 @@
+import numpy as np
+
+from agentrec.models import QueryCache, SBERTAgentRec
+from agentrec.models.encoders import HashingEncoder
+
+SAMPLES = [
+    {"agent_name": f"agent {i % 3}", "prompt": f"prompt {i} about topic {i % 3}"}
+    for i in range(12)
+]
+
+def test_fit_then_save_to_the_same_cache(tmp_path):
+    classifier = SBERTAgentRec(HashingEncoder(), cache_dir=tmp_path)
+    classifier.fit(SAMPLES)
+    classifier.save()
+    classifier.save()
+
+    loaded = SBERTAgentRec(HashingEncoder(), cache_dir=tmp_path)
+    loaded.load()
+    assert loaded.agents == classifier.agents
+    np.testing.assert_array_equal(loaded.embeddings, classifier.embeddings)
+    np.testing.assert_array_equal(loaded.hashes, classifier.hashes)
+
+def test_query_cache_follows_a_changed_encoder():
+    encoder = HashingEncoder(seed=0)
+    classifier = SBERTAgentRec(encoder, query_cache=QueryCache())
+    classifier.fit(SAMPLES)
+    before = classifier.encode(["prompt about topic 1"])
+
+    # Changing the encoder in place, as finetuning does, changes its
+    # fingerprint and therefore the query cache keys
+    encoder.seed = 1
+    after = classifier.encode(["prompt about topic 1"])
+    assert not np.allclose(before, after)
+    np.testing.assert_allclose(after, encoder.encode_batch(["prompt about topic 1"]))
+
+def test_query_cache_separates_score_functions():
+    classifier = SBERTAgentRec(HashingEncoder(), query_cache=QueryCache())
+    classifier.fit(SAMPLES)
+
+    classifier.score_function = lambda similarities, p, offsets: \
+        np.maximum.reduceat(similarities, offsets, axis=1)
+    best = classifier.recommend_batch(["prompt about topic 1"])
+
+    classifier.score_function = lambda similarities, p, offsets: \
+        -np.maximum.reduceat(similarities, offsets, axis=1)
+    worst = classifier.recommend_batch(["prompt about topic 1"])
+    assert best[0][0][0] != worst[0][0][0]
@@ -0,0 +1,42 @@
+import numpy as np
+
+from agentrec.datasets import PromptPool
+from agentrec.models import SBERTAgentRec
+from agentrec.models.cleaning import clean
+from agentrec.models.encoders import HashingEncoder
+
+TRAVEL = [
+    "book a flight to paris tomorrow",
+    "book a flight to paris tomorrow please",
+    "find me a cheap hotel near the station",
+]
+MISC = [
+    "what is the weather in london",
+    "translate this sentence into french",
+    "play some jazz music",
+]
+
+def make_pool(travel: list[str], misc: list[str]):
+    pool = PromptPool()
+    pool.pool = [{"agent_name": "travel", "prompt": prompt} for prompt in travel] + \
+                [{"agent_name": "misc", "prompt": prompt} for prompt in misc]
+    return pool
+
+def test_clean_with_reordered_warm_cache(tmp_path):
+    SBERTAgentRec(HashingEncoder(), cache_dir=tmp_path).fit(make_pool(TRAVEL, MISC).table)
+
+    # The same prompts in a different order within every agent hit the cache
+    pool = make_pool(TRAVEL[::-1], MISC[::-1])
+    classifier = SBERTAgentRec(HashingEncoder(), cache_dir=tmp_path)
+    report = clean(classifier, pool, threshold=0.85)
+
+    # The later paraphrase in pool order is the one removed
+    assert report["duplicates"] == {"travel": 1, "misc": 0}
+    assert pool.agent_prompts("travel") == [TRAVEL[2], TRAVEL[1]]
+    assert pool.agent_prompts("misc") == MISC[::-1]
+
+    expected = SBERTAgentRec(HashingEncoder())
+    expected.fit(pool.table)
+    assert classifier.agents == expected.agents
+    np.testing.assert_allclose(classifier.embeddings, expected.embeddings, atol=1e-6)
+    np.testing.assert_array_equal(classifier.hashes, expected.hashes)
@@ -0,0 +1,26 @@
+from agentrec.eval import evaluate, format_report
+from agentrec.models import SBERTAgentRec
+from agentrec.models.encoders import HashingEncoder
+from agentrec.models.scoring import maximum
+
+SAMPLES = [
+    {"agent_name": f"agent {i % 3}", "prompt": f"prompt {i} about topic {i % 3}"}
+    for i in range(12)
+]
+
+def test_p_is_only_swept_for_functions_which_use_it():
+    classifier = SBERTAgentRec(HashingEncoder())
+    classifier.fit(SAMPLES)
+
+    # Custom score functions do not have to accept weights
+    def best(similarities, p, offsets):
+        return maximum(similarities, offsets=offsets)
+
+    report = evaluate(classifier,
+                      ["prompt about topic 1", "topic 2"],
+                      ["agent 1", "agent 2"],
+                      score_functions=["max", "pmean", best],
+                      p=[1, 10])
+    assert [(result["score_function"], result["p"]) for result in report["results"]] == \
+        [("max", None), ("pmean", 1), ("pmean", 10), ("best", 1), ("best", 10)]
+    assert "max" in format_report(report)
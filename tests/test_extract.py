@@ -0,0 +1,16 @@
+from agentrec.datasets import JSONExtractor
+
+def extract(text: str, size: int):
+    extractor = JSONExtractor()
+    objects = []
+    for start in range(0, len(text), size):
+        objects += extractor.feed(text[start:start+size])
+
+    return objects + extractor.close(), extractor.stats()
+
+def test_close_recovers_objects_after_unclosed_braces():
+    text = 'Use { to open { an object: {"content": "a"} {"content": "b {c}"} {"content": "cut'
+    for size in (1, 3, len(text)):
+        objects, stats = extract(text, size)
+        assert objects == [{"content": "a"}, {"content": "b {c}"}]
+        assert stats["truncated"] == 1
@@ -0,0 +1,10 @@
+from agentrec.bench import IMPORT_TARGETS, import_times
+
+def test_imports_stay_light():
+    # The budget is generous so that slow machines do not fail the test,
+    # while an import of a heavy dependency still does
+    report = import_times(budget=5.0, repeat=1)
+    assert [result["target"] for result in report] == list(IMPORT_TARGETS)
+    for result in report:
+        assert result["heavy_modules"] == [], result["target"]
+        assert result["ok"], result["target"]
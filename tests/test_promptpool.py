@@ -0,0 +1,38 @@
+import pytest
+
+from agentrec.datasets import Agent, PromptPool
+
+class FakeModel:
+    def __call__(self, context: list[dict]):
+        prompts = " ".join('{"agent_name": "x", "content": "prompt %d"}' % i
+                           for i in range(5))
+        return context + [{"role": "assistant", "content": prompts}]
+
+def generate(tmp_path, **kwargs):
+    pool = PromptPool()
+    pool.set([Agent("A"), Agent("B")])
+    pool.generate_stream(FakeModel(),
+                         per_agent=5,
+                         path=tmp_path / "prompts.jsonl",
+                         agent_path=tmp_path / "agents.jsonl",
+                         batch_size=5,
+                         **kwargs)
+
+def test_generate_stream_keeps_file_without_manifest(tmp_path):
+    path = tmp_path / "prompts.jsonl"
+    path.write_text('{"agent_name": "A", "prompt": "handwritten"}\n')
+
+    with pytest.raises(ValueError):
+        generate(tmp_path)
+
+    assert path.read_text() == '{"agent_name": "A", "prompt": "handwritten"}\n'
+    assert not (tmp_path / "agents.jsonl").exists()
+
+    generate(tmp_path, overwrite=True)
+    assert "handwritten" not in path.read_text()
+    assert len(path.read_text().splitlines()) == 10
+
+def test_generate_stream_resumes_from_manifest(tmp_path):
+    generate(tmp_path)
+    generate(tmp_path)
+    assert len((tmp_path / "prompts.jsonl").read_text().splitlines()) == 10
@@ -0,0 +1,17 @@
+import numpy as np
+
+from agentrec.models.quantize import nearest_per_segment
+
+def test_nearest_per_segment_matches_a_full_sort():
+    rng = np.random.default_rng(0)
+    offsets = np.array([0, 2, 9, 9, 20])
+    distances = rng.integers(0, 8, size=(4, 25))
+
+    ids = nearest_per_segment(distances, offsets, 5)
+    assert ids.shape == (4, len(offsets), 5)
+    for query in range(len(distances)):
+        for segment, (start, end) in enumerate(zip(offsets, np.append(offsets[1:], 25))):
+            expected = np.sort(distances[query, start:end])[:5]
+            found = ids[query, segment][ids[query, segment] >= 0]
+            assert np.all((found >= start) & (found < end))
+            np.testing.assert_array_equal(distances[query, found], expected)
@@ -0,0 +1,11 @@
+import pytest
+
+from agentrec.models import SBERTAgentRec
+from agentrec.models.encoders import HashingEncoder
+
+def test_unfitted_classifier_cannot_recommend():
+    classifier = SBERTAgentRec(HashingEncoder())
+    with pytest.raises(ValueError, match="must be fitted"):
+        classifier.get_agent("book a flight to paris")
+    with pytest.raises(ValueError, match="must be fitted"):
+        classifier.recommend_batch(["book a flight to paris"], k=2)
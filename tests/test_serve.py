@@ -0,0 +1,88 @@
+import asyncio
+import json
+
+from agentrec.models import SBERTAgentRec
+from agentrec.models.encoders import HashingEncoder
+from agentrec.serve import MicroBatcher, RecommendationServer
+
+SAMPLES = [
+    {"agent_name": "travel", "prompt": "book a flight to paris"},
+    {"agent_name": "travel", "prompt": "find me a hotel in rome"},
+    {"agent_name": "weather", "prompt": "will it rain in london tomorrow"},
+]
+
+async def request(port: int, body: bytes, length: str):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(f"POST /recommend HTTP/1.1\r\nContent-Length: {length}\r\n"
+                 "Connection: close\r\n\r\n".encode() + body)
+    response = await reader.read()
+    writer.close()
+
+    status = int(response.split(b" ", 2)[1])
+    return status, json.loads(response.split(b"\r\n\r\n", 1)[1])
+
+def fitted():
+    classifier = SBERTAgentRec(HashingEncoder())
+    classifier.fit(SAMPLES)
+    return classifier
+
+def run(requests: list[tuple[bytes, str]], **kwargs):
+    classifier = fitted()
+
+    async def main():
+        server = RecommendationServer(classifier, port=0, max_wait=0.001, **kwargs)
+        await server.start()
+        try:
+            port = server.server.sockets[0].getsockname()[1]
+            return [await request(port, body, length) for body, length in requests]
+        finally:
+            await server.stop()
+
+    return asyncio.run(main())
+
+def make_request(payload: dict):
+    body = json.dumps(payload).encode()
+    return body, str(len(body))
+
+def test_recommend():
+    (status, payload), = run([make_request({"prompts": ["fly to paris"], "k": 2})])
+    assert status == 200
+    assert len(payload["recommendations"][0]) == 2
+
+def test_invalid_requests():
+    responses = run([
+        (b"{}", "abc"),
+        (b"{}", "-1"),
+        make_request({"prompt": "fly to paris", "k": 0}),
+        make_request({"prompt": "fly to paris", "k": -3}),
+        make_request({"prompt": "fly to paris", "k": "2"}),
+        make_request({"prompts": "abc"}),
+    ])
+    assert [status for status, _ in responses] == [400] * len(responses)
+
+def test_request_larger_than_the_queue():
+    responses = run([
+        make_request({"prompts": ["fly to paris", "rain in london", "hotel in rome"]}),
+        make_request({"prompts": ["fly to paris", "rain in london"]}),
+    ], max_queue_size=2)
+    assert [status for status, _ in responses] == [503, 200]
+
+def test_submit_batch_queues_all_prompts_or_none():
+    batcher = MicroBatcher(fitted(), max_queue_size=2)
+
+    async def main():
+        try:
+            await batcher.submit_batch(["fly to paris", "rain in london", "hotel in rome"])
+        except asyncio.QueueFull:
+            pass
+        assert batcher.queue.empty()
+
+        batcher.start()
+        try:
+            return await batcher.submit_batch(["fly to paris", "rain in london"])
+        finally:
+            await batcher.stop()
+
+    results = asyncio.run(main())
+    assert [result[0][0] for result in results] == ["travel", "weather"]
+    assert batcher.prompts == 2